@@ -1,11 +1,54 @@
-from flask import Flask, jsonify, render_template, request, redirect, url_for, session, send_from_directory
+from flask import Flask, Response, jsonify, make_response, render_template, request, redirect, url_for, session, \
+    send_from_directory
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SecureCookieSession, SecureCookieSessionInterface, SessionInterface
 from flask_cors import CORS
+import base64
+import csv
+import heapq
+import io
+import itertools
 import json
 import os
 import datetime
+import functools
+import hashlib
 import logging
+import marshal
+import pickle
+import queue
+import re
+import secrets
+import sqlite3
+import struct
+import sys
+import threading
+import time
+import uuid
+import zlib
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from decimal import Decimal, InvalidOperation
+import click
 from werkzeug.security import check_password_hash, generate_password_hash
-from flask_session import Session
+
+try:
+    from flask_session import Session
+except ImportError:  # backend de sessão "filesystem" indisponível
+    Session = None
+
+try:
+    import fcntl
+except ImportError:  # Windows: apenas bloqueio entre threads do mesmo processo
+    fcntl = None
+
+try:
+    import orjson
+except ImportError:  # JSON acelerado é opcional (codec "orjson")
+    orjson = None
 
 # Configuração de logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -13,22 +56,69 @@ logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 CORS(app)  # Habilita CORS para todas as rotas
-app.secret_key = "cubograf_secret_key"
+# Sessões: "sqlite" (vários workers; padrão), "memoria" (um processo), "filesystem"
+# (Flask-Session, backend anterior) ou "cookie" (assinado, exige CUBO_SECRET_KEY)
+app.config["SESSION_BACKEND"] = os.environ.get("CUBO_SESSION_BACKEND", "sqlite")
+app.config["SESSION_TTL"] = int(os.environ.get("CUBO_SESSION_TTL", str(12 * 3600)))
+app.config["SESSION_MAX_ENTRIES"] = int(os.environ.get("CUBO_SESSION_MAX_ENTRIES", "10000"))
+app.config["SESSION_GC_INTERVAL"] = int(os.environ.get("CUBO_SESSION_GC_INTERVAL", "300"))
+app.config["SESSION_COOKIE_SAMESITE"] = "Lax"
+app.permanent_session_lifetime = datetime.timedelta(seconds=app.config["SESSION_TTL"])
 app.config["SESSION_TYPE"] = "filesystem"
 app.config["SESSION_PERMANENT"] = False
-Session(app)
+# Cache em memória dos arquivos de dados (CUBO_DATA_CACHE=0 desativa)
+app.config["DATA_CACHE_ENABLED"] = os.environ.get("CUBO_DATA_CACHE", "1") != "0"
+app.config["DATA_CACHE_MAX_BYTES"] = int(os.environ.get("CUBO_DATA_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
 
 # Caminhos para arquivos de dados
-DATA_DIR = os.path.join(os.path.dirname(__file__), "data")
+DATA_DIR = os.environ.get("CUBO_DATA_DIR", os.path.join(os.path.dirname(__file__), "data"))
 ORDERS_FILE = os.path.join(DATA_DIR, "sample_data.json")
 USERS_FILE = os.path.join(DATA_DIR, "users.json")
 COMPRAS_FILE = os.path.join(DATA_DIR, "compras.json")
 CONTAS_FILE = os.path.join(DATA_DIR, "contas_pagar.json")
 FINANCIAL_FILE = os.path.join(DATA_DIR, "financial.json")
 BALANCETE_FILE = os.path.join(DATA_DIR, "balancete.json")
+DATA_FILES = (ORDERS_FILE, COMPRAS_FILE, CONTAS_FILE, FINANCIAL_FILE, BALANCETE_FILE)
+LEDGER_FILES = (FINANCIAL_FILE, BALANCETE_FILE)
+SEQUENCES_FILE = os.path.join(DATA_DIR, "sequences.json")
+AGGREGATES_FILE = os.path.join(DATA_DIR, "agregados.json")
+VERSIONS_FILE = os.path.join(DATA_DIR, "versions.json")
+JOBS_FILE = os.path.join(DATA_DIR, "jobs.json")
+EXPORTS_DIR = os.path.join(DATA_DIR, "exports")
+
+# Formato dos arquivos de dados: "auto" (orjson se instalado, senão "json"), "json",
+# "json-indentado", "orjson" ou "binario". CUBO_LEDGER_CODEC, se definido, vale só para
+# o financeiro e o balancete
+app.config["DATA_CODEC"] = os.environ.get("CUBO_DATA_CODEC", "auto")
+app.config["LEDGER_CODEC"] = os.environ.get("CUBO_LEDGER_CODEC") or None
+# Backend de armazenamento: "json" (padrão), "sqlite", "journal" ou "partitioned"
+app.config["STORAGE_BACKEND"] = os.environ.get("CUBO_STORAGE_BACKEND", "json")
+app.config["SQLITE_PATH"] = os.environ.get("CUBO_SQLITE_PATH", os.path.join(DATA_DIR, "cubo.db"))
+app.config["SESSION_SQLITE_PATH"] = os.environ.get("CUBO_SESSION_SQLITE_PATH", os.path.join(DATA_DIR, "sessions.db"))
+# Limites para a compactação do journal (tamanho em bytes e idade em segundos)
+app.config["JOURNAL_MAX_BYTES"] = int(os.environ.get("CUBO_JOURNAL_MAX_BYTES", str(1024 * 1024)))
+app.config["JOURNAL_MAX_AGE"] = int(os.environ.get("CUBO_JOURNAL_MAX_AGE", "3600"))
+app.config["JOURNAL_COMPACT_INTERVAL"] = int(os.environ.get("CUBO_JOURNAL_COMPACT_INTERVAL", "30"))
+# Eventos em tempo real (/api/events): limite de conexões por processo e intervalo do
+# keep-alive em segundos. Cada conexão ocupa uma thread do worker (gunicorn.conf.py)
+app.config["SSE_MAX_SUBSCRIBERS"] = int(os.environ.get("CUBO_SSE_MAX_SUBSCRIBERS", "50"))
+app.config["SSE_HEARTBEAT"] = int(os.environ.get("CUBO_SSE_HEARTBEAT", "15"))
+# Tarefas em segundo plano: threads do pool e quantas tarefas encerradas ficam no histórico
+app.config["JOB_WORKERS"] = int(os.environ.get("CUBO_JOB_WORKERS", "2"))
+app.config["JOB_HISTORY"] = int(os.environ.get("CUBO_JOB_HISTORY", "200"))
+# Login: método de hash das senhas (sem valor usa o padrão do werkzeug; definido, os
+# hashes com outros parâmetros são refeitos no login), falhas aceitas por usuário e por
+# IP na janela (segundos) e verificações simultâneas
+app.config["PASSWORD_HASH_METHOD"] = os.environ.get("CUBO_PASSWORD_HASH_METHOD") or None
+app.config["LOGIN_MAX_FAILURES_USER"] = int(os.environ.get("CUBO_LOGIN_MAX_FAILURES_USER", "5"))
+app.config["LOGIN_MAX_FAILURES_IP"] = int(os.environ.get("CUBO_LOGIN_MAX_FAILURES_IP", "20"))
+app.config["LOGIN_WINDOW"] = int(os.environ.get("CUBO_LOGIN_WINDOW", "300"))
+app.config["LOGIN_MAX_CONCURRENT"] = int(os.environ.get("CUBO_LOGIN_MAX_CONCURRENT", str(os.cpu_count() or 2)))
+# Quantas versões de cada coleção o log de alterações (?since=) mantém em memória
+app.config["CHANGE_LOG_MAX"] = int(os.environ.get("CUBO_CHANGE_LOG_MAX", "500"))
 
 # Garantir que os arquivos existam
-for file_path in [ORDERS_FILE, COMPRAS_FILE, CONTAS_FILE, FINANCIAL_FILE, BALANCETE_FILE]:
+for file_path in DATA_FILES:
     directory = os.path.dirname(file_path)
     if not os.path.exists(directory):
         os.makedirs(directory)
@@ -42,45 +132,3171 @@ for file_path in [ORDERS_FILE, COMPRAS_FILE, CONTAS_FILE, FINANCIAL_FILE, BALANC
             json.dump(initial_data, f, indent=2)
 
 
+# Chave de assinatura dos cookies
+SECRET_KEY_FILE = os.path.join(DATA_DIR, "secret_key")
+
+
+def _load_secret_key():
+    """CUBO_SECRET_KEY ou uma chave aleatória gerada uma única vez em data/secret_key"""
+    key = os.environ.get("CUBO_SECRET_KEY")
+    if key:
+        return key
+    if not os.path.exists(SECRET_KEY_FILE):
+        tmp_path = f"{SECRET_KEY_FILE}.{os.getpid()}.tmp"
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            f.write(secrets.token_hex(32))
+            f.flush()
+            os.fsync(f.fileno())
+        try:
+            # link() falha se outro worker criou a chave primeiro: vale a dele
+            os.link(tmp_path, SECRET_KEY_FILE)
+            logger.info("Chave secreta gerada em data/secret_key")
+        except FileExistsError:
+            pass
+        finally:
+            os.unlink(tmp_path)
+    with open(SECRET_KEY_FILE, 'r') as f:
+        key = f.read().strip()
+    if not key:
+        raise RuntimeError(f"Chave secreta vazia em {SECRET_KEY_FILE}")
+    return key
+
+
+app.secret_key = _load_secret_key()
+
+
+# Cache de repositório
+# Cada arquivo de dados é mantido em memória já interpretado (serializado com pickle,
+# que é bem mais rápido de restaurar que o JSON original). A entrada só é usada
+# enquanto a assinatura do arquivo (mtime, ctime, tamanho, inode) não mudar, assim
+# escritas feitas por outro worker ou edições manuais são percebidas na próxima leitura.
+_data_cache = OrderedDict()
+_data_cache_lock = threading.Lock()
+_data_cache_stats = {"hits": 0, "misses": 0, "evictions": 0, "bytes": 0}
+
+
+def _file_signature(file_path):
+    stat = os.stat(file_path)
+    return (stat.st_mtime_ns, stat.st_ctime_ns, stat.st_size, stat.st_ino)
+
+
+def _cache_enabled():
+    return app.config.get("DATA_CACHE_ENABLED", True)
+
+
+def _cache_get(file_path, signature):
+    """Retorna uma cópia independente dos dados em cache ou None"""
+    with _data_cache_lock:
+        cached = _data_cache.get(file_path)
+        if cached is None or cached[0] != signature:
+            _data_cache_stats["misses"] += 1
+            return None
+        _data_cache.move_to_end(file_path)
+        _data_cache_stats["hits"] += 1
+        blob = cached[1]
+    return pickle.loads(blob)
+
+
+def _cache_put(file_path, data, signature):
+    blob = pickle.dumps(data, pickle.HIGHEST_PROTOCOL)
+    max_bytes = app.config.get("DATA_CACHE_MAX_BYTES", 0)
+    with _data_cache_lock:
+        previous = _data_cache.pop(file_path, None)
+        if previous is not None:
+            _data_cache_stats["bytes"] -= len(previous[1])
+        if len(blob) > max_bytes:
+            return
+        _data_cache[file_path] = (signature, blob)
+        _data_cache_stats["bytes"] += len(blob)
+        # Remove as entradas usadas há mais tempo até caber no orçamento
+        while _data_cache_stats["bytes"] > max_bytes:
+            _, (_, evicted) = _data_cache.popitem(last=False)
+            _data_cache_stats["bytes"] -= len(evicted)
+            _data_cache_stats["evictions"] += 1
+
+
+def clear_data_cache():
+    with _data_cache_lock:
+        _data_cache.clear()
+        _data_cache_stats["bytes"] = 0
+
+
+def get_data_cache_stats():
+    with _data_cache_lock:
+        stats = dict(_data_cache_stats)
+        stats["entries"] = len(_data_cache)
+    stats["enabled"] = _cache_enabled()
+    stats["max_bytes"] = app.config.get("DATA_CACHE_MAX_BYTES", 0)
+    return stats
+
+
+# Bloqueio de arquivos entre processos
+# Cada arquivo de dados tem um arquivo "<arquivo>.lock" usado com flock. O bloqueio é
+# mantido durante todo o ciclo load_data -> modificação -> save_data, de modo que
+# vários workers do gunicorn não percam gravações uns dos outros. É reentrante por
+# thread; para evitar deadlock, o handler declara de uma vez todos os arquivos que
+# vai gravar e eles são bloqueados em ordem fixa.
+_lock_local = threading.local()
+_tx_local = threading.local()
+_process_locks = {}
+_lock_stats = {}
+_lock_stats_lock = threading.Lock()
+
+
+def _record_lock_wait(file_path, waited, contended):
+    with _lock_stats_lock:
+        stats = _lock_stats.setdefault(os.path.basename(file_path), {
+            "acquisitions": 0, "contended": 0, "wait_total_ms": 0.0, "wait_max_ms": 0.0
+        })
+        stats["acquisitions"] += 1
+        stats["contended"] += 1 if contended else 0
+        stats["wait_total_ms"] += waited * 1000
+        stats["wait_max_ms"] = max(stats["wait_max_ms"], waited * 1000)
+
+
+def get_lock_stats():
+    with _lock_stats_lock:
+        return {name: dict(stats) for name, stats in _lock_stats.items()}
+
+
+def _acquire_file_lock(file_path):
+    start = time.perf_counter()
+    if fcntl is None:
+        lock = _process_locks.setdefault(file_path, threading.Lock())
+        contended = not lock.acquire(blocking=False)
+        if contended:
+            lock.acquire()
+        handle = lock
+    else:
+        handle = os.open(file_path + ".lock", os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            contended = False
+        except BlockingIOError:
+            contended = True
+            fcntl.flock(handle, fcntl.LOCK_EX)
+    _record_lock_wait(file_path, time.perf_counter() - start, contended)
+    return handle
+
+
+def _release_file_lock(handle):
+    if fcntl is None:
+        handle.release()
+    else:
+        fcntl.flock(handle, fcntl.LOCK_UN)
+        os.close(handle)
+
+
+@contextmanager
+def data_lock(*file_paths):
+    """Bloqueio exclusivo dos arquivos durante um ciclo ler-modificar-gravar"""
+    held = _lock_local.__dict__.setdefault("held", {})
+    outermost = not held
+    acquired = []
+    try:
+        for file_path in sorted(set(file_paths)):
+            if file_path in held:
+                held[file_path][1] += 1
+            else:
+                held[file_path] = [_acquire_file_lock(file_path), 1]
+            acquired.append(file_path)
+        if outermost:
+            # Conclui transações interrompidas que envolvam apenas arquivos já bloqueados
+            recover_transactions(held_files=set(held))
+        yield
+    finally:
+        for file_path in reversed(acquired):
+            held[file_path][1] -= 1
+            if held[file_path][1] == 0:
+                _release_file_lock(held.pop(file_path)[0])
+
+
+def with_data_lock(*file_paths):
+    """Decorator que mantém data_lock(*file_paths) durante toda a função"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with data_lock(*file_paths):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _fsync_enabled():
+    # Durante a aplicação de uma transação o registro de commit já foi sincronizado
+    return not getattr(_tx_local, "deferred_sync", False)
+
+
+def _defer_sync(path):
+    """Anota um caminho gravado (ou removido) sem fsync dentro de _synced_batch"""
+    pending = getattr(_tx_local, "unsynced", None)
+    if pending is not None:
+        pending.add(path)
+
+
+def _fsync_directory(directory):
+    try:
+        fd = os.open(directory or ".", os.O_RDONLY)
+    except OSError:  # Windows não abre diretórios
+        return
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _fsync_paths(paths):
+    """fsync dos arquivos e dos diretórios que os contêm (renomeações e remoções)"""
+    for path in paths:
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except FileNotFoundError:
+            continue
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+    for directory in {os.path.dirname(path) for path in paths}:
+        _fsync_directory(directory)
+
+
+@contextmanager
+def _synced_batch():
+    """Grava sem fsync por arquivo e sincroniza tudo de uma vez ao final.
+
+    Usado ao aplicar um registro de transação: o registro só pode ser apagado depois
+    que os arquivos gravados (e as entradas de diretório das renomeações) estão no disco.
+    """
+    _tx_local.deferred_sync = True
+    _tx_local.unsynced = set()
+    try:
+        yield
+        paths = _tx_local.unsynced
+    finally:
+        _tx_local.deferred_sync = False
+        _tx_local.unsynced = None
+    _fsync_paths(paths)
+    sync = getattr(get_storage(), "sync", None)
+    if sync is not None:
+        sync()
+
+
+def _atomic_write(file_path, write, binary=False):
+    """Grava em um arquivo temporário e o renomeia sobre o destino"""
+    tmp_path = f"{file_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_path, 'wb' if binary else 'w') as f:
+            write(f)
+            f.flush()
+            if _fsync_enabled():
+                os.fsync(f.fileno())
+        os.replace(tmp_path, file_path)
+        if not _fsync_enabled():
+            _defer_sync(file_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+
+
+def _empty_data(file_path):
+    return [] if file_path not in LEDGER_FILES else {
+        "entries": [],
+        "balance": 0,
+        "last_update": datetime.datetime.now().isoformat()
+    }
+
+
+# Codecs dos arquivos de dados
+# DATA_CODEC define como os arquivos de dados são gravados; na leitura o formato é
+# reconhecido pelo conteúdo, então arquivos em formatos diferentes convivem (por
+# exemplo durante uma conversão com "flask converter-dados"). Os nomes dos arquivos
+# continuam os mesmos em qualquer formato.
+class JsonCodec:
+    name = "json"
+
+    def encode(self, data):
+        return json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode()
+
+    def decode(self, raw):
+        return json.loads(raw)
+
+
+class IndentedJsonCodec(JsonCodec):
+    """Formato anterior, legível e cerca de 40% maior"""
+    name = "json-indentado"
+
+    def encode(self, data):
+        return json.dumps(data, indent=2).encode()
+
+
+class OrjsonCodec(JsonCodec):
+    name = "orjson"
+
+    def encode(self, data):
+        try:
+            return orjson.dumps(data)
+        except TypeError:
+            # Inteiros acima de 64 bits ou chaves não textuais
+            return super().encode(data)
+
+    def decode(self, raw):
+        try:
+            return orjson.loads(raw)
+        except ValueError:
+            # NaN/Infinity e inteiros grandes gravados pelo json da biblioteca padrão
+            return super().decode(raw)
+
+
+class BinaryCodec:
+    """Quadros com tamanho e CRC32, cada um com um bloco de registros em marshal.
+
+    O arquivo começa com BinaryCodec.magic, seguido de quadros
+    <tamanho:uint32><crc32:uint32><conteúdo>. O primeiro quadro guarda o documento sem
+    os registros (a lista de "entries" dos livros fica como None); os seguintes, blocos
+    de até chunk_records registros. O marshal (versão 4, estável desde o Python 3.4)
+    carrega valores simples bem mais rápido que JSON, mas só deve ler arquivos gravados
+    pelo próprio sistema.
+    """
+    name = "binario"
+    magic = b"CUBOBIN1"
+    chunk_records = 4096
+    _header = struct.Struct("<II")
+
+    def _frame(self, value):
+        payload = marshal.dumps(value, 4)
+        return self._header.pack(len(payload), zlib.crc32(payload)) + payload
+
+    def encode(self, data):
+        if isinstance(data, list):
+            kind, shell, records = "lista", None, data
+        elif isinstance(data, dict) and isinstance(data.get("entries"), list):
+            kind, shell, records = "livro", dict(data, entries=None), data["entries"]
+        else:
+            kind, shell, records = "documento", data, []
+        frames = [self.magic, self._frame((kind, shell))]
+        for start in range(0, len(records), self.chunk_records):
+            frames.append(self._frame(records[start:start + self.chunk_records]))
+        return b"".join(frames)
+
+    def decode(self, raw):
+        view = memoryview(raw)
+        pos = len(self.magic)
+        header = None
+        records = []
+        while pos < len(view):
+            if pos + self._header.size > len(view):
+                raise ValueError("Arquivo binário truncado")
+            size, crc = self._header.unpack_from(view, pos)
+            payload = view[pos + self._header.size:pos + self._header.size + size]
+            if len(payload) != size or zlib.crc32(payload) != crc:
+                raise ValueError(f"Quadro corrompido no arquivo binário (posição {pos})")
+            if header is None:
+                header = marshal.loads(payload)
+            else:
+                records.extend(marshal.loads(payload))
+            pos += self._header.size + size
+        if header is None:
+            raise ValueError("Arquivo binário sem cabeçalho")
+
+        kind, shell = header
+        if kind == "lista":
+            return records
+        if kind == "livro":
+            shell["entries"] = records
+        return shell
+
+
+DATA_CODECS = {codec.name: codec for codec in (JsonCodec(), IndentedJsonCodec(), OrjsonCodec(), BinaryCodec())}
+
+
+def get_codec(file_path=None):
+    """Codec usado para gravar o arquivo (ou as partições da coleção) indicado"""
+    name = app.config.get("DATA_CODEC", "auto")
+    if file_path in LEDGER_FILES and app.config.get("LEDGER_CODEC"):
+        name = app.config["LEDGER_CODEC"]
+    if name == "auto":
+        name = "orjson" if orjson is not None else "json"
+    elif name == "orjson" and orjson is None:
+        _warn_missing_orjson()
+        name = "json"
+    if name not in DATA_CODECS:
+        raise ValueError(f"Codec de dados desconhecido: {name}")
+    return DATA_CODECS[name]
+
+
+@functools.lru_cache(maxsize=None)
+def _warn_missing_orjson():
+    logger.warning("Codec orjson configurado, mas o pacote não está instalado; usando json")
+
+
+def encode_data(data, file_path):
+    return get_codec(file_path).encode(data)
+
+
+def decode_data(raw):
+    """Interpreta o conteúdo de um arquivo de dados em qualquer um dos formatos"""
+    if raw.startswith(BinaryCodec.magic):
+        return DATA_CODECS["binario"].decode(raw)
+    return DATA_CODECS["orjson" if orjson is not None else "json"].decode(raw)
+
+
+def _write_encoded(file_path, data, codec_path=None):
+    raw = encode_data(data, codec_path or file_path)
+    _atomic_write(file_path, lambda f: f.write(raw), binary=True)
+
+
+# Backends de armazenamento
+# Os handlers continuam usando load_data/save_data; o backend escolhido em
+# STORAGE_BACKEND decide onde os dados ficam. "json" mantém os arquivos data/*.json
+# e "sqlite" guarda cada coleção em uma tabela indexada (modo WAL).
+class JsonStorage:
+    name = "json"
+
+    def exists(self, file_path):
+        return os.path.exists(file_path)
+
+    def signature(self, file_path):
+        return _file_signature(file_path)
+
+    def read(self, file_path):
+        with open(file_path, 'rb') as f:
+            return decode_data(f.read())
+
+    def write(self, file_path, data):
+        # Leitores nunca veem um arquivo pela metade
+        _write_encoded(file_path, data)
+
+
+# Tabela de cada arquivo no backend SQLite. Cada registro é uma linha com id estável
+# (rowid) e um ordinal explícito que dá a ordem da lista; inserir ou remover no meio
+# não renumera as linhas seguintes. Para o financeiro e o balancete a tabela guarda
+# as "entries"; o restante do documento (balance, last_update, fechamentos) fica em
+# ledger_meta. As consultas usam os índices em memória (período, chave), então as
+# tabelas não têm colunas indexadas além do ordinal.
+SQLITE_TABLES = {
+    ORDERS_FILE: "orders",
+    COMPRAS_FILE: "compras",
+    CONTAS_FILE: "contas_pagar",
+    FINANCIAL_FILE: "financial_entries",
+    BALANCETE_FILE: "balancete_entries",
+}
+
+
+class SqliteStorage:
+    name = "sqlite"
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._local = threading.local()
+        # Última versão conhecida de cada tabela com os ids, ordinais e documentos
+        # serializados das linhas, usados para regravar apenas as que mudaram
+        self._docs = {}
+        self._docs_lock = threading.Lock()
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._create_schema(conn)
+            self._local.conn = conn
+        return conn
+
+    def sync(self):
+        # Com synchronous=NORMAL o WAL só é sincronizado no checkpoint
+        self._connect().execute("PRAGMA wal_checkpoint(PASSIVE)")
+
+    def _create_schema(self, conn):
+        conn.execute("CREATE TABLE IF NOT EXISTS colecoes (nome TEXT PRIMARY KEY, versao INTEGER NOT NULL)")
+        conn.execute("CREATE TABLE IF NOT EXISTS ledger_meta (nome TEXT PRIMARY KEY, doc TEXT NOT NULL)")
+        for table in SQLITE_TABLES.values():
+            if "pos" in self._columns(conn, table):
+                self._migrate_positional(conn, table)
+            conn.execute(f"CREATE TABLE IF NOT EXISTS {table} "
+                         f"(id INTEGER PRIMARY KEY, ordem REAL NOT NULL, doc TEXT NOT NULL)")
+            conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_ordem ON {table} (ordem)")
+
+    @staticmethod
+    def _columns(conn, table):
+        return [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+
+    def _migrate_positional(self, conn, table):
+        """Converte uma tabela do layout antigo (pos como chave, colunas indexadas)"""
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Outro processo pode ter migrado enquanto esperávamos o bloqueio
+            if "pos" in self._columns(conn, table):
+                conn.execute(f"ALTER TABLE {table} RENAME TO {table}_posicional")
+                conn.execute(f"CREATE TABLE {table} (id INTEGER PRIMARY KEY, ordem REAL NOT NULL, doc TEXT NOT NULL)")
+                conn.execute(f"INSERT INTO {table} (ordem, doc) SELECT pos, doc FROM {table}_posicional ORDER BY pos")
+                conn.execute(f"DROP TABLE {table}_posicional")
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    @staticmethod
+    def _version(conn, table):
+        row = conn.execute("SELECT versao FROM colecoes WHERE nome = ?", (table,)).fetchone()
+        return row[0] if row else None
+
+    @staticmethod
+    def _rows(conn, table):
+        rows = conn.execute(f"SELECT id, ordem, doc FROM {table} ORDER BY ordem").fetchall()
+        return [row[0] for row in rows], [row[1] for row in rows], [row[2] for row in rows]
+
+    @staticmethod
+    def _ordinals(before, after, count):
+        """Ordinais para count linhas entre os vizinhos before e after (None = ponta)"""
+        if before is None and after is None:
+            return [float(n) for n in range(count)]
+        if after is None:
+            return [before + n for n in range(1, count + 1)]
+        if before is None:
+            return [after - n for n in range(count, 0, -1)]
+        step = (after - before) / (count + 1)
+        return [before + step * n for n in range(1, count + 1)]
+
+    def exists(self, file_path):
+        return self._version(self._connect(), SQLITE_TABLES[file_path]) is not None
+
+    def signature(self, file_path):
+        # O caminho do banco evita que bancos diferentes com a mesma versão se confundam no cache
+        return (self.name, self.db_path, self._version(self._connect(), SQLITE_TABLES[file_path]))
+
+    def read(self, file_path):
+        table = SQLITE_TABLES[file_path]
+        conn = self._connect()
+        conn.execute("BEGIN")
+        try:
+            version = self._version(conn, table)
+            ids, ordens, docs = self._rows(conn, table)
+            meta = conn.execute("SELECT doc FROM ledger_meta WHERE nome = ?", (table,)).fetchone()
+        finally:
+            conn.execute("COMMIT")
+
+        with self._docs_lock:
+            self._docs[table] = (version, ids, ordens, docs)
+
+        records = json.loads("[" + ",".join(docs) + "]")
+        if file_path not in LEDGER_FILES:
+            return records
+        data = json.loads(meta[0]) if meta else {"entries": None, "balance": 0}
+        data["entries"] = records
+        return data
+
+    def write(self, file_path, data):
+        table = SQLITE_TABLES[file_path]
+        records = data.get("entries", []) if file_path in LEDGER_FILES else data
+        docs = [json.dumps(record, ensure_ascii=False) for record in records]
+
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            version = self._version(conn, table)
+            with self._docs_lock:
+                known = self._docs.get(table)
+            if version is not None and known is not None and known[0] == version:
+                _, ids, ordens, previous = known
+            else:
+                ids, ordens, previous = self._rows(conn, table)
+            ids, ordens = list(ids), list(ordens)
+
+            # Regrava apenas as linhas alteradas; inserções recebem ordinais entre os vizinhos
+            renumber = False
+            for op in _diff_records(previous, docs):
+                if op["op"] == "set":
+                    conn.execute(f"UPDATE {table} SET doc = ? WHERE id = ?", (op["rec"], ids[op["pos"]]))
+                    continue
+                start, end = op["pos"], op["pos"] + op["del"]
+                conn.executemany(f"DELETE FROM {table} WHERE id = ?", [(row_id,) for row_id in ids[start:end]])
+                before = ordens[start - 1] if start > 0 else None
+                after = ordens[end] if end < len(ordens) else None
+                new_ordens = self._ordinals(before, after, len(op["ins"]))
+                window = [before] * (before is not None) + new_ordens + [after] * (after is not None)
+                renumber = renumber or any(a >= b for a, b in zip(window, window[1:]))
+                new_ids = [conn.execute(f"INSERT INTO {table} (ordem, doc) VALUES (?, ?)", (ordem, doc)).lastrowid
+                           for ordem, doc in zip(new_ordens, op["ins"])]
+                ids[start:end], ordens[start:end] = new_ids, new_ordens
+            if renumber:
+                # Sem espaço entre dois ordinais vizinhos: numera a tabela de novo
+                ordens = [float(n) for n in range(len(ids))]
+                conn.executemany(f"UPDATE {table} SET ordem = ? WHERE id = ?", zip(ordens, ids))
+
+            if file_path in LEDGER_FILES:
+                meta = {key: (None if key == "entries" else value) for key, value in data.items()}
+                conn.execute("INSERT OR REPLACE INTO ledger_meta (nome, doc) VALUES (?, ?)",
+                             (table, json.dumps(meta, ensure_ascii=False)))
+
+            new_version = (version or 0) + 1
+            conn.execute("INSERT OR REPLACE INTO colecoes (nome, versao) VALUES (?, ?)", (table, new_version))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+        with self._docs_lock:
+            self._docs[table] = (new_version, ids, ordens, docs)
+
+
+# Diferença entre duas versões de um arquivo de dados, expressa como operações
+# posicionais que podem ser reaplicadas sobre a versão antiga:
+#   set    -> substitui o registro na posição "pos"
+#   splice -> remove "del" registros a partir de "pos" e insere "ins"
+#   put    -> define uma chave do documento (balance, last_update, ...)
+#   unset  -> remove uma chave do documento
+# Operações sobre listas dentro de um documento (financeiro/balancete) levam "campo".
+def _diff_records(old, new, field=None):
+    ops = []
+    if len(old) == len(new):
+        for pos, (old_record, new_record) in enumerate(zip(old, new)):
+            if old_record != new_record:
+                ops.append({"op": "set", "pos": pos, "rec": new_record})
+    else:
+        limit = min(len(old), len(new))
+        prefix = 0
+        while prefix < limit and old[prefix] == new[prefix]:
+            prefix += 1
+        suffix = 0
+        while suffix < limit - prefix and old[-1 - suffix] == new[-1 - suffix]:
+            suffix += 1
+        ops.append({
+            "op": "splice",
+            "pos": prefix,
+            "del": len(old) - prefix - suffix,
+            "ins": new[prefix:len(new) - suffix]
+        })
+    if field is not None:
+        for op in ops:
+            op["campo"] = field
+    return ops
+
+
+def diff_data(old, new):
+    if isinstance(old, list) and isinstance(new, list):
+        return _diff_records(old, new)
+    if isinstance(old, dict) and isinstance(new, dict):
+        ops = []
+        for key, value in new.items():
+            if isinstance(value, list) and isinstance(old.get(key), list):
+                ops.extend(_diff_records(old[key], value, key))
+            elif key not in old or old[key] != value:
+                ops.append({"op": "put", "campo": key, "valor": value})
+        for key in old:
+            if key not in new:
+                ops.append({"op": "unset", "campo": key})
+        return ops
+    return [{"op": "replace", "valor": new}]
+
+
+def apply_ops(data, ops):
+    for op in ops:
+        kind = op["op"]
+        if kind == "replace":
+            data = op["valor"]
+        elif kind == "put":
+            data[op["campo"]] = op["valor"]
+        elif kind == "unset":
+            data.pop(op["campo"], None)
+        else:
+            target = data[op["campo"]] if "campo" in op else data
+            if kind == "set":
+                target[op["pos"]] = op["rec"]
+            elif kind == "splice":
+                target[op["pos"]:op["pos"] + op["del"]] = op["ins"]
+    return data
+
+
+class JournalStorage(JsonStorage):
+    """Snapshot JSON mais um journal com uma linha por gravação.
+
+    A primeira linha do journal identifica o snapshot sobre o qual ele foi escrito
+    (CRC32 do conteúdo). Depois de uma compactação o snapshot muda, então um journal
+    antigo que tenha sobrado de uma queda é reconhecido e ignorado.
+    """
+    name = "journal"
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        # file_path -> (assinatura, crc do snapshot, tamanho íntegro do journal)
+        self._state = {}
+        self._compactor = None
+
+    @staticmethod
+    def journal_path(file_path):
+        return file_path + ".journal"
+
+    def exists(self, file_path):
+        return os.path.exists(file_path) or os.path.exists(self.journal_path(file_path))
+
+    def signature(self, file_path):
+        journal_path = self.journal_path(file_path)
+        return (
+            self.name,
+            _file_signature(file_path) if os.path.exists(file_path) else None,
+            _file_signature(journal_path) if os.path.exists(journal_path) else None
+        )
+
+    def _load(self, file_path):
+        """Reconstrói o estado a partir do snapshot e do journal"""
+        signature = self.signature(file_path)
+        if os.path.exists(file_path):
+            with open(file_path, 'rb') as f:
+                raw = f.read()
+            data = decode_data(raw)
+            base = zlib.crc32(raw)
+        else:
+            data = _empty_data(file_path)
+            base = None
+
+        journal_path = self.journal_path(file_path)
+        valid_length = None
+        if os.path.exists(journal_path):
+            with open(journal_path, 'rb') as f:
+                lines = f.read().split(b"\n")
+            # Se o arquivo não termina em quebra de linha, a última linha foi
+            # interrompida no meio da gravação e é descartada
+            if lines[-1]:
+                logger.warning(f"Linha incompleta descartada do journal {journal_path}")
+            entries = []
+            length = 0
+            for line in lines[:-1]:
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    logger.error(f"Linha corrompida no journal {journal_path}, ignorando o restante")
+                    break
+                length += len(line) + 1
+
+            if entries and entries[0].get("base") == base:
+                for entry in entries[1:]:
+                    data = apply_ops(data, entry["ops"])
+                valid_length = length
+            elif entries:
+                logger.warning(f"Journal {journal_path} não corresponde ao snapshot atual, ignorando")
+
+        self._state[file_path] = (signature, base, valid_length)
+        return data
+
+    def read(self, file_path):
+        with self._lock:
+            return self._load(file_path)
+
+    def write(self, file_path, data):
+        with self._lock:
+            signature = self.signature(file_path)
+            state = self._state.get(file_path)
+            previous = None
+            if state is not None and state[0] == signature and _cache_enabled():
+                previous = _cache_get(file_path, signature)
+            if previous is None:
+                previous = self._load(file_path)
+            _, base, valid_length = self._state[file_path]
+
+            ops = diff_data(previous, data)
+            if not ops:
+                return
+
+            journal_path = self.journal_path(file_path)
+            if valid_length is None:
+                # Journal ausente ou de outro snapshot: começa um novo
+                header = (json.dumps({"base": base, "criado_em": time.time()}) + "\n").encode()
+                tmp_path = journal_path + ".tmp"
+                with open(tmp_path, 'wb') as f:
+                    f.write(header)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, journal_path)
+                valid_length = len(header)
+            elif os.path.getsize(journal_path) != valid_length:
+                # Remove uma linha incompleta deixada por uma gravação interrompida
+                with open(journal_path, 'rb+') as f:
+                    f.truncate(valid_length)
+
+            line = (json.dumps({"ts": datetime.datetime.now().isoformat(), "ops": ops},
+                               ensure_ascii=False) + "\n").encode()
+            fd = os.open(journal_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                written = 0
+                while written < len(line):
+                    written += os.write(fd, line[written:])
+                if _fsync_enabled():
+                    os.fsync(fd)
+                else:
+                    _defer_sync(journal_path)
+            finally:
+                os.close(fd)
+
+            self._state[file_path] = (self.signature(file_path), base, valid_length + len(line))
+
+    def needs_compaction(self, file_path):
+        journal_path = self.journal_path(file_path)
+        if not os.path.exists(journal_path):
+            return False
+        if os.path.getsize(journal_path) >= app.config["JOURNAL_MAX_BYTES"]:
+            return True
+        try:
+            with open(journal_path, 'rb') as f:
+                created = json.loads(f.readline()).get("criado_em", 0)
+        except ValueError:
+            return True
+        return time.time() - created >= app.config["JOURNAL_MAX_AGE"]
+
+    def compact(self, file_path):
+        """Incorpora o journal a um novo snapshot"""
+        with data_lock(file_path), self._lock:
+            journal_path = self.journal_path(file_path)
+            if not os.path.exists(journal_path):
+                return False
+            data = self._load(file_path)
+            _write_encoded(file_path, data)
+            # Se o processo cair antes desta remoção, o journal deixa de corresponder
+            # ao novo snapshot e é ignorado na próxima leitura
+            os.unlink(journal_path)
+            if _cache_enabled():
+                _cache_put(file_path, data, self.signature(file_path))
+            logger.info(f"Journal de {os.path.basename(file_path)} compactado")
+            return True
+
+    def start_compactor(self):
+        if self._compactor is not None:
+            return self
+
+        def run():
+            while True:
+                time.sleep(app.config["JOURNAL_COMPACT_INTERVAL"])
+                for file_path in DATA_FILES:
+                    try:
+                        if self.needs_compaction(file_path):
+                            self.compact(file_path)
+                    except Exception as e:
+                        logger.error(f"Erro ao compactar journal de {file_path}: {e}")
+
+        self._compactor = threading.Thread(target=run, name="journal-compactor", daemon=True)
+        self._compactor.start()
+        return self
+
+
+# Layout particionado por mês
+# Cada coleção fica em data/<coleção>/<YYYY-MM>.json e data/manifest.json lista as
+# partições, suas contagens e os meses encerrados. Cada registro guarda um número de
+# ordem estável para que a lista completa seja remontada na ordem original; uma
+# gravação regrava apenas as partições que tiveram registros alterados. Os meses que
+# aparecem em "fechamentos" do financeiro (encerrar_mes) são selados: suas partições
+# de ordens, compras e lançamentos ficam somente leitura. Contas a pagar continuam
+# graváveis, já que são quitadas depois do mês de vencimento.
+PARTITION_LAYOUT = {
+    ORDERS_FILE: ("orders", ("data",)),
+    COMPRAS_FILE: ("compras", ("data",)),
+    CONTAS_FILE: ("contas_pagar", ("vencimento",)),
+    FINANCIAL_FILE: ("financial", ("date", "data")),
+    BALANCETE_FILE: ("balancete", ("date", "data")),
+}
+SEALABLE_COLLECTIONS = ("orders", "compras", "financial", "balancete")
+UNDATED_PARTITION = "sem-data"
+_MONTH_PATTERN = re.compile(r"^\d{4}-\d{2}")
+
+
+class PartitionedStorage:
+    name = "partitioned"
+
+    def __init__(self, data_dir):
+        self.data_dir = data_dir
+        self.manifest_path = os.path.join(data_dir, "manifest.json")
+        self._lock = threading.RLock()
+        # file_path -> (assinatura, números de ordem alinhados aos registros)
+        self._ordinals = {}
+
+    @staticmethod
+    def partition_key(file_path, record):
+        if isinstance(record, dict):
+            for field in PARTITION_LAYOUT[file_path][1]:
+                value = record.get(field)
+                if isinstance(value, str) and _MONTH_PATTERN.match(value):
+                    return value[:7]
+        return UNDATED_PARTITION
+
+    def is_partition_field(self, file_path, field):
+        return field == PARTITION_LAYOUT[file_path][1][0]
+
+    def _partition_path(self, file_path, month):
+        return os.path.join(self.data_dir, PARTITION_LAYOUT[file_path][0], f"{month}.json")
+
+    def _meta_path(self, file_path):
+        return os.path.join(self.data_dir, PARTITION_LAYOUT[file_path][0], "meta.json")
+
+    def _read_manifest(self):
+        if not os.path.exists(self.manifest_path):
+            return {"versao": 0, "colecoes": {}, "seladas": []}
+        with open(self.manifest_path, 'r') as f:
+            return json.load(f)
+
+    def _read_partition(self, path):
+        signature = _file_signature(path)
+        pairs = _cache_get(path, signature) if _cache_enabled() else None
+        if pairs is None:
+            with open(path, 'rb') as f:
+                pairs = decode_data(f.read())
+            if _cache_enabled():
+                _cache_put(path, pairs, signature)
+        return pairs
+
+    def exists(self, file_path):
+        return PARTITION_LAYOUT[file_path][0] in self._read_manifest()["colecoes"]
+
+    def signature(self, file_path):
+        return (self.name, _file_signature(self.manifest_path) if os.path.exists(self.manifest_path) else None)
+
+    def read(self, file_path):
+        with self._lock:
+            signature = self.signature(file_path)
+            manifest = self._read_manifest()
+            pairs = []
+            for month in manifest["colecoes"].get(PARTITION_LAYOUT[file_path][0], {}):
+                pairs.extend(self._read_partition(self._partition_path(file_path, month)))
+            pairs.sort(key=lambda pair: pair[0])
+            records = [pair[1] for pair in pairs]
+            self._ordinals[file_path] = (signature, [pair[0] for pair in pairs])
+
+            if file_path not in LEDGER_FILES:
+                return records
+            meta_path = self._meta_path(file_path)
+            data = {"entries": None, "balance": 0}
+            if os.path.exists(meta_path):
+                with open(meta_path, 'r') as f:
+                    data = json.load(f)
+            data["entries"] = records
+            return data
+
+    def read_period(self, file_path, periodo):
+        """Registros das partições do período, sem abrir as demais"""
+        manifest = self._read_manifest()
+        pairs = []
+        for month in manifest["colecoes"].get(PARTITION_LAYOUT[file_path][0], {}):
+            if month.startswith(periodo[:7]) or month == UNDATED_PARTITION:
+                pairs.extend(self._read_partition(self._partition_path(file_path, month)))
+        pairs.sort(key=lambda pair: pair[0])
+        return [pair[1] for pair in pairs]
+
+    @staticmethod
+    def _new_ordinals(ordinals, pos, removed, count):
+        low = ordinals[pos - 1] if pos > 0 else None
+        high = ordinals[pos + removed] if pos + removed < len(ordinals) else None
+        if high is None:
+            start = (low if low is not None else -1) + 1
+            return [start + i for i in range(count)]
+        if low is None:
+            return [high - count + i for i in range(count)]
+        step = (high - low) / (count + 1)
+        return [low + step * (i + 1) for i in range(count)]
+
+    def _plan(self, file_path, data):
+        """Partições afetadas pela gravação e os novos números de ordem"""
+        signature = self.signature(file_path)
+        previous = _cache_get(file_path, signature) if _cache_enabled() else None
+        known = self._ordinals.get(file_path)
+        if previous is None or known is None or known[0] != signature:
+            previous = self.read(file_path) if self.exists(file_path) else _empty_data(file_path)
+            if not self.exists(file_path):
+                self._ordinals[file_path] = (signature, [])
+        ordinals = list(self._ordinals[file_path][1])
+
+        old_records = _records_of(file_path, previous)
+        affected = set()
+        meta_changed = False
+        for op in diff_data(previous, data):
+            if op["op"] not in ("set", "splice") or op.get("campo", "entries") != "entries" \
+                    and file_path in LEDGER_FILES:
+                meta_changed = True
+                continue
+            pos = op["pos"]
+            if op["op"] == "set":
+                affected.add(self.partition_key(file_path, old_records[pos]))
+                affected.add(self.partition_key(file_path, op["rec"]))
+            else:
+                for record in old_records[pos:pos + op["del"]]:
+                    affected.add(self.partition_key(file_path, record))
+                for record in op["ins"]:
+                    affected.add(self.partition_key(file_path, record))
+                ordinals[pos:pos + op["del"]] = self._new_ordinals(ordinals, pos, op["del"], len(op["ins"]))
+        return affected, meta_changed, ordinals
+
+    @staticmethod
+    def _check_sealed(file_path, affected, manifest):
+        if PARTITION_LAYOUT[file_path][0] in SEALABLE_COLLECTIONS:
+            sealed = sorted(affected & set(manifest["seladas"]))
+            if sealed:
+                raise PermissionError(f"Mês encerrado, partição somente leitura: {', '.join(sealed)}")
+
+    def check_writable(self, file_path, data):
+        """Recusa antes da gravação alterações em meses selados"""
+        with self._lock:
+            self._check_sealed(file_path, self._plan(file_path, data)[0], self._read_manifest())
+
+    def write(self, file_path, data):
+        with self._lock:
+            name = PARTITION_LAYOUT[file_path][0]
+            affected, meta_changed, ordinals = self._plan(file_path, data)
+            new_records = _records_of(file_path, data)
+            manifest = self._read_manifest()
+            self._check_sealed(file_path, affected, manifest)
+
+            # Regrava apenas as partições afetadas
+            partitions = manifest["colecoes"].setdefault(name, {})
+            grouped = {month: [] for month in affected}
+            for ordinal, record in zip(ordinals, new_records):
+                month = self.partition_key(file_path, record)
+                if month in grouped:
+                    grouped[month].append([ordinal, record])
+            os.makedirs(os.path.join(self.data_dir, name), exist_ok=True)
+            for month, pairs in grouped.items():
+                path = self._partition_path(file_path, month)
+                if pairs:
+                    _write_encoded(path, pairs, codec_path=file_path)
+                    partitions[month] = {"registros": len(pairs)}
+                elif os.path.exists(path):
+                    os.unlink(path)
+                    _defer_sync(path)
+                    partitions.pop(month, None)
+
+            if file_path in LEDGER_FILES and (meta_changed or not os.path.exists(self._meta_path(file_path))):
+                meta = {key: (None if key == "entries" else value) for key, value in data.items()}
+                _atomic_write(self._meta_path(file_path), lambda f: json.dump(meta, f, ensure_ascii=False))
+
+            # Meses encerrados pelo encerrar_mes passam a ser selados
+            if file_path == FINANCIAL_FILE:
+                for fechamento in data.get("fechamentos", []):
+                    try:
+                        month = f"{int(fechamento['ano'])}-{int(fechamento['mes']):02d}"
+                    except (KeyError, TypeError, ValueError):
+                        continue
+                    if month not in manifest["seladas"]:
+                        self._seal(manifest, month)
+
+            manifest["versao"] += 1
+            _atomic_write(self.manifest_path, lambda f: json.dump(manifest, f, indent=2, sort_keys=True))
+            self._ordinals[file_path] = (self.signature(file_path), ordinals)
+
+    def _seal(self, manifest, month):
+        manifest["seladas"].append(month)
+        manifest["seladas"].sort()
+        for file_path, (name, _) in PARTITION_LAYOUT.items():
+            path = self._partition_path(file_path, month)
+            if name in SEALABLE_COLLECTIONS and os.path.exists(path):
+                os.chmod(path, 0o444)
+        logger.info(f"Partições de {month} seladas")
+
+
+STORAGE_BACKENDS = {
+    "json": lambda: JsonStorage(),
+    "sqlite": lambda: SqliteStorage(app.config["SQLITE_PATH"]),
+    "journal": lambda: JournalStorage().start_compactor(),
+    "partitioned": lambda: PartitionedStorage(DATA_DIR),
+}
+_storages = {}
+
+
+def get_storage():
+    backend = app.config.get("STORAGE_BACKEND", "json")
+    storage = _storages.get(backend)
+    if storage is None:
+        if backend not in STORAGE_BACKENDS:
+            raise ValueError(f"Backend de armazenamento desconhecido: {backend}")
+        storage = _storages[backend] = STORAGE_BACKENDS[backend]()
+    return storage
+
+
+# Funções chamadas após cada gravação bem-sucedida de um arquivo de dados, com os
+# dados gravados, a nova assinatura e, quando estava no cache, a versão anterior como
+# (assinatura, dados). Usadas para manter estruturas derivadas (índices, agregados)
+# sem reler o arquivo.
+_after_save_hooks = []
+
+
+def after_save(func):
+    _after_save_hooks.append(func)
+    return func
+
+
 # Funções auxiliares para manipulação de dados
 def load_data(file_path):
     try:
-        if os.path.exists(file_path):
-            with open(file_path, 'r') as f:
-                return json.load(f)
-        return [] if file_path != FINANCIAL_FILE and file_path != BALANCETE_FILE else {
-            "entries": [],
-            "balance": 0,
-            "last_update": datetime.datetime.now().isoformat()
-        }
+        tx = current_transaction()
+        if tx is not None and file_path in tx.staged:
+            return pickle.loads(tx.staged[file_path])
+
+        storage = get_storage()
+        if storage.exists(file_path):
+            if not _cache_enabled():
+                return storage.read(file_path)
+
+            # A assinatura é lida antes do conteúdo: se o arquivo mudar no meio da
+            # leitura, a próxima chamada verá uma assinatura diferente e relerá o arquivo
+            signature = storage.signature(file_path)
+            data = _cache_get(file_path, signature)
+            if data is not None:
+                return data
+
+            data = storage.read(file_path)
+            _cache_put(file_path, data, signature)
+            return data
+        return _empty_data(file_path)
     except Exception as e:
         logger.error(f"Erro ao carregar dados de {file_path}: {e}")
-        return [] if file_path != FINANCIAL_FILE and file_path != BALANCETE_FILE else {
-            "entries": [],
-            "balance": 0,
-            "last_update": datetime.datetime.now().isoformat()
-        }
+        return _empty_data(file_path)
 
 
 def save_data(data, file_path):
     try:
-        with open(file_path, 'w') as f:
-            json.dump(data, f, indent=2)
+        tx = current_transaction()
+        if tx is not None:
+            tx.stage(file_path, data)
+            return True
+
+        storage = get_storage()
+        with data_lock(file_path):
+            previous = None
+            if _cache_enabled() and storage.exists(file_path):
+                previous_signature = storage.signature(file_path)
+                previous_data = _cache_get(file_path, previous_signature)
+                if previous_data is not None:
+                    previous = (previous_signature, previous_data)
+            storage.write(file_path, data)
+            signature = storage.signature(file_path)
+            if _cache_enabled():
+                # Write-through: a próxima leitura não precisa reinterpretar o arquivo
+                _cache_put(file_path, data, signature)
+            bump_version(file_path)
+            for hook in _after_save_hooks:
+                try:
+                    hook(file_path, data, signature, previous)
+                except Exception as e:
+                    logger.error(f"Erro ao atualizar estruturas derivadas de {file_path}: {e}")
         return True
     except Exception as e:
         logger.error(f"Erro ao salvar dados em {file_path}: {e}")
         return False
 
 
-def load_users():
+# Transações envolvendo vários arquivos
+# Dentro de "with transaction(...)", load_data e save_data passam a ler e preparar as
+# alterações em memória. No commit, as diferenças de todos os arquivos vão para um
+# único registro (data/transacao.<pid>.<thread>.json), que é o único ponto
+# sincronizado em disco; em seguida os arquivos são gravados e o registro removido.
+# Se o processo cair no meio, o próximo a bloquear esses arquivos (ou a inicialização)
+# reaplica o registro nos arquivos que ainda não foram gravados.
+class Transaction:
+    def __init__(self, file_paths):
+        self.file_paths = set(file_paths)
+        self.staged = OrderedDict()
+        self.events = []
+        self.rolled_back = False
+
+    def stage(self, file_path, data):
+        if file_path not in self.file_paths:
+            raise ValueError(f"Arquivo {os.path.basename(file_path)} não declarado na transação")
+        self.staged[file_path] = pickle.dumps(data, pickle.HIGHEST_PROTOCOL)
+
+    def rollback(self):
+        self.rolled_back = True
+        self.staged.clear()
+        self.events.clear()
+
+
+def current_transaction():
+    return getattr(_tx_local, "transaction", None)
+
+
+@contextmanager
+def transaction(*file_paths):
+    """Agrupa as gravações do bloco em um commit único (ou nenhum, em caso de erro)"""
+    outer = current_transaction()
+    if outer is not None:
+        missing = set(file_paths) - outer.file_paths
+        if missing:
+            raise ValueError(f"Arquivos fora da transação externa: {', '.join(sorted(missing))}")
+        yield outer
+        return
+
+    with data_lock(*file_paths):
+        tx = Transaction(file_paths)
+        _tx_local.transaction = tx
+        try:
+            yield tx
+        except BaseException:
+            tx.rollback()
+            raise
+        finally:
+            _tx_local.transaction = None
+        if not tx.rolled_back and tx.staged:
+            _commit_transaction(tx)
+        # Eventos só são publicados depois que as gravações foram confirmadas
+        for event in tx.events:
+            event_broker.publish(*event)
+
+
+def with_transaction(*file_paths):
+    """Decorator de rota: respostas de erro (status >= 400) desfazem as alterações"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            try:
+                with transaction(*file_paths) as tx:
+                    response = func(*args, **kwargs)
+                    status = response[1] if isinstance(response, tuple) else getattr(response, "status_code", 200)
+                    if status >= 400:
+                        tx.rollback()
+                return response
+            except Exception as e:
+                logger.error(f"Erro ao gravar transação: {e}")
+                return jsonify({"error": "Erro ao salvar dados", "details": [str(e)]}), 500
+        return wrapper
+    return decorator
+
+
+def _comparable_signature(storage, file_path):
+    if not storage.exists(file_path):
+        return None
+    return json.loads(json.dumps(storage.signature(file_path)))
+
+
+def _commit_transaction(tx):
+    storage = get_storage()
+    check_writable = getattr(storage, "check_writable", None)
+    if check_writable is not None:
+        for file_path, blob in tx.staged.items():
+            check_writable(file_path, pickle.loads(blob))
+
+    record = {"criado_em": datetime.datetime.now().isoformat(), "arquivos": []}
+    for file_path, blob in tx.staged.items():
+        base = _comparable_signature(storage, file_path)
+        record["arquivos"].append({
+            "arquivo": os.path.basename(file_path),
+            "base": base,
+            "ops": diff_data(load_data(file_path), pickle.loads(blob))
+        })
+
+    record_path = os.path.join(DATA_DIR, f"transacao.{os.getpid()}.{threading.get_ident()}.json")
+    _atomic_write(record_path, lambda f: json.dump(record, f))
+    _fsync_directory(DATA_DIR)
+
+    # A partir daqui a transação está confirmada: falhas são concluídas pela recuperação
     try:
-        if os.path.exists(USERS_FILE):
-            with open(USERS_FILE, 'r') as f:
-                return json.load(f)
+        with _synced_batch():
+            for file_path, blob in tx.staged.items():
+                if not save_data(pickle.loads(blob), file_path):
+                    raise IOError(f"Erro ao gravar {os.path.basename(file_path)}")
+    except Exception:
+        recover_transactions(held_files=tx.file_paths)
+        raise
+    os.unlink(record_path)
+
+
+def _apply_transaction_record(record):
+    storage = get_storage()
+    for item in record["arquivos"]:
+        file_path = os.path.join(DATA_DIR, item["arquivo"])
+        # Arquivos cuja assinatura já mudou foram gravados antes da interrupção
+        if _comparable_signature(storage, file_path) != item["base"]:
+            continue
+        data = storage.read(file_path) if storage.exists(file_path) else _empty_data(file_path)
+        if not save_data(apply_ops(data, item["ops"]), file_path):
+            raise IOError(f"Erro ao recuperar {item['arquivo']}")
+
+
+def recover_transactions(held_files=None):
+    """Conclui transações confirmadas cujo registro ficou no disco.
+
+    Com held_files, considera apenas registros cujos arquivos já estão bloqueados
+    pela thread atual (evita bloquear arquivos fora de ordem).
+    """
+    if not os.path.isdir(DATA_DIR):
+        return
+    for name in sorted(os.listdir(DATA_DIR)):
+        if not (name.startswith("transacao.") and name.endswith(".json")):
+            continue
+        record_path = os.path.join(DATA_DIR, name)
+        try:
+            with open(record_path, 'r') as f:
+                record = json.load(f)
+            file_paths = [os.path.join(DATA_DIR, item["arquivo"]) for item in record["arquivos"]]
+            if held_files is not None and not set(file_paths) <= set(held_files):
+                continue
+            with data_lock(*file_paths):
+                if not os.path.exists(record_path):
+                    continue
+                with _synced_batch():
+                    _apply_transaction_record(record)
+                os.unlink(record_path)
+                logger.warning(f"Transação interrompida concluída a partir de {name}")
+        except FileNotFoundError:
+            continue
+        except Exception as e:
+            logger.error(f"Erro ao recuperar transação {name}: {e}")
+
+
+# Sequências de IDs
+# Cada coleção tem uma sequência nomeada em data/sequences.json com o último ID
+# entregue. A alocação bloqueia apenas esse arquivo (nunca outro enquanto o mantém),
+# então pode ser chamada de dentro de qualquer handler. Na primeira vez a sequência
+# parte do maior ID já existente na coleção. IDs de transações desfeitas não são
+# reaproveitados.
+SEQUENCES = {
+    "orders": (ORDERS_FILE, "numero"),
+    "compras": (COMPRAS_FILE, "id"),
+    "contas_pagar": (CONTAS_FILE, "id"),
+    "financial": (FINANCIAL_FILE, "id"),
+    "balancete": (BALANCETE_FILE, "id"),
+}
+
+
+def _max_existing_id(name):
+    file_path, field = SEQUENCES[name]
+    data = load_data(file_path)
+    records = data.get("entries", []) if file_path in LEDGER_FILES else data
+    values = [int(str(record.get(field))) for record in records
+              if isinstance(record, dict) and str(record.get(field, "")).isdigit()]
+    return max(values, default=0)
+
+
+def allocate_ids(name, count=1):
+    """Reserva um bloco contíguo de IDs da sequência e retorna o range alocado"""
+    if name not in SEQUENCES:
+        raise ValueError(f"Sequência desconhecida: {name}")
+    with data_lock(SEQUENCES_FILE):
+        sequences = {}
+        if os.path.exists(SEQUENCES_FILE):
+            with open(SEQUENCES_FILE, 'r') as f:
+                sequences = json.load(f)
+        last = sequences.get(name)
+        if last is None:
+            last = _max_existing_id(name)
+        sequences[name] = last + count
+        _atomic_write(SEQUENCES_FILE, lambda f: json.dump(sequences, f, indent=2))
+    return range(last + 1, last + count + 1)
+
+
+def next_id(name):
+    return allocate_ids(name)[0]
+
+
+def get_sequences():
+    if not os.path.exists(SEQUENCES_FILE):
+        return {}
+    with open(SEQUENCES_FILE, 'r') as f:
+        return json.load(f)
+
+
+# Versões das coleções
+# data/versions.json guarda um contador por coleção, incrementado a cada gravação
+# feita por save_data (em qualquer processo). As rotas GET derivam delas, e das
+# assinaturas dos arquivos, um ETag forte e respondem 304 quando o cliente já tem a
+# versão atual, sem carregar nem serializar os dados.
+COLLECTION_NAMES = {
+    ORDERS_FILE: "orders",
+    COMPRAS_FILE: "compras",
+    CONTAS_FILE: "contas_pagar",
+    FINANCIAL_FILE: "financial",
+    BALANCETE_FILE: "balancete",
+}
+_versions_cache = {"signature": None, "versions": {}}
+_versions_cache_lock = threading.Lock()
+
+
+def _collection_name(file_path):
+    return COLLECTION_NAMES.get(file_path, os.path.basename(file_path))
+
+
+def get_versions():
+    if not os.path.exists(VERSIONS_FILE):
+        return {}
+    signature = _file_signature(VERSIONS_FILE)
+    with _versions_cache_lock:
+        if _versions_cache["signature"] == signature:
+            return dict(_versions_cache["versions"])
+    with open(VERSIONS_FILE, 'r') as f:
+        versions = json.load(f)
+    with _versions_cache_lock:
+        _versions_cache.update(signature=signature, versions=versions)
+    return dict(versions)
+
+
+def bump_version(file_path):
+    """Incrementa a versão da coleção e retorna o novo valor"""
+    name = _collection_name(file_path)
+    with data_lock(VERSIONS_FILE):
+        versions = get_versions()
+        versions[name] = versions.get(name, 0) + 1
+        _atomic_write(VERSIONS_FILE, lambda f: json.dump(versions, f, indent=2, sort_keys=True))
+    return versions[name]
+
+
+def _request_etag(file_paths):
+    # A resposta também depende da rota, dos parâmetros, do usuário e da data atual
+    # (períodos padrão usam o mês corrente). A assinatura do armazenamento entra junto
+    # da versão: um arquivo editado fora de save_data (à mão, por outra ferramenta)
+    # não muda a versão, mas muda a assinatura
+    versions = get_versions()
+    storage = get_storage()
+    parts = [request.full_path, session.get("username") or "", session.get("user_role") or "",
+             datetime.date.today().isoformat()]
+    for path in file_paths:
+        signature = storage.signature(path) if storage.exists(path) else None
+        parts.append(f"{_collection_name(path)}={versions.get(_collection_name(path), 0)}:{signature}")
+    return hashlib.sha1("|".join(parts).encode()).hexdigest()
+
+
+def with_etag(*file_paths):
+    """Decorator para rotas GET: ETag pelas versões das coleções lidas e 304 quando não mudou"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            etag = _request_etag(file_paths)
+            if request.if_none_match.contains(etag):
+                response = make_response("", 304)
+                response.set_etag(etag)
+                return response
+            response = make_response(func(*args, **kwargs))
+            if response.status_code == 200:
+                response.set_etag(etag)
+            return response
+        return wrapper
+    return decorator
+
+
+# Log de alterações (?since=<versão>)
+# Para ordens, compras e contas, cada gravação (de qualquer processo) acrescenta uma
+# linha a data/alteracoes.<coleção>.jsonl com a versão gerada e os registros
+# incluídos/alterados (upsert) ou removidos (delete), identificados pela chave da
+# coleção. A linha é escrita com o bloqueio do arquivo de dados, então as versões
+# ficam em ordem; a cada CHANGE_LOG_MAX versões o log é reescrito só com as últimas
+# CHANGE_LOG_MAX. Uma consulta com since devolve as alterações das versões seguintes
+# já mescladas; se alguma versão do intervalo não estiver no log (log truncado ou
+# gravação sem a versão anterior em cache) a resposta traz a coleção completa para
+# uma nova sincronização.
+CHANGE_KEYS = {
+    ORDERS_FILE: "numero",
+    COMPRAS_FILE: "id",
+    CONTAS_FILE: "id",
+}
+_change_logs = {}
+_change_logs_lock = threading.Lock()
+
+
+def _change_log_path(file_path):
+    return os.path.join(DATA_DIR, f"alteracoes.{_collection_name(file_path)}.jsonl")
+
+
+def _read_change_log(file_path):
+    """[(versão, alterações)] do log da coleção, em cache enquanto o arquivo não muda"""
+    path = _change_log_path(file_path)
+    if not os.path.exists(path):
         return []
-    except Exception as e:
-        logger.error(f"Erro ao carregar usuários: {e}")
+    signature = _file_signature(path)
+    with _change_logs_lock:
+        cached = _change_logs.get(file_path)
+    if cached is not None and cached[0] == signature:
+        return cached[1]
+    entries = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                item = json.loads(line)
+            except ValueError:
+                # Linha ainda sendo escrita por outro processo: a versão fica de fora
+                continue
+            entries.append((item["versao"], item["alteracoes"]))
+    with _change_logs_lock:
+        _change_logs[file_path] = (signature, entries)
+    return entries
+
+
+@after_save
+def _record_changes(file_path, data, signature, previous):
+    if file_path not in CHANGE_KEYS:
+        return
+    version = get_versions().get(_collection_name(file_path), 0)
+    key = CHANGE_KEYS[file_path]
+    added = []
+    removed = []
+
+    def collect(record, sign):
+        if isinstance(record, dict):
+            (added if sign > 0 else removed).append(record)
+
+    changes = None
+    if previous is not None and apply_record_changes(previous[1], data, collect):
+        changes = [{"op": "upsert", "id": str(record.get(key)), "registro": record} for record in added]
+        upserted = {change["id"] for change in changes}
+        changes.extend({"op": "delete", "id": record_id}
+                       for record_id in dict.fromkeys(str(record.get(key)) for record in removed)
+                       if record_id not in upserted)
+
+    # save_data mantém o bloqueio do arquivo de dados: outra gravação da coleção não
+    # intercala linhas nem versões
+    path = _change_log_path(file_path)
+    line = json.dumps({"versao": version, "alteracoes": changes}) + "\n"
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write(line)
+    limit = app.config["CHANGE_LOG_MAX"]
+    if version % limit == 0:
+        kept = [(entry_version, entry_changes) for entry_version, entry_changes in _read_change_log(file_path)
+                if entry_version > version - limit]
+        _atomic_write(path, lambda f: f.write("".join(
+            json.dumps({"versao": entry_version, "alteracoes": entry_changes}) + "\n"
+            for entry_version, entry_changes in kept)))
+
+
+def changes_since(file_path, since):
+    """(versão atual, alterações mescladas) ou (versão atual, None) se for preciso ressincronizar"""
+    current = get_versions().get(_collection_name(file_path), 0)
+    # since=0 indica que o cliente ainda não tem cópia da coleção
+    if since <= 0 or since > current:
+        return current, None
+    if since == current:
+        return current, []
+    entries = [entry for entry in _read_change_log(file_path) if since < entry[0] <= current]
+    if [version for version, _ in entries] != list(range(since + 1, current + 1)) \
+            or any(changes is None for _, changes in entries):
+        return current, None
+
+    merged = OrderedDict()
+    for _, changes in entries:
+        for change in changes:
+            merged.pop(change["id"], None)
+            merged[change["id"]] = change
+    return current, list(merged.values())
+
+
+def since_response(file_path, decorate=None):
+    """Resposta de ?since=: alterações desde a versão ou a coleção completa"""
+    try:
+        since = int(request.args["since"])
+    except ValueError:
+        return jsonify({"error": "Parâmetros inválidos: since deve ser um número"}), 400
+
+    decorate = decorate or (lambda record: record)
+    current, changes = changes_since(file_path, since)
+    if changes is None:
+        records = [decorate(record) for record in load_data(file_path) if isinstance(record, dict)]
+        return jsonify({"versao": current, "completo": True, "registros": records})
+    return jsonify({
+        "versao": current,
+        "completo": False,
+        "alteracoes": [dict(change, registro=decorate(dict(change["registro"]))) if "registro" in change
+                       else change for change in changes]
+    })
+
+
+# Eventos em tempo real
+# Os handlers publicam eventos tipados (publish_event) que chegam às conexões abertas
+# em /api/events deste processo; dentro de uma transação o evento só sai depois do
+# commit. Enquanto houver conexões, uma única thread por processo acompanha
+# data/versions.json e publica "colecao_alterada" quando uma coleção muda, o que cobre
+# gravações feitas por outros processos; cada conexão apenas espera na sua fila.
+# Eventos com roles só são entregues a usuários com um desses papéis.
+#
+# Cada conexão ocupa uma thread pelo tempo em que fica aberta: em produção o gunicorn
+# deve usar workers gthread (veja gunicorn.conf.py). Com workers sync cada conexão
+# prenderia um processo inteiro, que seria morto ao atingir o timeout.
+COLLECTION_EVENT_ROLES = {
+    "orders": None,
+    "compras": ("admin",),
+    "contas_pagar": ("admin",),
+    "financial": ("admin",),
+    "balancete": ("admin",),
+}
+
+
+class EventSubscriber:
+    def __init__(self, role):
+        self.role = role
+        self.queue = queue.Queue(maxsize=100)
+        self.overflow = False
+
+    def accepts(self, roles):
+        return roles is None or self.role in roles
+
+
+class EventBroker:
+    def __init__(self, poll_interval=1.0):
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self._next_id = 0
+        self._poll_interval = poll_interval
+        self._watcher = None
+
+    def subscribe(self, role, max_subscribers):
+        with self._lock:
+            if len(self._subscribers) >= max_subscribers:
+                return None
+            subscriber = EventSubscriber(role)
+            self._subscribers.add(subscriber)
+            if self._watcher is None:
+                self._watcher = threading.Thread(target=self._watch_versions, name="cubo-eventos", daemon=True)
+                self._watcher.start()
+            return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def count(self):
+        with self._lock:
+            return len(self._subscribers)
+
+    def publish(self, tipo, dados, roles=None):
+        with self._lock:
+            self._next_id += 1
+            event = {"id": self._next_id, "tipo": tipo, "dados": dados}
+            subscribers = [subscriber for subscriber in self._subscribers if subscriber.accepts(roles)]
+        for subscriber in subscribers:
+            try:
+                subscriber.queue.put_nowait(event)
+            except queue.Full:
+                # Cliente lento: em vez dos eventos perdidos ele recebe um pedido de recarga
+                subscriber.overflow = True
+
+    def _watch_versions(self):
+        """Publica "colecao_alterada" para cada mudança em data/versions.json.
+
+        Termina quando a última conexão sai; a próxima inscrição inicia outra thread.
+        """
+        versions = get_versions()
+        while True:
+            time.sleep(self._poll_interval)
+            with self._lock:
+                if not self._subscribers:
+                    self._watcher = None
+                    return
+            try:
+                current = get_versions()
+            except (OSError, ValueError) as e:
+                logger.error(f"Erro ao ler versões das coleções: {e}")
+                continue
+            for name, version in current.items():
+                if version != versions.get(name):
+                    self.publish("colecao_alterada", {"colecao": name, "versao": version},
+                                 COLLECTION_EVENT_ROLES.get(name, ("admin",)))
+            versions = current
+
+
+event_broker = EventBroker()
+
+
+def publish_event(tipo, dados, roles=None):
+    """Publica um evento (após o commit, se houver uma transação em andamento)"""
+    tx = current_transaction()
+    if tx is not None:
+        tx.events.append((tipo, dados, roles))
+    else:
+        event_broker.publish(tipo, dados, roles)
+
+
+def _format_event(tipo, dados, event_id=None):
+    lines = [f"id: {event_id}"] if event_id is not None else []
+    lines.extend([f"event: {tipo}", f"data: {json.dumps(dados, ensure_ascii=False)}"])
+    return "\n".join(lines) + "\n\n"
+
+
+def _event_stream(subscriber, heartbeat):
+    try:
+        yield "retry: 5000\n\n"
+        while True:
+            # Espera bloqueada na fila: sem eventos, a conexão só acorda para o keep-alive
+            try:
+                events = [subscriber.queue.get(timeout=heartbeat)]
+            except queue.Empty:
+                events = []
+            while True:
+                try:
+                    events.append(subscriber.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            chunks = []
+            if subscriber.overflow:
+                subscriber.overflow = False
+                chunks.append(_format_event("recarregar", {}))
+            chunks.extend(_format_event(event["tipo"], event["dados"], event["id"]) for event in events)
+            yield "".join(chunks) or ": keep-alive\n\n"
+    finally:
+        event_broker.unsubscribe(subscriber)
+
+
+@after_save
+def _publish_balance_changes(file_path, data, signature, previous):
+    if file_path in LEDGER_FILES and isinstance(data, dict):
+        previous_balance = previous[1].get("balance") if previous is not None and isinstance(previous[1], dict) \
+            else None
+        if data.get("balance") != previous_balance:
+            event_broker.publish("saldo_atualizado", {"colecao": _collection_name(file_path),
+                                                      "saldo": data.get("balance")}, ("admin",))
+
+
+# Tarefas em segundo plano
+# Operações em lote (encerrar o mês, transferir pedidos, exportações grandes) rodam em
+# um pool de threads em vez de ocupar o worker da requisição, que responde 202 com a
+# tarefa. data/jobs.json é a tabela de tarefas, compartilhada entre os processos:
+# estado, progresso, resultado e pedido de cancelamento. Cada tarefa tem uma chave;
+# enquanto houver uma tarefa pendente ou em execução com a mesma chave, um novo pedido
+# recebe essa tarefa em vez de criar outra. A função da tarefa recebe um JobContext e
+# deve chamar progress()/check() entre as etapas; o cancelamento é atendido nesses
+# pontos e, dentro de uma transação, desfaz as alterações ainda não gravadas.
+JOB_ACTIVE = ("pendente", "executando")
+JOB_PROGRESS_INTERVAL = 0.5
+
+
+class JobCancelled(Exception):
+    pass
+
+
+def _read_jobs():
+    if not os.path.exists(JOBS_FILE):
+        return {}
+    with open(JOBS_FILE, 'r') as f:
+        return json.load(f)
+
+
+def _write_jobs(jobs):
+    _atomic_write(JOBS_FILE, lambda f: json.dump(jobs, f, indent=2, ensure_ascii=False))
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except (PermissionError, OSError):
+        return True
+    return True
+
+
+def _prune_jobs(jobs):
+    """Marca como interrompidas as tarefas de processos que terminaram e limita o histórico"""
+    now = datetime.datetime.now().isoformat()
+    for job in jobs.values():
+        if job["status"] in JOB_ACTIVE and job.get("pid") != os.getpid() and not _pid_alive(job.get("pid", 0)):
+            job.update(status="interrompido", finalizado_em=now, erro="Processo encerrado durante a tarefa")
+
+    finished = sorted((job for job in jobs.values() if job["status"] not in JOB_ACTIVE),
+                      key=lambda job: job["criado_em"])
+    for job in finished[:max(0, len(finished) - app.config["JOB_HISTORY"])]:
+        del jobs[job["id"]]
+        if job.get("arquivo") and os.path.exists(os.path.join(EXPORTS_DIR, job["arquivo"])):
+            os.unlink(os.path.join(EXPORTS_DIR, job["arquivo"]))
+
+
+def get_job(job_id):
+    return _read_jobs().get(str(job_id))
+
+
+def list_jobs(limit=50):
+    jobs = sorted(_read_jobs().values(), key=lambda job: job["criado_em"], reverse=True)
+    return jobs[:limit]
+
+
+def update_job(job_id, **changes):
+    with data_lock(JOBS_FILE):
+        jobs = _read_jobs()
+        job = jobs.get(job_id)
+        if job is None:
+            return None
+        job.update(changes)
+        _write_jobs(jobs)
+        return job
+
+
+def cancel_job(job_id):
+    """Pede o cancelamento; uma tarefa ainda pendente é cancelada na hora"""
+    with data_lock(JOBS_FILE):
+        jobs = _read_jobs()
+        job = jobs.get(job_id)
+        if job is None or job["status"] not in JOB_ACTIVE:
+            return job
+        job["cancelar"] = True
+        if job["status"] == "pendente":
+            job.update(status="cancelado", finalizado_em=datetime.datetime.now().isoformat())
+        _write_jobs(jobs)
+        return job
+
+
+class JobContext:
+    """Repassado à função da tarefa para informar progresso e atender cancelamentos"""
+
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self._last_update = 0.0
+
+    def check(self):
+        job = get_job(self.job_id)
+        if job is not None and job.get("cancelar"):
+            raise JobCancelled()
+
+    def progress(self, atual, total=None):
+        now = time.monotonic()
+        if now - self._last_update < JOB_PROGRESS_INTERVAL and (total is None or atual < total):
+            return
+        self._last_update = now
+        job = update_job(self.job_id, progresso={"atual": atual, "total": total})
+        if job is not None and job.get("cancelar"):
+            raise JobCancelled()
+
+
+class JobRunner:
+    def __init__(self, workers):
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="cubo-job")
+
+    def submit(self, tipo, chave, func, parametros, usuario=None):
+        """Enfileira a tarefa; retorna (tarefa, criada), ou a tarefa ativa de mesma chave"""
+        with data_lock(JOBS_FILE):
+            jobs = _read_jobs()
+            _prune_jobs(jobs)
+            for job in jobs.values():
+                if job["chave"] == chave and job["status"] in JOB_ACTIVE:
+                    _write_jobs(jobs)
+                    return job, False
+
+            job = {
+                "id": uuid.uuid4().hex,
+                "tipo": tipo,
+                "chave": chave,
+                "status": "pendente",
+                "parametros": parametros,
+                "progresso": {"atual": 0, "total": None},
+                "resultado": None,
+                "erro": None,
+                "cancelar": False,
+                "criado_em": datetime.datetime.now().isoformat(),
+                "criado_por": usuario,
+                "pid": os.getpid()
+            }
+            jobs[job["id"]] = job
+            _write_jobs(jobs)
+
+        self._executor.submit(self._run, job["id"], func, parametros)
+        return job, True
+
+    def _run(self, job_id, func, parametros):
+        with data_lock(JOBS_FILE):
+            jobs = _read_jobs()
+            job = jobs.get(job_id)
+            if job is None or job["status"] != "pendente":
+                return
+            job.update(status="executando", iniciado_em=datetime.datetime.now().isoformat())
+            _write_jobs(jobs)
+
+        try:
+            resultado = func(JobContext(job_id), **parametros)
+            changes = {"status": "concluido", "resultado": resultado}
+        except JobCancelled:
+            changes = {"status": "cancelado"}
+        except Exception as e:
+            logger.error(f"Erro na tarefa {job_id}: {e}")
+            changes = {"status": "erro", "erro": str(e)}
+        update_job(job_id, finalizado_em=datetime.datetime.now().isoformat(), **changes)
+
+
+_job_runner = None
+_job_runner_lock = threading.Lock()
+
+
+def get_job_runner():
+    global _job_runner
+    with _job_runner_lock:
+        if _job_runner is None:
+            _job_runner = JobRunner(app.config["JOB_WORKERS"])
+        return _job_runner
+
+
+def submit_job(tipo, chave, func, **parametros):
+    return get_job_runner().submit(tipo, chave, func, parametros, session.get("username"))
+
+
+# Índices de chave primária e de referência
+# Para cada arquivo, um mapa campo -> valor (como texto) -> posições na lista de
+# registros. O índice vale para uma assinatura do arquivo: é refeito logo após as
+# gravações deste processo e, quando outro processo altera o arquivo, na próxima
+# consulta. As posições são sempre conferidas contra a lista recebida; se ela não
+# corresponder ao índice (por exemplo, dados preparados em uma transação), a busca
+# volta a ser linear.
+INDEXED_FIELDS = {
+    ORDERS_FILE: ("numero",),
+    COMPRAS_FILE: ("id",),
+    CONTAS_FILE: ("id", "compra_id"),
+    FINANCIAL_FILE: ("id", "compra_id", "conta_id", "referencia"),
+    BALANCETE_FILE: ("id", "referencia", "reference_id"),
+}
+_record_indexes = {}
+_record_indexes_lock = threading.Lock()
+
+
+def _records_of(file_path, data):
+    if file_path in LEDGER_FILES:
+        return data.get("entries", []) if isinstance(data, dict) else []
+    return data if isinstance(data, list) else []
+
+
+def _build_record_index(file_path, records):
+    # Valores únicos (o caso comum em id e numero) guardam a posição sem lista
+    index = {field: {} for field in INDEXED_FIELDS[file_path]}
+    for pos, record in enumerate(records):
+        if isinstance(record, dict):
+            for field, values in index.items():
+                value = record.get(field)
+                if value is not None:
+                    key = str(value)
+                    found = values.get(key)
+                    if found is None:
+                        values[key] = pos
+                    elif found.__class__ is int:
+                        values[key] = [found, pos]
+                    else:
+                        found.append(pos)
+    return len(records), index
+
+
+@after_save
+def _refresh_record_index(file_path, data, signature, previous):
+    with _record_indexes_lock:
+        in_use = file_path in _record_indexes
+    if in_use and file_path in INDEXED_FIELDS:
+        built = _build_record_index(file_path, _records_of(file_path, data))
+        with _record_indexes_lock:
+            _record_indexes[file_path] = (signature, built)
+
+
+def _get_record_index(file_path, field, length):
+    tx = current_transaction()
+    if file_path not in INDEXED_FIELDS or field not in INDEXED_FIELDS[file_path] \
+            or (tx is not None and file_path in tx.staged):
+        return None
+
+    storage = get_storage()
+    signature = storage.signature(file_path) if storage.exists(file_path) else None
+    with _record_indexes_lock:
+        cached = _record_indexes.get(file_path)
+    if cached is None or cached[0] != signature:
+        signature, records = resident_records(file_path)
+        cached = (signature, _build_record_index(file_path, records))
+        with _record_indexes_lock:
+            _record_indexes[file_path] = cached
+
+    indexed_length, index = cached[1]
+    return index[field] if indexed_length == length else None
+
+
+def find_positions(file_path, records, field, value):
+    """Posições dos registros em que record[field] == value (comparados como texto)"""
+    key = str(value)
+    index = _get_record_index(file_path, field, len(records))
+    if index is None:
+        return [pos for pos, record in enumerate(records)
+                if isinstance(record, dict) and record.get(field) is not None and str(record[field]) == key]
+    found = index.get(key, ())
+    return [pos for pos in ((found,) if found.__class__ is int else found)
+            if isinstance(records[pos], dict) and str(records[pos].get(field)) == key]
+
+
+def find_position(file_path, records, field, value):
+    positions = find_positions(file_path, records, field, value)
+    return positions[0] if positions else None
+
+
+# Registros residentes
+# Cada worker mantém uma única lista dos registros de cada coleção (os dicts de uma
+# leitura de load_data) para a assinatura atual do arquivo. A tabela colunar e o
+# índice por período apontam para ela em vez de guardar cópias próprias: a tabela
+# guarda referências e o índice, só posições. Além dela fica apenas o blob do cache de
+# repositório, de onde load_data tira as cópias que os handlers podem alterar.
+_resident_records = {}
+_resident_records_lock = threading.Lock()
+
+
+def resident_records(file_path):
+    """(assinatura, registros) da versão atual do arquivo; os registros são
+    compartilhados e não devem ser modificados"""
+    tx = current_transaction()
+    if tx is not None and file_path in tx.staged:
+        return None, _records_of(file_path, load_data(file_path))
+
+    # Assinatura lida antes do conteúdo, como em load_data
+    storage = get_storage()
+    signature = storage.signature(file_path) if storage.exists(file_path) else None
+    with _resident_records_lock:
+        cached = _resident_records.get(file_path)
+    if cached is None or cached[0] != signature:
+        cached = (signature, _records_of(file_path, load_data(file_path)))
+        with _resident_records_lock:
+            _resident_records[file_path] = cached
+    return cached
+
+
+@after_save
+def _drop_resident_records(file_path, data, signature, previous):
+    # A lista da versão anterior é liberada logo; a nova é lida na próxima consulta
+    with _resident_records_lock:
+        _resident_records.pop(file_path, None)
+
+
+# Registros compactos
+# Objetos com __slots__ em vez de dicts, medidos por benchmark-memoria. Textos
+# repetidos (status, vendedor, fornecedor, materiais...) são internados e os campos
+# derivados das ordens (valor_entrada, valor_restante, valor_estimado_lucro,
+# status_class) não são guardados: são calculados no acesso. Quando o valor gravado no
+# arquivo difere do calculado, ou o campo não existe no registro, isso fica anotado em
+# _extras, junto dos campos fora do layout, para que to_dict() devolva exatamente o
+# registro original. Os registros residentes continuam como dicts: a tabela colunar é
+# refeita a cada gravação e converter a coleção inteira custaria mais do que a memória
+# economizada.
+_ABSENT = object()
+
+
+def _order_derived(record):
+    """Campos derivados de uma ordem, calculados como em build_order"""
+    derived = {}
+    try:
+        valor_total, custo = float(record.valor_total), float(record.custo)
+    except (TypeError, ValueError):
+        pass
+    else:
+        valor_entrada = valor_total * 0.5
+        derived.update(valor_entrada=valor_entrada, valor_restante=valor_total - valor_entrada,
+                       valor_estimado_lucro=valor_total - custo)
+    if isinstance(record.status, str):
+        derived["status_class"] = f"status-{record.status.lower().replace(' ', '-')}"
+    return derived
+
+
+class CompactRecord:
+    """Registro com os campos do layout em slots; acesso compatível com dict (get, [])"""
+    __slots__ = ("_extras",)
+    LAYOUT = ()
+    INTERNED = frozenset()
+    DERIVED = ()
+
+    @staticmethod
+    def derive(record):
+        return {}
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._STORED = tuple((field, field in cls.INTERNED) for field in cls.LAYOUT if field not in cls.DERIVED)
+        cls._LAYOUT_SET = frozenset(cls.LAYOUT)
+
+    @classmethod
+    def from_dict(cls, data):
+        record = cls.__new__(cls)
+        intern = sys.intern
+        for field, interned in cls._STORED:
+            value = data.get(field, _ABSENT)
+            if interned:
+                if value.__class__ is str:
+                    value = intern(value)
+                elif value.__class__ is list and all(item.__class__ is str for item in value):
+                    value = tuple(intern(item) for item in value)
+            setattr(record, field, value)
+
+        layout = cls._LAYOUT_SET
+        extras = None
+        if not layout.issuperset(data):
+            extras = {key: value for key, value in data.items() if key not in layout}
+        if cls.DERIVED:
+            computed = cls.derive(record)
+            for field in cls.DERIVED:
+                value = data.get(field, _ABSENT)
+                expected = computed.get(field, _ABSENT)
+                if value is _ABSENT or value.__class__ is not expected.__class__ or value != expected:
+                    if extras is None:
+                        extras = {}
+                    extras[field] = value
+        record._extras = extras
+        return record
+
+    def _value(self, field):
+        if self._extras is not None and field in self._extras:
+            return self._extras[field]
+        if field in self.DERIVED:
+            return self.derive(self).get(field, _ABSENT)
+        if field in self._LAYOUT_SET:
+            value = object.__getattribute__(self, field)
+            return list(value) if isinstance(value, tuple) else value
+        return _ABSENT
+
+    def get(self, field, default=None):
+        value = self._value(field)
+        return default if value is _ABSENT else value
+
+    def __getitem__(self, field):
+        value = self._value(field)
+        if value is _ABSENT:
+            raise KeyError(field)
+        return value
+
+    def __contains__(self, field):
+        return self._value(field) is not _ABSENT
+
+    def to_dict(self):
+        """Registro no formato JSON original"""
+        data = {}
+        extras = self._extras or {}
+        derived = self.derive(self) if self.DERIVED else {}
+        for field in self.LAYOUT:
+            if field in extras:
+                value = extras[field]
+            elif field in derived:
+                value = derived[field]
+            elif field in self.DERIVED:
+                continue
+            else:
+                value = getattr(self, field)
+                if value.__class__ is tuple:
+                    value = list(value)
+            if value is not _ABSENT:
+                data[field] = value
+        for field, value in extras.items():
+            if field not in self.LAYOUT and value is not _ABSENT:
+                data[field] = value
+        return data
+
+
+class Order(CompactRecord):
+    LAYOUT = ("numero", "cliente", "vendedor", "material", "fornecedor", "valor_total", "custo",
+              "valor_entrada", "valor_restante", "valor_estimado_lucro", "forma_pagamento", "data",
+              "status", "status_class")
+    INTERNED = frozenset({"cliente", "vendedor", "material", "fornecedor", "forma_pagamento", "data", "status"})
+    DERIVED = ("valor_entrada", "valor_restante", "valor_estimado_lucro", "status_class")
+    derive = staticmethod(_order_derived)
+    __slots__ = ("numero", "cliente", "vendedor", "material", "fornecedor", "valor_total", "custo",
+                 "forma_pagamento", "data", "status")
+
+
+class Compra(CompactRecord):
+    LAYOUT = ("id", "item", "fornecedor", "valor", "data", "observacao", "timestamp")
+    INTERNED = frozenset({"item", "fornecedor", "data"})
+    __slots__ = LAYOUT
+
+
+class ContaPagar(CompactRecord):
+    LAYOUT = ("id", "descricao", "valor", "vencimento", "categoria", "forma_pagamento", "status", "observacao",
+              "compra_id", "data_pagamento", "pago_por", "data_criacao", "criado_por", "timestamp")
+    INTERNED = frozenset({"vencimento", "categoria", "forma_pagamento", "status", "pago_por", "criado_por"})
+    __slots__ = LAYOUT
+
+
+class LedgerEntry(CompactRecord):
+    LAYOUT = ("id", "type", "tipo", "value", "valor", "description", "descricao", "date", "data", "status",
+              "order_id", "reference_id", "referencia", "category", "categoria", "compra_id", "conta_id",
+              "cliente", "observacao", "timestamp")
+    INTERNED = frozenset({"type", "tipo", "status", "category", "categoria", "cliente"})
+    __slots__ = LAYOUT
+
+
+# Índice por período (ano-mês)
+# Agrupa os registros de cada arquivo pelo prefixo YYYY-MM dos campos de data e, dentro
+# de cada mês, pelo status. Consultas mensais percorrem apenas os registros do mês.
+# O índice guarda só as posições dos registros (lidos dos registros residentes) e vale
+# para uma assinatura do arquivo. As gravações deste processo (inclusive as remarcações de data de
+# encerrar_mes e transferir_pedidos) aplicam ao índice apenas a diferença entre a
+# versão anterior e a nova, como os agregados; quando a versão anterior não está
+# disponível, ou o arquivo foi alterado por outro processo, o índice é refeito na
+# próxima consulta.
+PERIOD_FIELDS = {
+    ORDERS_FILE: ("data",),
+    COMPRAS_FILE: ("data",),
+    CONTAS_FILE: ("vencimento", "data_vencimento", "data_pagamento"),
+    FINANCIAL_FILE: ("date", "data"),
+}
+_period_indexes = {}
+_period_indexes_lock = threading.Lock()
+
+
+def _period_keys(file_path, record):
+    """(campo, mês, status) de cada entrada do registro no índice"""
+    if not isinstance(record, dict):
         return []
+    status = record.get("status")
+    return [(field, record[field][:7], status) for field in PERIOD_FIELDS[file_path]
+            if isinstance(record.get(field), str)]
+
+
+def _build_period_index(file_path, records):
+    index = {field: {} for field in PERIOD_FIELDS[file_path]}
+    for pos, record in enumerate(records):
+        for field, month, status in _period_keys(file_path, record):
+            index[field].setdefault(month, {}).setdefault(status, []).append(pos)
+    return len(records), index
+
+
+def _apply_period_changes(file_path, built, old, new):
+    """Novo índice a partir do índice de old, aplicando só os registros alterados em new.
+
+    As listas de entradas são copiadas antes de mudar (o índice anterior pode estar em
+    uso por outra thread); retorna None se as versões não puderem ser comparadas.
+    """
+    old_records, new_records = _records_of(file_path, old), _records_of(file_path, new)
+    if built[0] != len(old_records):
+        return None
+    index = {field: {month: dict(bucket) for month, bucket in months.items()}
+             for field, months in built[1].items()}
+    copied = set()
+
+    def entries(field, month, status):
+        key = (field, month, status)
+        bucket = index[field].setdefault(month, {})
+        if key not in copied:
+            bucket[status] = list(bucket.get(status, ()))
+            copied.add(key)
+        return bucket[status]
+
+    def remove(record, pos):
+        for field, month, status in _period_keys(file_path, record):
+            items = entries(field, month, status)
+            items[:] = [item for item in items if item != pos]
+
+    def add(record, pos):
+        for field, month, status in _period_keys(file_path, record):
+            entries(field, month, status).append(pos)
+
+    for op in _diff_records(old_records, new_records):
+        if op["op"] == "set":
+            remove(old_records[op["pos"]], op["pos"])
+            add(op["rec"], op["pos"])
+            continue
+        start, end = op["pos"], op["pos"] + op["del"]
+        for pos, record in enumerate(old_records[start:end], start):
+            remove(record, pos)
+        shift = len(op["ins"]) - op["del"]
+        if shift:
+            # Registros depois do trecho alterado mudam de posição
+            for months in index.values():
+                for bucket in months.values():
+                    for status, items in bucket.items():
+                        if any(pos >= end for pos in items):
+                            bucket[status] = [pos + shift if pos >= end else pos for pos in items]
+        for pos, record in enumerate(op["ins"], start):
+            add(record, pos)
+
+    for field, month, status in copied:
+        bucket = index[field].get(month)
+        if bucket is None or status not in bucket:
+            continue
+        if bucket[status]:
+            bucket[status].sort()
+        else:
+            del bucket[status]
+            if not bucket:
+                del index[field][month]
+    return len(new_records), index
+
+
+@after_save
+def _update_period_index(file_path, data, signature, previous):
+    if file_path not in PERIOD_FIELDS:
+        return
+    with _period_indexes_lock:
+        cached = _period_indexes.get(file_path)
+    if cached is None:
+        return
+    built = None
+    if previous is not None and cached[0] == previous[0]:
+        built = _apply_period_changes(file_path, cached[1], previous[1], data)
+    with _period_indexes_lock:
+        if built is None:
+            # Sem a versão anterior o índice é refeito na próxima consulta
+            _period_indexes.pop(file_path, None)
+        else:
+            _period_indexes[file_path] = (signature, built)
+
+
+def _get_period_index(file_path):
+    storage = get_storage()
+    signature = storage.signature(file_path) if storage.exists(file_path) else None
+    with _period_indexes_lock:
+        cached = _period_indexes.get(file_path)
+    if cached is None or cached[0] != signature:
+        # Dados preparados em uma transação não entram no índice guardado
+        tx = current_transaction()
+        staged = tx is not None and file_path in tx.staged
+        records_signature, records = resident_records(file_path)
+        cached = (records_signature, _build_period_index(file_path, records))
+        if not staged:
+            with _period_indexes_lock:
+                _period_indexes[file_path] = cached
+    return cached[1]
+
+
+def _period_entries(index, field, periodo, status=None, exclude=None):
+    """Posições, em ordem, dos registros nos meses do período (sem filtrar o dia)"""
+    months = index[field]
+    if len(periodo) >= 7:
+        buckets = [months.get(periodo[:7], {})]
+    else:
+        buckets = [bucket for month, bucket in months.items() if month.startswith(periodo)]
+
+    entries = []
+    for bucket in buckets:
+        for record_status, items in bucket.items():
+            if status is not None and record_status not in status:
+                continue
+            if exclude is not None and record_status in exclude:
+                continue
+            entries.extend(items)
+    entries.sort()
+    return entries
+
+
+def period_records(file_path, field, periodo, status=None, exclude=None):
+    """Registros cujo campo começa com o período, na ordem do arquivo.
+
+    Os registros são os residentes e não devem ser modificados.
+    """
+    storage = get_storage()
+    tx = current_transaction()
+    if isinstance(storage, PartitionedStorage) and storage.is_partition_field(file_path, field) \
+            and (tx is None or file_path not in tx.staged):
+        # No layout particionado basta abrir as partições do período
+        return [
+            record for record in storage.read_period(file_path, periodo)
+            if isinstance(record, dict) and isinstance(record.get(field), str)
+            and record[field].startswith(periodo)
+            and (status is None or record.get("status") in status)
+            and (exclude is None or record.get("status") not in exclude)
+        ]
+
+    _, records = resident_records(file_path)
+    return [records[pos] for pos in period_positions(file_path, records, field, periodo, status, exclude)]
+
+
+def period_positions(file_path, records, field, periodo, status=None, exclude=None):
+    """Posições, na lista recebida, dos registros do período (para alterá-los)"""
+    tx = current_transaction()
+    length, index = _get_period_index(file_path)
+    if length == len(records) and (tx is None or file_path not in tx.staged):
+        positions = _period_entries(index, field, periodo, status, exclude)
+        if len(periodo) > 7:
+            positions = [pos for pos in positions
+                         if isinstance(records[pos], dict) and str(records[pos].get(field)).startswith(periodo)]
+        return positions
+    return [
+        pos for pos, record in enumerate(records)
+        if isinstance(record, dict) and isinstance(record.get(field), str)
+        and record[field].startswith(periodo)
+        and (status is None or record.get("status") in status)
+        and (exclude is None or record.get("status") not in exclude)
+    ]
+
+
+def apply_record_changes(old, new, apply):
+    """Chama apply(registro, -1) para cada registro removido e apply(registro, 1) para
+    cada registro incluído entre duas versões de uma lista. Retorna False (sem chamar
+    nada) se alguma das versões não for uma lista."""
+    if not isinstance(old, list) or not isinstance(new, list):
+        return False
+    for op in _diff_records(old, new):
+        if op["op"] == "set":
+            apply(old[op["pos"]], -1)
+            apply(op["rec"], 1)
+        else:
+            for record in old[op["pos"]:op["pos"] + op["del"]]:
+                apply(record, -1)
+            for record in op["ins"]:
+                apply(record, 1)
+    return True
+
+
+# Agregados mensais do dashboard
+# data/agregados.json guarda, por mês (YYYY-MM), a contagem e as somas de valor_total,
+# custo e valor_restante das ordens por status, e o total das contas pendentes por
+# vencimento. Cada gravação de ordens ou contas aplica apenas a diferença entre a
+# versão anterior e a nova; quando a versão anterior não está disponível (ou os
+# agregados foram calculados sobre outra versão do arquivo) a coleção é recalculada.
+# As somas são guardadas como Decimal (em texto) para que somar e subtrair deltas não
+# acumule erro de ponto flutuante.
+AGGREGATE_SOURCES = {
+    ORDERS_FILE: "ordens",
+    CONTAS_FILE: "contas",
+}
+ORDER_MEASURES = ("valor_total", "custo", "valor_restante")
+_aggregates_cache = {"signature": None, "state": None}
+_aggregates_cache_lock = threading.Lock()
+
+
+def _as_decimal(value):
+    try:
+        return Decimal(str(float(value or 0)))
+    except (TypeError, ValueError, InvalidOperation):
+        return Decimal(0)
+
+
+def _order_contribution(order):
+    if not isinstance(order, dict) or not isinstance(order.get("data"), str):
+        return None
+    status = order.get("status")
+    values = [_as_decimal(order.get(field, 0)) for field in ORDER_MEASURES]
+    return order["data"][:7], "" if status is None else str(status), values
+
+
+def _conta_contribution(conta):
+    if not isinstance(conta, dict) or not isinstance(conta_vencimento(conta), str) \
+            or conta.get("status") != "Pendente":
+        return None
+    return conta_vencimento(conta)[:7], "Pendente", [_as_decimal(conta.get("valor", 0))]
+
+
+def _apply_contribution(state, source, record, sign):
+    contribution = (_order_contribution if source == "ordens" else _conta_contribution)(record)
+    if contribution is None:
+        return
+    month, status, values = contribution
+    fields = ORDER_MEASURES if source == "ordens" else ("valor",)
+    row = state[source].setdefault(month, {}).setdefault(
+        status, dict({"quantidade": 0}, **{field: "0" for field in fields}))
+    row["quantidade"] += sign
+    for field, value in zip(fields, values):
+        row[field] = str(Decimal(row[field]) + sign * value)
+    if row["quantidade"] == 0:
+        del state[source][month][status]
+        if not state[source][month]:
+            del state[source][month]
+
+
+def _compute_source(state, file_path, data):
+    source = AGGREGATE_SOURCES[file_path]
+    state[source] = {}
+    for record in data if isinstance(data, list) else []:
+        _apply_contribution(state, source, record, 1)
+
+
+def _empty_aggregates():
+    return {"fontes": {}, **{source: {} for source in AGGREGATE_SOURCES.values()}}
+
+
+def _read_aggregates():
+    if not os.path.exists(AGGREGATES_FILE):
+        return _empty_aggregates()
+    signature = _file_signature(AGGREGATES_FILE)
+    with _aggregates_cache_lock:
+        if _aggregates_cache["signature"] == signature:
+            return pickle.loads(_aggregates_cache["state"])
+    with open(AGGREGATES_FILE, 'r') as f:
+        state = json.load(f)
+    with _aggregates_cache_lock:
+        _aggregates_cache.update(signature=signature, state=pickle.dumps(state))
+    return state
+
+
+def _write_aggregates(state):
+    _atomic_write(AGGREGATES_FILE, lambda f: json.dump(state, f, indent=2, sort_keys=True))
+
+
+@after_save
+def _update_aggregates(file_path, data, signature, previous):
+    if file_path not in AGGREGATE_SOURCES:
+        return
+    storage = get_storage()
+    source = AGGREGATE_SOURCES[file_path]
+    name = os.path.basename(file_path)
+    with data_lock(AGGREGATES_FILE):
+        state = _read_aggregates()
+        base = json.loads(json.dumps(previous[0])) if previous is not None else None
+        if base is None or state["fontes"].get(name) != base or not apply_record_changes(
+                previous[1], data, functools.partial(_apply_contribution, state, source)):
+            _compute_source(state, file_path, data)
+        state["fontes"][name] = _comparable_signature(storage, file_path)
+        _write_aggregates(state)
+
+
+def rebuild_aggregates(file_paths=None):
+    """Recalcula os agregados a partir dos dados brutos"""
+    storage = get_storage()
+    file_paths = list(file_paths or AGGREGATE_SOURCES)
+    with data_lock(*file_paths):
+        with data_lock(AGGREGATES_FILE):
+            state = _read_aggregates()
+            for file_path in file_paths:
+                _compute_source(state, file_path, load_data(file_path))
+                state["fontes"][os.path.basename(file_path)] = _comparable_signature(storage, file_path)
+            _write_aggregates(state)
+            return state
+
+
+def get_aggregates():
+    """Agregados em dia com os arquivos atuais (recalcula as coleções desatualizadas)"""
+    storage = get_storage()
+    state = _read_aggregates()
+    stale = [file_path for file_path in AGGREGATE_SOURCES
+             if state["fontes"].get(os.path.basename(file_path)) != _comparable_signature(storage, file_path)]
+    return rebuild_aggregates(stale) if stale else state
+
+
+def verify_aggregates():
+    """Compara os agregados mantidos com um recálculo completo; retorna as diferenças"""
+    stored = get_aggregates()
+    expected = _empty_aggregates()
+    for file_path in AGGREGATE_SOURCES:
+        _compute_source(expected, file_path, load_data(file_path))
+
+    differences = []
+    for source in AGGREGATE_SOURCES.values():
+        for month in sorted(set(stored[source]) | set(expected[source])):
+            rows, expected_rows = stored[source].get(month, {}), expected[source].get(month, {})
+            for status in sorted(set(rows) | set(expected_rows)):
+                row, expected_row = rows.get(status, {}), expected_rows.get(status, {})
+                for field in sorted(set(row) | set(expected_row)):
+                    if Decimal(str(row.get(field, 0))) != Decimal(str(expected_row.get(field, 0))):
+                        differences.append((source, month, status, field, row.get(field, 0),
+                                            expected_row.get(field, 0)))
+    return differences
+
+
+def month_aggregates(periodo):
+    """Linhas agregadas do mês: (ordens por status, contas pendentes), somas em Decimal"""
+    state = get_aggregates()
+
+    def rows(source):
+        return {status: {field: value if field == "quantidade" else Decimal(value) for field, value in row.items()}
+                for status, row in state[source].get(periodo, {}).items()}
+    return rows("ordens"), rows("contas")
+
+
+# Agregação colunar para os relatórios
+# Cada coleção é carregada uma vez em colunas: valores em array('d'), status como
+# códigos internados e datas como dias desde 1970-01-01, com as linhas ordenadas por
+# data. Uma consulta de período localiza o intervalo por busca binária e calcula, em
+# uma única passada, a contagem e as somas das medidas pedidas agrupadas por status.
+# As tabelas ficam em memória enquanto a assinatura do arquivo não muda.
+COLUMN_LAYOUT = {
+    ORDERS_FILE: (("data",), ("valor_total", "custo", "valor_restante")),
+    COMPRAS_FILE: (("data",), ("valor",)),
+    CONTAS_FILE: (("vencimento", "data_pagamento"), ("valor",)),
+}
+NO_DATE = -(2 ** 31)
+_EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()
+_status_codes = {}
+_status_names = []
+_column_tables = {}
+_column_tables_lock = threading.Lock()
+
+
+def conta_vencimento(conta):
+    """Vencimento da conta (registros vindos do frontend antigo usam data_vencimento)"""
+    return conta.get("vencimento") or conta.get("data_vencimento")
+
+
+def _status_code(status):
+    name = "" if status is None else sys.intern(str(status))
+    code = _status_codes.get(name)
+    if code is None:
+        with _column_tables_lock:
+            code = _status_codes.setdefault(name, len(_status_names))
+            if code == len(_status_names):
+                _status_names.append(name)
+    return code
+
+
+def _epoch_day(value):
+    if not isinstance(value, str) or not _MONTH_PATTERN.match(value):
+        return NO_DATE
+    try:
+        return datetime.date.fromisoformat(value[:10]).toordinal() - _EPOCH_ORDINAL
+    except ValueError:
+        # Dia ausente ou inválido: conta no primeiro dia do mês
+        try:
+            return datetime.date(int(value[:4]), int(value[5:7]), 1).toordinal() - _EPOCH_ORDINAL
+        except ValueError:
+            return NO_DATE
+
+
+def month_range(ano, mes):
+    """Intervalo [início, fim) do mês em dias desde 1970-01-01"""
+    start = datetime.date(ano, mes, 1)
+    end = datetime.date(ano + 1, 1, 1) if mes == 12 else datetime.date(ano, mes + 1, 1)
+    return start.toordinal() - _EPOCH_ORDINAL, end.toordinal() - _EPOCH_ORDINAL
+
+
+class ColumnTable:
+    """Registros de uma coleção em colunas, ordenados por cada campo de data"""
+
+    def __init__(self, file_path, records):
+        date_fields, measures = COLUMN_LAYOUT[file_path]
+        self.records = [record for record in records if isinstance(record, dict)]
+        self.status = array('H', (_status_code(record.get("status")) for record in self.records))
+        self.money = {
+            field: array('d', (_as_float(record.get(field, 0)) for record in self.records))
+            for field in measures
+        }
+        self.sorted = {}
+        for field in date_fields:
+            if file_path == CONTAS_FILE and field == "vencimento":
+                days = [_epoch_day(conta_vencimento(record)) for record in self.records]
+            else:
+                days = [_epoch_day(record.get(field)) for record in self.records]
+            positions = sorted(range(len(days)), key=days.__getitem__)
+            self.sorted[field] = (array('l', (days[pos] for pos in positions)), array('l', positions))
+
+    def _positions(self, date_field, start, end):
+        days, positions = self.sorted[date_field]
+        return positions[bisect_left(days, start):bisect_left(days, end)]
+
+    def aggregate(self, date_field, start, end, measures, status=None, exclude=None):
+        """Contagem e somas por status das linhas com data em [start, end)"""
+        columns = [self.money[field] for field in measures]
+        codes = self.status
+        size = len(_status_names)
+        counts = [0] * size
+        sums = [[0.0] * size for _ in measures]
+        for pos in self._positions(date_field, start, end):
+            code = codes[pos]
+            counts[code] += 1
+            for column, total in zip(columns, sums):
+                total[code] += column[pos]
+
+        groups = {}
+        for code, count in enumerate(counts):
+            name = _status_names[code]
+            if count and (status is None or name in status) and (exclude is None or name not in exclude):
+                groups[name] = dict({"quantidade": count},
+                                    **{field: total[code] for field, total in zip(measures, sums)})
+        return groups
+
+    def rows(self, date_field, start, end, status=None):
+        """Registros com data em [start, end), ordenados por data.
+
+        Os registros pertencem à tabela e não devem ser modificados.
+        """
+        return list(self.iter_rows(date_field, start, end, status))
+
+    def iter_rows(self, date_field, start, end, status=None):
+        """Como rows, mas produzindo os registros um a um"""
+        records = self.records
+        wanted = None if status is None else {_status_code(name) for name in status}
+        codes = self.status
+        for pos in self._positions(date_field, start, end):
+            if wanted is None or codes[pos] in wanted:
+                yield records[pos]
+
+
+def _as_float(value):
+    try:
+        return float(value or 0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def column_table(file_path):
+    """Tabela colunar da versão atual do arquivo (ou dos dados preparados na transação)"""
+    tx = current_transaction()
+    if tx is not None and file_path in tx.staged:
+        return ColumnTable(file_path, load_data(file_path))
+
+    storage = get_storage()
+    signature = storage.signature(file_path) if storage.exists(file_path) else None
+    with _column_tables_lock:
+        cached = _column_tables.get(file_path)
+    if cached is not None and cached[0] == signature:
+        return cached[1]
+    # A tabela aponta para os registros residentes em vez de guardar uma cópia
+    signature, records = resident_records(file_path)
+    table = ColumnTable(file_path, records)
+    with _column_tables_lock:
+        _column_tables[file_path] = (signature, table)
+    return table
+
+
+def group_total(groups, field, status=None, exclude=None):
+    """Soma de uma medida sobre os grupos de status selecionados"""
+    return sum(row[field] for name, row in groups.items()
+               if (status is None or name in status) and (exclude is None or name not in exclude))
+
+
+def resumo_ordens(groups):
+    """Indicadores das ordens a partir das linhas agrupadas por status.
+
+    Aceita tanto os grupos do motor colunar quanto as linhas de agregados mantidos,
+    para que o dashboard e o financeiro usem a mesma definição de cada indicador.
+    """
+    receita = group_total(groups, "valor_total", status=["Finalizada"])
+    custos = group_total(groups, "custo", status=["Finalizada"])
+    return {
+        "total_orders": group_total(groups, "quantidade"),
+        "orders_em_producao": group_total(groups, "quantidade", status=["Em Produção"]),
+        "orders_aguardando": group_total(groups, "quantidade", status=["Aguardando Aprovação", "Aguardando Pagamento"]),
+        "orders_finalizados": group_total(groups, "quantidade", status=["Finalizada"]),
+        "orders_retirada": group_total(groups, "quantidade", status=["Disponível para Retirada"]),
+        "receita_total": float(receita),
+        "custos_total": float(custos),
+        "lucro_total": float(receita - custos),
+        "valores_receber": float(group_total(groups, "valor_restante", exclude=["Finalizada", "Cancelada"])),
+    }
+
+
+# Índice de agrupamento para os gráficos
+# Contagem e soma de valor_total das ordens por (mês, status, nome) para cada
+# dimensão (material e vendedor). Fica em memória, é atualizado pela diferença entre
+# versões a cada gravação deste processo e refeito quando outro processo altera o
+# arquivo de ordens.
+GROUP_DIMENSIONS = ("material", "vendedor")
+_group_index = {"signature": None, "grupos": None}
+_group_index_lock = threading.Lock()
+
+
+def _group_keys(order, dimension):
+    value = order.get(dimension)
+    if dimension == "material":
+        values = value if isinstance(value, list) else [value]
+    else:
+        values = [value]
+    return [item.strip() for item in values if isinstance(item, str) and item.strip()]
+
+
+def _apply_group_contribution(groups, order, sign):
+    if not isinstance(order, dict):
+        return
+    data = order.get("data")
+    month = data[:7] if isinstance(data, str) and _MONTH_PATTERN.match(data) else ""
+    status = "" if order.get("status") is None else str(order.get("status"))
+    valor = _as_float(order.get("valor_total", 0))
+    for dimension in GROUP_DIMENSIONS:
+        cells = groups[dimension]
+        for name in _group_keys(order, dimension):
+            key = (month, status, name)
+            cell = cells.setdefault(key, [0, 0.0])
+            cell[0] += sign
+            cell[1] += sign * valor
+            if cell[0] == 0:
+                del cells[key]
+
+
+def _build_group_index(orders):
+    groups = {dimension: {} for dimension in GROUP_DIMENSIONS}
+    for order in orders if isinstance(orders, list) else []:
+        _apply_group_contribution(groups, order, 1)
+    return groups
+
+
+@after_save
+def _update_group_index(file_path, data, signature, previous):
+    if file_path != ORDERS_FILE:
+        return
+    with _group_index_lock:
+        groups = _group_index["grupos"]
+        if groups is None:
+            return
+        if previous is None or _group_index["signature"] != previous[0] or not apply_record_changes(
+                previous[1], data, functools.partial(_apply_group_contribution, groups)):
+            groups = _build_group_index(data)
+        _group_index.update(signature=signature, grupos=groups)
+
+
+def group_totals(dimension, periodo=None, status=None, exclude=None):
+    """Totais por nome na dimensão: {nome: [quantidade, valor_total]}"""
+    storage = get_storage()
+    signature = storage.signature(ORDERS_FILE) if storage.exists(ORDERS_FILE) else None
+    with _group_index_lock:
+        if _group_index["grupos"] is None or _group_index["signature"] != signature:
+            _group_index.update(signature=signature, grupos=_build_group_index(load_data(ORDERS_FILE)))
+        cells = list(_group_index["grupos"][dimension].items())
+
+    totals = {}
+    for (month, cell_status, name), (count, valor) in cells:
+        if periodo and not month.startswith(periodo):
+            continue
+        if (status and cell_status not in status) or (exclude and cell_status in exclude):
+            continue
+        entry = totals.setdefault(name, [0, 0.0])
+        entry[0] += count
+        entry[1] += valor
+    return totals
+
+
+# Sessões
+# SESSION_BACKEND decide onde fica a sessão (logged_in, username, user_role). "sqlite"
+# (padrão) e "memoria" guardam a sessão no servidor e o cookie leva só um identificador
+# aleatório; a sessão expira após SESSION_TTL segundos sem uso e as expiradas são
+# removidas a cada SESSION_GC_INTERVAL segundos. "cookie" guarda o conteúdo (inclusive
+# o papel do usuário) no próprio cookie, assinado com a secret_key: quem conhece a chave
+# forja sessões de admin, por isso esse backend só inicia com CUBO_SECRET_KEY definida
+# explicitamente (e a mesma chave em todos os hosts). "filesystem" é o backend anterior
+# (Flask-Session), que grava um arquivo por sessão e nunca os remove.
+class StoredSession(SecureCookieSession):
+    def __init__(self, initial=None, sid=None, new=False, expires=None):
+        super().__init__(initial)
+        self.sid = sid
+        self.new = new
+        self.expires = expires
+
+
+class MemorySessionStore:
+    """Sessões em um LRU com expiração, válido apenas para um processo"""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._sessions = OrderedDict()
+
+    def get(self, sid):
+        with self._lock:
+            item = self._sessions.get(sid)
+            if item is None:
+                return None
+            if item[0] <= time.time():
+                del self._sessions[sid]
+                return None
+            self._sessions.move_to_end(sid)
+            return item
+
+    def put(self, sid, data, expires):
+        with self._lock:
+            self._sessions[sid] = (expires, data)
+            self._sessions.move_to_end(sid)
+            while len(self._sessions) > self.max_entries:
+                self._sessions.popitem(last=False)
+
+    def touch(self, sid, expires):
+        with self._lock:
+            item = self._sessions.get(sid)
+            if item is not None:
+                self._sessions[sid] = (expires, item[1])
+
+    def delete(self, sid):
+        with self._lock:
+            self._sessions.pop(sid, None)
+
+    def gc(self):
+        now = time.time()
+        with self._lock:
+            expired = [sid for sid, (expires, _) in self._sessions.items() if expires <= now]
+            for sid in expired:
+                del self._sessions[sid]
+        return len(expired)
+
+    def count(self):
+        with self._lock:
+            return len(self._sessions)
+
+
+class SqliteSessionStore:
+    """Sessões em uma tabela SQLite indexada pela expiração, compartilhada entre workers"""
+    serializer = TaggedJSONSerializer()
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._local = threading.local()
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS sessoes "
+                         "(id TEXT PRIMARY KEY, dados TEXT NOT NULL, expira_em REAL NOT NULL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_sessoes_expira_em ON sessoes (expira_em)")
+            self._local.conn = conn
+        return conn
+
+    def get(self, sid):
+        row = self._connect().execute("SELECT expira_em, dados FROM sessoes WHERE id = ? AND expira_em > ?",
+                                      (sid, time.time())).fetchone()
+        return (row[0], self.serializer.loads(row[1])) if row else None
+
+    def put(self, sid, data, expires):
+        self._connect().execute("INSERT OR REPLACE INTO sessoes (id, dados, expira_em) VALUES (?, ?, ?)",
+                                (sid, self.serializer.dumps(data), expires))
+
+    def touch(self, sid, expires):
+        self._connect().execute("UPDATE sessoes SET expira_em = ? WHERE id = ?", (expires, sid))
+
+    def delete(self, sid):
+        self._connect().execute("DELETE FROM sessoes WHERE id = ?", (sid,))
+
+    def gc(self):
+        return self._connect().execute("DELETE FROM sessoes WHERE expira_em <= ?", (time.time(),)).rowcount
+
+    def count(self):
+        return self._connect().execute("SELECT COUNT(*) FROM sessoes WHERE expira_em > ?",
+                                       (time.time(),)).fetchone()[0]
+
+
+class ServerSessionInterface(SessionInterface):
+    """Sessão guardada em um store do servidor; o cookie leva só o identificador"""
+
+    def __init__(self, store):
+        self.store = store
+        self._last_gc = time.monotonic()
+
+    def _collect_garbage(self, app):
+        now = time.monotonic()
+        if now - self._last_gc < app.config["SESSION_GC_INTERVAL"]:
+            return
+        self._last_gc = now
+        try:
+            removed = self.store.gc()
+            if removed:
+                logger.info(f"{removed} sessões expiradas removidas")
+        except Exception as e:
+            logger.error(f"Erro ao remover sessões expiradas: {e}")
+
+    def open_session(self, app, request):
+        self._collect_garbage(app)
+        sid = request.cookies.get(self.get_cookie_name(app))
+        item = self.store.get(sid) if sid else None
+        if item is None:
+            # Um identificador desconhecido nunca é reaproveitado (fixação de sessão)
+            return StoredSession(sid=secrets.token_urlsafe(32), new=True)
+        return StoredSession(item[1], sid=sid, expires=item[0])
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        secure = self.get_cookie_secure(app)
+        samesite = self.get_cookie_samesite(app)
+        httponly = self.get_cookie_httponly(app)
+
+        if session.accessed:
+            response.vary.add("Cookie")
+
+        # Sessão esvaziada (logout): remove do store e apaga o cookie
+        if not session:
+            if session.modified:
+                if not session.new:
+                    self.store.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path, secure=secure,
+                                       samesite=samesite, httponly=httponly)
+                response.vary.add("Cookie")
+            return
+
+        now = time.time()
+        ttl = app.config["SESSION_TTL"]
+        if session.modified or session.new:
+            self.store.put(session.sid, dict(session), now + ttl)
+            response.set_cookie(name, session.sid, expires=self.get_expiration_time(app, session),
+                                httponly=httponly, domain=domain, path=path, secure=secure, samesite=samesite)
+            response.vary.add("Cookie")
+        elif session.expires - now < ttl * 0.9:
+            # A expiração é renovada no máximo uma vez a cada 10% do TTL
+            self.store.touch(session.sid, now + ttl)
+
+
+SESSION_BACKENDS = ("cookie", "memoria", "sqlite", "filesystem")
+
+
+def build_session_interface(backend):
+    if backend == "cookie":
+        if not os.environ.get("CUBO_SECRET_KEY"):
+            raise RuntimeError("O backend de sessão cookie exige CUBO_SECRET_KEY com uma chave secreta própria")
+        return SecureCookieSessionInterface()
+    if backend == "memoria":
+        return ServerSessionInterface(MemorySessionStore(app.config["SESSION_MAX_ENTRIES"]))
+    if backend == "sqlite":
+        return ServerSessionInterface(SqliteSessionStore(app.config["SESSION_SQLITE_PATH"]))
+    if backend == "filesystem":
+        if Session is None:
+            raise ValueError("Backend de sessão filesystem requer o pacote Flask-Session")
+        previous = app.session_interface
+        Session(app)
+        interface, app.session_interface = app.session_interface, previous
+        return interface
+    raise ValueError(f"Backend de sessão desconhecido: {backend}")
+
+
+def get_session_stats():
+    store = getattr(app.session_interface, "store", None)
+    stats = {"backend": app.config["SESSION_BACKEND"]}
+    if store is not None:
+        stats["ativas"] = store.count()
+    return stats
+
+
+app.session_interface = build_session_interface(app.config["SESSION_BACKEND"])
+
+
+# Diretório de usuários
+# O /login consulta um índice nome -> usuário mantido em memória e refeito apenas quando
+# a assinatura de users.json muda. Como cada verificação de senha custa centenas de
+# milissegundos de CPU, as falhas recentes são contadas por usuário e por IP (em cada
+# worker) e, acima do limite, a tentativa é recusada antes de qualquer hash; um
+# semáforo limita ainda quantas verificações rodam ao mesmo tempo.
+class LoginThrottled(Exception):
+    def __init__(self, retry_after):
+        super().__init__(f"Tente novamente em {retry_after:.0f}s")
+        self.retry_after = max(1, int(retry_after + 0.999))
+
+
+class LoginThrottle:
+    """Instantes das falhas recentes por chave, em uma janela deslizante"""
+    max_keys = 10000
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._failures = OrderedDict()
+
+    def retry_after(self, key, limit, window):
+        """Segundos até a chave voltar a ser aceita (0 se não estiver bloqueada)"""
+        with self._lock:
+            now = time.monotonic()
+            failures = self._failures.get(key)
+            if failures is None:
+                return 0
+            while failures and failures[0] <= now - window:
+                failures.popleft()
+            if not failures:
+                del self._failures[key]
+                return 0
+            if len(failures) < limit:
+                return 0
+            return failures[-limit] + window - now
+
+    def record_failure(self, key):
+        with self._lock:
+            failures = self._failures.pop(key, None) or deque()
+            failures.append(time.monotonic())
+            self._failures[key] = failures
+            # Tentativas com nomes aleatórios não fazem a tabela crescer sem limite
+            while len(self._failures) > self.max_keys:
+                self._failures.popitem(last=False)
+
+    def reset(self, key):
+        with self._lock:
+            self._failures.pop(key, None)
+
+    def count(self):
+        with self._lock:
+            return len(self._failures)
+
+
+@functools.lru_cache(maxsize=None)
+def _reference_hash(method):
+    """Hash de uma senha aleatória: usado contra usuários inexistentes e para saber o
+    prefixo (método e parâmetros) que os hashes gerados com o método têm"""
+    if method is None:
+        return generate_password_hash(uuid.uuid4().hex)
+    return generate_password_hash(uuid.uuid4().hex, method)
+
+
+class UserDirectory:
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.throttle = LoginThrottle()
+        self._lock = threading.Lock()
+        self._signature = False
+        self._users = []
+        self._index = {}
+        self._hash_slots = None
+
+    def _load(self):
+        # Assinatura lida antes do conteúdo, como em load_data
+        signature = _file_signature(self.file_path) if os.path.exists(self.file_path) else None
+        with self._lock:
+            if signature != self._signature:
+                users = []
+                if signature is not None:
+                    try:
+                        with open(self.file_path, 'r') as f:
+                            users = json.load(f)
+                    except Exception as e:
+                        logger.error(f"Erro ao carregar usuários: {e}")
+                        return [], {}
+                index = {}
+                for user in users:
+                    if isinstance(user, dict):
+                        index.setdefault(user.get("username"), user)
+                self._users, self._index, self._signature = users, index, signature
+            return self._users, self._index
+
+    def all(self):
+        return [dict(user) if isinstance(user, dict) else user for user in self._load()[0]]
+
+    def get(self, username):
+        user = self._load()[1].get(username)
+        return dict(user) if user is not None else None
+
+    def save(self, users):
+        with data_lock(self.file_path):
+            _atomic_write(self.file_path, lambda f: json.dump(users, f, indent=2))
+        with self._lock:
+            self._signature = False
+
+    def update_user(self, username, **changes):
+        """Altera campos de um usuário relendo o arquivo sob bloqueio"""
+        with data_lock(self.file_path):
+            with open(self.file_path, 'r') as f:
+                users = json.load(f)
+            for user in users:
+                if isinstance(user, dict) and user.get("username") == username:
+                    user.update(changes)
+                    break
+            else:
+                return False
+            _atomic_write(self.file_path, lambda f: json.dump(users, f, indent=2))
+        with self._lock:
+            self._signature = False
+        return True
+
+    @staticmethod
+    def hash_password(password):
+        method = app.config["PASSWORD_HASH_METHOD"]
+        if method is None:
+            return generate_password_hash(password)
+        return generate_password_hash(password, method)
+
+    @staticmethod
+    def needs_rehash(password_hash):
+        # Só há migração quando o método foi escolhido em CUBO_PASSWORD_HASH_METHOD;
+        # com o padrão do werkzeug os hashes existentes ficam como estão
+        method = app.config["PASSWORD_HASH_METHOD"]
+        if method is None:
+            return False
+        return password_hash.split("$", 1)[0] != _reference_hash(method).split("$", 1)[0]
+
+    def _slots(self):
+        if self._hash_slots is None:
+            self._hash_slots = threading.BoundedSemaphore(max(1, app.config["LOGIN_MAX_CONCURRENT"]))
+        return self._hash_slots
+
+    def authenticate(self, username, password, remote_addr):
+        """Usuário autenticado (cópia) ou None; LoginThrottled se a tentativa for recusada"""
+        window = app.config["LOGIN_WINDOW"]
+        keys = ((f"usuario:{username}", app.config["LOGIN_MAX_FAILURES_USER"]),
+                (f"ip:{remote_addr}", app.config["LOGIN_MAX_FAILURES_IP"]))
+        wait = max(self.throttle.retry_after(key, limit, window) for key, limit in keys)
+        if wait > 0:
+            raise LoginThrottled(wait)
+
+        user = self.get(username) if username else None
+        stored_hash = user.get("password_hash") if user else None
+        valid = False
+        if username and password:
+            if not self._slots().acquire(timeout=5):
+                raise LoginThrottled(5)
+            try:
+                # Usuários inexistentes também pagam uma verificação: o tempo de resposta
+                # não revela quais nomes existem
+                reference = _reference_hash(app.config["PASSWORD_HASH_METHOD"])
+                valid = check_password_hash(stored_hash or reference, password) and bool(stored_hash)
+            finally:
+                self._slots().release()
+
+        if not valid:
+            for key, _ in keys:
+                self.throttle.record_failure(key)
+            return None
+
+        self.throttle.reset(keys[0][0])
+        if self.needs_rehash(stored_hash):
+            if self.update_user(username, password_hash=self.hash_password(password)):
+                logger.info(f"Hash da senha de {username} refeito com {app.config['PASSWORD_HASH_METHOD']}")
+        return user
+
+    def stats(self):
+        return {"usuarios": len(self._load()[1]), "chaves_com_falhas": self.throttle.count()}
+
+
+user_directory = UserDirectory(USERS_FILE)
 
 
 # Rotas de autenticação
@@ -94,32 +3310,27 @@ def index():
 @app.route("/login", methods=["GET", "POST"])
 def login():
     if request.method == "POST":
-        username = request.form.get("username")
-        password = request.form.get("password")
-
-        logger.info(f"Tentativa de login para usuário: {username}")
-
-        users = load_users()
-        logger.info(f"Usuários carregados: {len(users)} usuários encontrados")
-
-        for user in users:
-            if user.get("username") == username:
-                logger.info("Usuário encontrado, verificando senha")
-                stored_hash = user.get("password_hash", "")
-                logger.info(f"Hash armazenado: {stored_hash}")
-
-                if check_password_hash(stored_hash, password):
-                    logger.info("Senha correta, autenticando usuário")
-                    session["logged_in"] = True
-                    session["username"] = username
-                    session["user_role"] = user.get("role", "vendedor")
-                    return redirect(url_for("index"))
-                else:
-                    logger.warning("Senha incorreta")
-                    return render_template("login.html", error="Usuário ou senha incorretos")
+        username = request.form.get("username") or ""
+        password = request.form.get("password") or ""
 
-        logger.warning("Usuário não encontrado")
-        return render_template("login.html", error="Usuário ou senha incorretos")
+        try:
+            user = user_directory.authenticate(username, password, request.remote_addr)
+        except LoginThrottled as e:
+            logger.warning(f"Login recusado por excesso de tentativas: {username} ({request.remote_addr})")
+            response = make_response(render_template(
+                "login.html", error="Muitas tentativas de login. Aguarde alguns minutos e tente novamente."), 429)
+            response.headers["Retry-After"] = str(e.retry_after)
+            return response
+
+        if user is None:
+            logger.warning(f"Falha de login para usuário: {username} ({request.remote_addr})")
+            return render_template("login.html", error="Usuário ou senha incorretos")
+
+        logger.info(f"Login de {username}")
+        session["logged_in"] = True
+        session["username"] = username
+        session["user_role"] = user.get("role", "vendedor")
+        return redirect(url_for("index"))
 
     return render_template("login.html")
 
@@ -132,34 +3343,163 @@ def logout():
 
 # API para ordens de serviço
 @app.route("/api/orders", methods=["GET"])
+@with_etag(ORDERS_FILE)
 def get_orders():
     if not session.get("logged_in"):
         return jsonify({"error": "Unauthorized"}), 401
 
+    if "since" in request.args:
+        return since_response(ORDERS_FILE, _decorate_order)
+
     orders = load_data(ORDERS_FILE)
 
-    # Adiciona classes CSS para status
-    for order in orders:
-        if isinstance(order, dict):
-            status = order.get("status", "")
-            if status == "Aguardando Aprovação":
-                order["status_class"] = "status-aprovacao"
-            elif status == "Aguardando Pagamento":
-                order["status_class"] = "status-pagamento"
-            elif status == "Em Produção":
-                order["status_class"] = "status-producao"
-            elif status == "Disponível para Retirada":
-                order["status_class"] = "status-retirada"
-            elif status == "Finalizada":
-                order["status_class"] = "status-finalizada"
-            elif status == "Cancelada":
-                order["status_class"] = "status-cancelada"
-
-            # Garante que o campo material seja uma lista
-            if "material" in order and not isinstance(order["material"], list):
-                order["material"] = [order["material"]]
-
-    return jsonify(orders)
+    # Sem parâmetros de consulta, mantém a resposta original (lista completa)
+    if not any(param in request.args for param in ORDER_QUERY_PARAMS):
+        for order in orders:
+            if isinstance(order, dict):
+                _decorate_order(order)
+        return jsonify(orders)
+
+    try:
+        query = _parse_order_query(request.args)
+    except ValueError as e:
+        return jsonify({"error": f"Parâmetros inválidos: {str(e)}"}), 400
+
+    # Filtra e ordena; a posição no arquivo desempata e identifica a ordem no cursor
+    sort_key = ORDER_SORT_KEYS[query["ordenar"]] if query["ordenar"] else None
+    matches = [
+        ((sort_key(order) if sort_key else 0, pos), order)
+        for pos, order in enumerate(orders)
+        if isinstance(order, dict) and _order_matches(order, query)
+    ]
+    descending = query["direcao"] == "desc"
+    matches.sort(key=lambda item: item[0], reverse=descending)
+
+    page = matches
+    if query["cursor"] is not None:
+        after = query["cursor"]
+        page = [item for item in matches if (item[0] < after if descending else item[0] > after)]
+    next_cursor = None
+    if query["limite"] is not None and len(page) > query["limite"]:
+        page = page[:query["limite"]]
+        next_cursor = _encode_cursor(page[-1][0], query["ordenar"], query["direcao"])
+
+    return jsonify({
+        "orders": [_decorate_order(order) for _, order in page],
+        "total": len(matches),
+        "proximo_cursor": next_cursor
+    })
+
+
+# Consulta de ordens: filtros de texto (sem diferenciar maiúsculas), status exato,
+# intervalo de datas inclusivo, ordenação e paginação por cursor
+ORDER_QUERY_PARAMS = ("status", "vendedor", "fornecedor", "cliente", "busca", "data_inicio", "data_fim",
+                      "ordenar", "direcao", "limite", "cursor")
+ORDER_STATUS_CLASSES = {
+    "Aguardando Aprovação": "status-aprovacao",
+    "Aguardando Pagamento": "status-pagamento",
+    "Em Produção": "status-producao",
+    "Disponível para Retirada": "status-retirada",
+    "Finalizada": "status-finalizada",
+    "Cancelada": "status-cancelada",
+}
+ORDER_SORT_KEYS = {
+    "data": lambda order: str(order.get("data") or ""),
+    "numero": lambda order: (0, int(order["numero"]), "") if str(order.get("numero", "")).isdigit()
+    else (1, 0, str(order.get("numero", ""))),
+    "cliente": lambda order: str(order.get("cliente") or "").lower(),
+    "vendedor": lambda order: str(order.get("vendedor") or "").lower(),
+    "fornecedor": lambda order: str(order.get("fornecedor") or "").lower(),
+    "status": lambda order: str(order.get("status") or ""),
+    "valor_total": lambda order: _as_float(order.get("valor_total", 0)),
+}
+MAX_ORDERS_PAGE = 1000
+
+
+def _decorate_order(order):
+    """Adiciona a classe CSS do status e garante que material seja uma lista"""
+    status_class = ORDER_STATUS_CLASSES.get(order.get("status", ""))
+    if status_class:
+        order["status_class"] = status_class
+    if "material" in order and not isinstance(order["material"], list):
+        order["material"] = [order["material"]]
+    return order
+
+
+def _encode_cursor(key, ordenar, direcao):
+    cursor = {"ordenar": ordenar, "direcao": direcao, "chave": key}
+    return base64.urlsafe_b64encode(json.dumps(cursor).encode()).decode()
+
+
+def _valid_sort_value(ordenar, value):
+    """Confere se o valor do cursor é comparável com as chaves de ORDER_SORT_KEYS[ordenar]"""
+    if ordenar is None:
+        return value == 0
+    if ordenar == "numero":
+        return (isinstance(value, tuple) and len(value) == 3 and isinstance(value[0], int)
+                and isinstance(value[1], int) and isinstance(value[2], str))
+    if ordenar == "valor_total":
+        return isinstance(value, (int, float)) and not isinstance(value, bool)
+    return isinstance(value, str)
+
+
+def _decode_cursor(cursor, ordenar, direcao):
+    try:
+        decoded = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        value, pos = decoded["chave"]
+        value = tuple(value) if isinstance(value, list) else value
+    except (ValueError, TypeError, KeyError):
+        raise ValueError("cursor inválido")
+    # Um cursor só vale para a mesma ordenação em que foi emitido
+    if decoded.get("ordenar") != ordenar or decoded.get("direcao") != direcao:
+        raise ValueError("cursor emitido para outra ordenação")
+    if not isinstance(pos, int) or isinstance(pos, bool) or not _valid_sort_value(ordenar, value):
+        raise ValueError("cursor inválido")
+    return value, pos
+
+
+def _parse_order_query(args):
+    ordenar = args.get("ordenar")
+    if ordenar and ordenar not in ORDER_SORT_KEYS:
+        raise ValueError(f"ordenação desconhecida: {ordenar}")
+    direcao = args.get("direcao", "asc")
+    if direcao not in ("asc", "desc"):
+        raise ValueError("direção deve ser asc ou desc")
+    limite = args.get("limite")
+    if limite is not None:
+        limite = int(limite)
+        if limite < 1 or limite > MAX_ORDERS_PAGE:
+            raise ValueError(f"limite deve estar entre 1 e {MAX_ORDERS_PAGE}")
+    cursor = args.get("cursor")
+    return {
+        "status": [status for value in args.getlist("status") for status in value.split(",") if status],
+        "vendedor": args.get("vendedor", "").lower(),
+        "fornecedor": args.get("fornecedor", "").lower(),
+        "cliente": args.get("cliente", "").lower(),
+        "busca": args.get("busca", "").lower(),
+        "data_inicio": args.get("data_inicio") or None,
+        "data_fim": args.get("data_fim") or None,
+        "ordenar": ordenar,
+        "direcao": direcao,
+        "limite": limite,
+        "cursor": _decode_cursor(cursor, ordenar, direcao) if cursor else None,
+    }
+
+
+def _order_matches(order, query):
+    def contains(field, term):
+        return not term or term in str(order.get(field) or "").lower()
+
+    data = str(order.get("data") or "")[:10]
+    return (
+        (not query["status"] or order.get("status") in query["status"])
+        and contains("vendedor", query["vendedor"])
+        and contains("fornecedor", query["fornecedor"])
+        and contains("cliente", query["cliente"])
+        and (not query["busca"] or contains("numero", query["busca"]) or contains("cliente", query["busca"]))
+        and (query["data_inicio"] is None or data >= query["data_inicio"])
+        and (query["data_fim"] is None or data <= query["data_fim"])
+    )
 
 
 def validate_order_data(data):
@@ -178,6 +3518,19 @@ def validate_order_data(data):
         if not data.get(field):
             errors.append(f"Campo '{name}' é obrigatório")
 
+    # Campos de texto (build_order usa strip/lower neles)
+    text_fields = {
+        "cliente": "Nome do cliente",
+        "vendedor": "Nome do vendedor",
+        "fornecedor": "Fornecedor",
+        "forma_pagamento": "Forma de pagamento",
+        "data": "Data",
+        "status": "Status"
+    }
+    for field, name in text_fields.items():
+        if data.get(field) is not None and not isinstance(data[field], str):
+            errors.append(f"Campo '{name}' deve ser texto")
+
     # Validação de valores numéricos
     try:
         # Converter valor_total para float, removendo formatação monetária
@@ -207,13 +3560,50 @@ def validate_order_data(data):
     material = data.get("material", [])
     if isinstance(material, str):
         material = [item.strip() for item in material.split(",") if item.strip()]
-    if not material:
+    if material and (not isinstance(material, list) or not all(isinstance(item, str) for item in material)):
+        errors.append("Material deve ser um texto ou uma lista de textos")
+    elif not material:
         errors.append("Pelo menos um material deve ser informado")
 
     return errors
 
 
+def build_order(data, numero):
+    """Monta uma nova ordem a partir dos dados já validados"""
+    # Processa o campo material
+    material_list = []
+    if isinstance(data.get("material"), str):
+        material_list = [item.strip() for item in data["material"].split(",") if item.strip()]
+    elif isinstance(data.get("material"), list):
+        material_list = data["material"]
+
+    # Calcular valores automáticos
+    valor_total = float(data.get("valor_total", 0))
+    custo = float(data.get("custo", 0))
+    valor_entrada = valor_total * 0.5  # 50% do valor total
+    valor_restante = valor_total - valor_entrada
+    valor_estimado_lucro = valor_total - custo
+
+    return {
+        "numero": str(numero).zfill(2),
+        "cliente": (data.get("cliente") or "").strip(),
+        "vendedor": (data.get("vendedor") or "").strip(),
+        "material": material_list,
+        "fornecedor": (data.get("fornecedor") or "").strip(),
+        "valor_total": valor_total,
+        "custo": custo,
+        "valor_entrada": valor_entrada,
+        "valor_restante": valor_restante,
+        "valor_estimado_lucro": valor_estimado_lucro,
+        "forma_pagamento": data.get("forma_pagamento", "PIX"),
+        "data": data.get("data", datetime.datetime.now().strftime("%Y-%m-%d")),
+        "status": data.get("status", "Aguardando Aprovação"),
+        "status_class": f"status-{data.get('status', 'aguardando-aprovacao').lower().replace(' ', '-')}"
+    }
+
+
 @app.route("/api/orders", methods=["POST"])
+@with_transaction(ORDERS_FILE, FINANCIAL_FILE, BALANCETE_FILE)
 def create_order():
     try:
         data = request.get_json()
@@ -228,50 +3618,17 @@ def create_order():
         orders = load_data(ORDERS_FILE)
 
         # Gera um número sequencial para a ordem
-        next_number = "01"
-        if orders:
-            valid_numbers = [int(order.get("numero", "0")) for order in orders if
-                             isinstance(order, dict) and order.get("numero", "").isdigit()]
-            if valid_numbers:
-                next_number = str(max(valid_numbers) + 1).zfill(2)
-
-        # Processa o campo material
-        material_list = []
-        if isinstance(data.get("material"), str):
-            material_list = [item.strip() for item in data["material"].split(",") if item.strip()]
-        elif isinstance(data.get("material"), list):
-            material_list = data["material"]
-
-        # Calcular valores automáticos
-        valor_total = float(data.get("valor_total", 0))
-        custo = float(data.get("custo", 0))
-        valor_entrada = valor_total * 0.5  # 50% do valor total
-        valor_restante = valor_total - valor_entrada
-        valor_estimado_lucro = valor_total - custo
-
-        # Cria a nova ordem
-        new_order = {
-            "numero": next_number,
-            "cliente": data.get("cliente", "").strip(),
-            "vendedor": data.get("vendedor", "").strip(),
-            "material": material_list,
-            "fornecedor": data.get("fornecedor", "").strip(),
-            "valor_total": valor_total,
-            "custo": custo,
-            "valor_entrada": valor_entrada,
-            "valor_restante": valor_restante,
-            "valor_estimado_lucro": valor_estimado_lucro,
-            "forma_pagamento": data.get("forma_pagamento", "PIX"),
-            "data": data.get("data", datetime.datetime.now().strftime("%Y-%m-%d")),
-            "status": data.get("status", "Aguardando Aprovação"),
-            "status_class": f"status-{data.get('status', 'aguardando-aprovacao').lower().replace(' ', '-')}"
-        }
+        new_order = build_order(data, next_id("orders"))
 
         orders.append(new_order)
 
         if save_data(orders, ORDERS_FILE):
-            # Atualizar dados financeiros
-            update_financial_data(new_order)
+            # Atualizar dados financeiros (na mesma transação da ordem)
+            if not update_financial_data(new_order):
+                return jsonify({"error": "Erro ao salvar ordem",
+                                "details": ["Erro ao atualizar dados financeiros"]}), 500
+            publish_event("ordem_criada", {"numero": new_order["numero"], "status": new_order["status"],
+                                           "data": new_order["data"]})
             return jsonify({"success": True, "order": new_order})
         else:
             return jsonify({"error": "Erro ao salvar ordem", "details": ["Erro ao salvar no arquivo"]}), 500
@@ -281,32 +3638,324 @@ def create_order():
         return jsonify({"error": "Erro ao processar dados", "details": [str(e)]}), 400
 
 
-def update_financial_data(order):
+# Inclusão de ordens em lote
+# Todas as ordens são validadas antes de qualquer gravação; os números, os IDs dos
+# lançamentos do financeiro e do balancete são reservados em blocos contíguos e os três
+# arquivos são gravados uma única vez, no commit da transação. No modo "tudo_ou_nada"
+# qualquer ordem inválida recusa o lote inteiro; em "melhor_esforco" as válidas são
+# gravadas e as inválidas voltam com os erros na posição correspondente.
+MAX_ORDERS_BATCH = 1000
+ORDER_BATCH_MODES = ("tudo_ou_nada", "melhor_esforco")
+
+
+@app.route("/api/orders/batch", methods=["POST"])
+@with_transaction(ORDERS_FILE, FINANCIAL_FILE, BALANCETE_FILE)
+def create_orders_batch():
+    if not session.get("logged_in"):
+        return jsonify({"error": "Unauthorized"}), 401
+
+    payload = request.get_json(silent=True)
+    if isinstance(payload, list):
+        payload = {"ordens": payload}
+    if not isinstance(payload, dict) or not isinstance(payload.get("ordens"), list) or not payload["ordens"]:
+        return jsonify({"error": "Dados inválidos", "details": ["Envie uma lista de ordens em \"ordens\""]}), 400
+
+    modo = payload.get("modo", "tudo_ou_nada")
+    if modo not in ORDER_BATCH_MODES:
+        return jsonify({"error": "Dados inválidos", "details": [f"Modo inválido: {modo}"]}), 400
+    if len(payload["ordens"]) > MAX_ORDERS_BATCH:
+        return jsonify({"error": "Dados inválidos",
+                        "details": [f"O lote aceita no máximo {MAX_ORDERS_BATCH} ordens"]}), 400
+
     try:
-        # Carrega os dados financeiros
+        # Validar todas as ordens antes de reservar números ou gravar
+        resultados = []
+        validas = []
+        for indice, data in enumerate(payload["ordens"]):
+            data = dict(data) if isinstance(data, dict) else None
+            erros = validate_order_data(data) if data is not None else ["Ordem deve ser um objeto"]
+            if not erros:
+                # Falhas ao montar a ordem contam como erro do item, não do lote
+                try:
+                    build_order(data, 0)
+                except (AttributeError, TypeError, ValueError) as e:
+                    erros = [f"Ordem inválida: {e}"]
+            if erros:
+                resultados.append({"indice": indice, "success": False, "details": erros})
+            else:
+                resultados.append({"indice": indice, "success": True})
+                validas.append((indice, data))
+
+        invalidas = len(resultados) - len(validas)
+        if (invalidas and modo == "tudo_ou_nada") or not validas:
+            return jsonify({"error": "Dados inválidos", "details": [f"{invalidas} ordens inválidas"],
+                            "resultados": resultados}), 400
+
+        numeros = allocate_ids("orders", len(validas))
+        financial_ids = allocate_ids("financial", len(validas))
+        balancete_ids = allocate_ids("balancete", len(validas))
+
+        orders = load_data(ORDERS_FILE)
         financial_data = load_data(FINANCIAL_FILE)
+        balancete = load_data(BALANCETE_FILE)
+        novas = []
+        for (indice, data), numero, financial_id, balancete_id in zip(validas, numeros, financial_ids, balancete_ids):
+            order = build_order(data, numero)
+            orders.append(order)
+            ledger_append(financial_data, order_financial_entry(order, financial_id))
+            ledger_append(balancete, balancete_entry(order["valor_total"], "entrada", order["numero"], balancete_id))
+            resultados[indice]["numero"] = order["numero"]
+            novas.append(order)
+
+        if not (save_data(orders, ORDERS_FILE) and save_data(financial_data, FINANCIAL_FILE)
+                and save_data(balancete, BALANCETE_FILE)):
+            return jsonify({"error": "Erro ao salvar ordens", "details": ["Erro ao salvar no arquivo"]}), 500
+
+        publish_event("ordens_criadas", {"quantidade": len(novas),
+                                         "numeros": [order["numero"] for order in novas]})
+        return jsonify({"success": True, "criadas": len(novas), "invalidas": invalidas,
+                        "resultados": resultados, "orders": novas})
 
-        # Cria novo registro de entrada
-        entry = {
-            "id": len(financial_data["entries"]) + 1,
-            "type": "entrada",
-            "value": float(order["valor_total"]),
-            "description": f"Ordem de Serviço #{order['numero']} - {order['cliente']}",
-            "date": datetime.datetime.now().isoformat(),
-            "order_id": order["numero"]
-        }
+    except Exception as e:
+        logger.error(f"Erro ao criar ordens em lote: {e}")
+        return jsonify({"error": "Erro ao criar ordens", "details": [str(e)]}), 500
+
+
+# Livro-razão
+# O saldo dos livros (financial e balancete) é mantido de forma incremental: os
+# lançamentos são incluídos, alterados e removidos por ledger_append, ledger_update e
+# ledger_remove, que ajustam o saldo apenas com a diferença do lançamento. Junto de
+# "balance" o documento guarda "saldos": o total e o saldo líquido de cada mês e de
+# cada dia (Decimal em texto, como nos agregados). Esses são os pontos de controle que
+# balance_as_of usa para responder o saldo em uma data sem percorrer os lançamentos.
+# Lançamentos sem data entram no total, mas não nas consultas por data. Documentos
+# gravados antes do livro-razão, ou com saldos de uma regra anterior (LEDGER_RULES),
+# têm os saldos recalculados no primeiro uso.
+#
+# A despesa lançada ao registrar uma compra ("type": "expense") é uma provisão: só
+# entra no saldo com status "Pago". O pagamento da conta pelas rotas de contas a pagar
+# lança a saída e marca a provisão como "Liquidada", para que a compra conte uma vez.
+LEDGER_DATE_PATTERN = re.compile(r"\d{4}-\d{2}-\d{2}")
+LEDGER_RULES = 2
+_ledger_balances = {}
+_ledger_balances_lock = threading.Lock()
+
+
+def _entry_amount(entry):
+    """Valor de um lançamento com sinal (entradas somam, demais tipos subtraem).
+
+    Lançamentos antigos usam "type"/"value" e os de contas a pagar "tipo"/"valor";
+    registros sem tipo (pagamentos avulsos) e despesas de compra ainda não pagas não
+    alteram o saldo.
+    """
+    entry_type = entry.get("type", entry.get("tipo"))
+    if entry_type is None or (entry_type == "expense" and entry.get("status") != "Pago"):
+        return Decimal(0)
+    value = _as_decimal(entry.get("value", entry.get("valor", 0)))
+    return value if entry_type == "entrada" else -value
+
+
+def _entry_date(entry):
+    value = entry.get("date", entry.get("data"))
+    if isinstance(value, str) and LEDGER_DATE_PATTERN.match(value):
+        return value[:10]
+    return None
+
+
+def _apply_entry(data, entry, sign):
+    amount = sign * _entry_amount(entry)
+    if not amount:
+        return
+    saldos = data["saldos"]
+    saldos["total"] = str(Decimal(saldos["total"]) + amount)
+    data["balance"] = float(Decimal(saldos["total"]))
+
+    date = _entry_date(entry)
+    if date is None:
+        saldos["sem_data"] = str(Decimal(saldos["sem_data"]) + amount)
+        return
+    month = saldos["meses"].setdefault(date[:7], {"saldo": "0", "dias": {}})
+    month["saldo"] = str(Decimal(month["saldo"]) + amount)
+    day = date[8:10]
+    month["dias"][day] = str(Decimal(month["dias"].get(day, "0")) + amount)
+    if not Decimal(month["dias"][day]):
+        del month["dias"][day]
+        if not month["dias"]:
+            del saldos["meses"][date[:7]]
+
+
+def compute_ledger_balances(data):
+    """Recalcula "balance" e "saldos" somando todos os lançamentos do documento"""
+    data["saldos"] = {"total": "0", "sem_data": "0", "meses": {}, "regra": LEDGER_RULES}
+    data["balance"] = 0
+    for entry in data.setdefault("entries", []):
+        _apply_entry(data, entry, 1)
+    return data
+
+
+def _current_balances(data):
+    saldos = data.get("saldos")
+    return isinstance(saldos, dict) and saldos.get("regra") == LEDGER_RULES
+
+
+def _ledger(data):
+    if not _current_balances(data):
+        compute_ledger_balances(data)
+    return data.setdefault("entries", [])
+
+
+def ledger_append(data, entry):
+    """Inclui um lançamento e ajusta o saldo"""
+    _ledger(data).append(entry)
+    _apply_entry(data, entry, 1)
+    return entry
+
+
+def ledger_update(data, position, entry):
+    """Substitui o lançamento da posição e ajusta o saldo pela diferença"""
+    entries = _ledger(data)
+    _apply_entry(data, entries[position], -1)
+    entries[position] = entry
+    _apply_entry(data, entry, 1)
+    return entry
+
+
+def ledger_remove(data, position):
+    """Remove o lançamento da posição e retira o valor dele do saldo"""
+    entry = _ledger(data).pop(position)
+    _apply_entry(data, entry, -1)
+    return entry
+
+
+@after_save
+def _cache_ledger_balances(file_path, data, signature, previous):
+    if file_path in LEDGER_FILES and isinstance(data, dict) and isinstance(data.get("saldos"), dict):
+        with _ledger_balances_lock:
+            _ledger_balances[file_path] = (signature, json.loads(json.dumps(data["saldos"])))
+
+
+def ledger_balances(file_path):
+    """Saldos por período da versão atual do livro (sem recarregar os lançamentos se possível)"""
+    storage = get_storage()
+    signature = storage.signature(file_path) if storage.exists(file_path) else None
+    with _ledger_balances_lock:
+        cached = _ledger_balances.get(file_path)
+    if cached is not None and cached[0] == signature:
+        return cached[1]
+    data = load_data(file_path)
+    if not _current_balances(data):
+        compute_ledger_balances(data)
+    with _ledger_balances_lock:
+        _ledger_balances[file_path] = (signature, data["saldos"])
+    return data["saldos"]
+
+
+def balance_as_of(file_path, date):
+    """Saldo do livro considerando os lançamentos com data até `date` (YYYY-MM-DD), inclusive"""
+    saldos = ledger_balances(file_path)
+    month_key, day_key = date[:7], date[8:10]
+    total = Decimal(0)
+    for month, row in saldos["meses"].items():
+        if month < month_key:
+            total += Decimal(row["saldo"])
+        elif month == month_key:
+            total += sum((Decimal(value) for day, value in row["dias"].items() if day <= day_key), Decimal(0))
+    return total
+
+
+def verify_ledger(file_path):
+    """Compara o saldo e os saldos por período gravados com um recálculo completo"""
+    data = load_data(file_path)
+    stored_balance, stored = data.get("balance"), data.get("saldos")
+    expected = compute_ledger_balances(data)
+
+    differences = []
+    if stored_balance != expected["balance"]:
+        differences.append(("balance", stored_balance, expected["balance"]))
+    if not isinstance(stored, dict):
+        differences.append(("saldos", "ausentes", "calculados a partir dos lançamentos"))
+        return differences
+    for key in ("total", "sem_data"):
+        if Decimal(stored.get(key, "0")) != Decimal(expected["saldos"][key]):
+            differences.append((key, stored.get(key), expected["saldos"][key]))
+    months = stored.get("meses", {})
+    for month in sorted(set(months) | set(expected["saldos"]["meses"])):
+        row, expected_row = months.get(month, {}), expected["saldos"]["meses"].get(month, {})
+        days, expected_days = row.get("dias", {}), expected_row.get("dias", {})
+        for day in sorted(set(days) | set(expected_days)):
+            if Decimal(days.get(day, "0")) != Decimal(expected_days.get(day, "0")):
+                differences.append((f"{month}-{day}", days.get(day, "0"), expected_days.get(day, "0")))
+        if Decimal(row.get("saldo", "0")) != Decimal(expected_row.get("saldo", "0")):
+            differences.append((month, row.get("saldo", "0"), expected_row.get("saldo", "0")))
+    return differences
+
+
+def verify_compras_pagas():
+    """Confere que cada conta gerada por uma compra sai do financeiro uma única vez.
+
+    Somados, a despesa da compra e a saída do pagamento devem dar -valor para contas
+    pagas e zero para as pendentes. Retorna (conta, status, encontrado, esperado).
+    """
+    entries = _records_of(FINANCIAL_FILE, load_data(FINANCIAL_FILE))
+    totals = {}
+    for entry in entries:
+        if not isinstance(entry, dict):
+            continue
+        if entry.get("type") == "expense" and entry.get("conta_id") is not None:
+            key = str(entry["conta_id"])
+        elif entry.get("tipo") == "saida" and entry.get("referencia") is not None:
+            key = str(entry["referencia"])
+        else:
+            continue
+        totals[key] = totals.get(key, Decimal(0)) + _entry_amount(entry)
+
+    differences = []
+    for conta in load_data(CONTAS_FILE):
+        if not isinstance(conta, dict) or not conta.get("compra_id"):
+            continue
+        expected = -_as_decimal(conta.get("valor", 0)) if conta.get("status") == "Pago" else Decimal(0)
+        found = totals.get(str(conta.get("id")), Decimal(0))
+        if found != expected:
+            differences.append((conta.get("id"), conta.get("status"), found, expected))
+    return differences
+
+
+def order_financial_entry(order, entry_id):
+    """Lançamento de entrada do financeiro referente a uma ordem"""
+    return {
+        "id": entry_id,
+        "type": "entrada",
+        "value": float(order["valor_total"]),
+        "description": f"Ordem de Serviço #{order['numero']} - {order['cliente']}",
+        "date": datetime.datetime.now().isoformat(),
+        "order_id": order["numero"]
+    }
 
-        # Adiciona a entrada
-        financial_data["entries"].append(entry)
 
-        # Atualiza o saldo
-        financial_data["balance"] = sum(
-            entry["value"] if entry["type"] == "entrada" else -entry["value"]
-            for entry in financial_data["entries"]
-        )
+def balancete_entry(value, entry_type, reference_id, entry_id):
+    """Lançamento do balancete"""
+    return {
+        "id": entry_id,
+        "type": entry_type,
+        "value": float(value),
+        "reference_id": reference_id,
+        "date": datetime.datetime.now().isoformat(),
+        "category": "servico" if entry_type == "entrada" else "custo"
+    }
+
+
+@with_data_lock(FINANCIAL_FILE, BALANCETE_FILE)
+def update_financial_data(order):
+    try:
+        # Carrega os dados financeiros
+        financial_data = load_data(FINANCIAL_FILE)
+
+        # Adiciona a entrada (o saldo é ajustado pelo livro-razão)
+        ledger_append(financial_data, order_financial_entry(order, next_id("financial")))
 
         # Atualiza o balancete
-        update_balancete(order["valor_total"], "entrada", order["numero"])
+        if not update_balancete(order["valor_total"], "entrada", order["numero"]):
+            return False
 
         # Salva os dados atualizados
         save_data(financial_data, FINANCIAL_FILE)
@@ -317,29 +3966,14 @@ def update_financial_data(order):
         return False
 
 
+@with_data_lock(BALANCETE_FILE)
 def update_balancete(value, entry_type, reference_id):
     try:
         # Carrega os dados do balancete
         balancete = load_data(BALANCETE_FILE)
 
-        # Cria novo registro
-        entry = {
-            "id": len(balancete["entries"]) + 1,
-            "type": entry_type,
-            "value": float(value),
-            "reference_id": reference_id,
-            "date": datetime.datetime.now().isoformat(),
-            "category": "servico" if entry_type == "entrada" else "custo"
-        }
-
-        # Adiciona a entrada
-        balancete["entries"].append(entry)
-
-        # Atualiza o saldo
-        balancete["balance"] = sum(
-            entry["value"] if entry["type"] == "entrada" else -entry["value"]
-            for entry in balancete["entries"]
-        )
+        # Adiciona a entrada (o saldo é ajustado pelo livro-razão)
+        ledger_append(balancete, balancete_entry(value, entry_type, reference_id, next_id("balancete")))
 
         # Salva os dados atualizados
         save_data(balancete, BALANCETE_FILE)
@@ -351,6 +3985,7 @@ def update_balancete(value, entry_type, reference_id):
 
 
 @app.route("/api/orders/<order_id>", methods=["PUT"])
+@with_data_lock(ORDERS_FILE)
 def update_order(order_id):
     if not session.get("logged_in"):
         return jsonify({"error": "Unauthorized"}), 401
@@ -363,11 +3998,7 @@ def update_order(order_id):
         orders = load_data(ORDERS_FILE)
 
         # Encontra a ordem pelo número
-        order_index = None
-        for i, order in enumerate(orders):
-            if isinstance(order, dict) and order.get("numero") == order_id:
-                order_index = i
-                break
+        order_index = find_position(ORDERS_FILE, orders, "numero", order_id)
 
         if order_index is None:
             return jsonify({"error": "Ordem não encontrada"}), 404
@@ -422,6 +4053,8 @@ def update_order(order_id):
         orders[order_index] = updated_order
 
         if save_data(orders, ORDERS_FILE):
+            publish_event("ordem_atualizada", {"numero": updated_order["numero"], "status": updated_order["status"],
+                                               "data": updated_order["data"]})
             return jsonify({"success": True, "order": updated_order})
         else:
             return jsonify({"error": "Erro ao salvar ordem"}), 500
@@ -433,15 +4066,20 @@ def update_order(order_id):
 
 # API para compras
 @app.route("/api/compras", methods=["GET"])
+@with_etag(COMPRAS_FILE)
 def get_compras():
     if not session.get("logged_in") or session.get("user_role") != "admin":
         return jsonify({"error": "Unauthorized"}), 401
 
+    if "since" in request.args:
+        return since_response(COMPRAS_FILE)
+
     compras = load_data(COMPRAS_FILE)
     return jsonify(compras)
 
 
 @app.route("/api/compras", methods=["POST"])
+@with_transaction(COMPRAS_FILE, CONTAS_FILE, FINANCIAL_FILE)
 def create_compra():
     if not session.get("logged_in") or session.get("user_role") != "admin":
         return jsonify({"error": "Unauthorized"}), 401
@@ -477,16 +4115,11 @@ def create_compra():
         compras = load_data(COMPRAS_FILE)
 
         # Gera um ID sequencial para a compra
-        next_id = "1"
-        if compras:
-            valid_ids = [int(compra.get("id", "0")) for compra in compras if
-                         isinstance(compra, dict) and compra.get("id", "").isdigit()]
-            if valid_ids:
-                next_id = str(max(valid_ids) + 1)
+        compra_id = str(next_id("compras"))
 
         # Cria a nova compra
         new_compra = {
-            "id": next_id,
+            "id": compra_id,
             "item": data["item"].strip(),
             "fornecedor": data["fornecedor"].strip(),
             "valor": valor,
@@ -504,12 +4137,7 @@ def create_compra():
         # Criar conta a pagar
         try:
             contas = load_data(CONTAS_FILE)
-            next_conta_id = "1"
-            if contas:
-                valid_conta_ids = [int(conta.get("id", "0")) for conta in contas if
-                                   isinstance(conta, dict) and conta.get("id", "").isdigit()]
-                if valid_conta_ids:
-                    next_conta_id = str(max(valid_conta_ids) + 1)
+            next_conta_id = str(next_id("contas_pagar"))
 
             new_conta = {
                 "id": next_conta_id,
@@ -529,7 +4157,7 @@ def create_compra():
 
             # Registrar despesa
             expense_entry = {
-                "id": str(len(financial_data["entries"]) + 1),
+                "id": str(next_id("financial")),
                 "type": "expense",
                 "description": f"Compra #{new_compra['id']} - {new_compra['item']}",
                 "value": new_compra["valor"],
@@ -540,7 +4168,7 @@ def create_compra():
                 "timestamp": datetime.datetime.now().isoformat()
             }
 
-            financial_data["entries"].append(expense_entry)
+            ledger_append(financial_data, expense_entry)
             save_data(financial_data, FINANCIAL_FILE)
 
             return jsonify({
@@ -552,12 +4180,11 @@ def create_compra():
 
         except Exception as e:
             logger.error(f"Erro ao criar conta a pagar: {e}")
-            # Retornar sucesso da compra, mas com aviso
+            # A compra, a conta e o lançamento são gravados juntos ou não são gravados
             return jsonify({
-                "success": True,
-                "compra": new_compra,
-                "warning": "Erro ao criar conta a pagar automaticamente"
-            })
+                "error": "Erro ao criar conta a pagar automaticamente",
+                "details": [str(e)]
+            }), 500
 
     except Exception as e:
         logger.error(f"Erro ao criar compra: {e}")
@@ -565,6 +4192,7 @@ def create_compra():
 
 
 @app.route("/api/compras/<compra_id>", methods=["PUT"])
+@with_data_lock(COMPRAS_FILE)
 def update_compra(compra_id):
     if not session.get("logged_in") or session.get("user_role") != "admin":
         return jsonify({"error": "Unauthorized"}), 401
@@ -577,11 +4205,7 @@ def update_compra(compra_id):
         compras = load_data(COMPRAS_FILE)
 
         # Encontra a compra pelo ID
-        compra_index = None
-        for i, compra in enumerate(compras):
-            if isinstance(compra, dict) and compra.get("id") == compra_id:
-                compra_index = i
-                break
+        compra_index = find_position(COMPRAS_FILE, compras, "id", compra_id)
 
         if compra_index is None:
             return jsonify({"error": "Compra não encontrada"}), 404
@@ -610,11 +4234,15 @@ def update_compra(compra_id):
 
 # API para contas a pagar
 @app.route("/api/contas_pagar", methods=["GET"])
+@with_etag(CONTAS_FILE)
 def get_contas_pagar():
     if not session.get("logged_in") or session.get("user_role") != "admin":
         return jsonify({"error": "Unauthorized"}), 401
 
     try:
+        if "since" in request.args:
+            return since_response(CONTAS_FILE)
+
         contas = load_data(CONTAS_FILE)
         return jsonify(contas)
     except Exception as e:
@@ -623,6 +4251,7 @@ def get_contas_pagar():
 
 
 @app.route("/api/contas_pagar", methods=["POST"])
+@with_transaction(CONTAS_FILE, BALANCETE_FILE)
 def criar_conta_pagar():
     if not session.get("logged_in") or session.get("user_role") != "admin":
         return jsonify({"error": "Unauthorized"}), 401
@@ -631,6 +4260,8 @@ def criar_conta_pagar():
         data = request.json
         if not data:
             return jsonify({"error": "Dados inválidos"}), 400
+        if not data.get("vencimento") and data.get("data_vencimento"):
+            data["vencimento"] = data["data_vencimento"]
 
         # Validar campos obrigatórios
         required_fields = {
@@ -655,12 +4286,12 @@ def criar_conta_pagar():
         # Carregar contas existentes
         contas = load_data(CONTAS_FILE)
 
-        # Gerar ID único
-        next_id = str(len(contas) + 1)
+        # Gerar ID único (a sequência não repete IDs de contas excluídas)
+        conta_id = str(next_id("contas_pagar"))
 
         # Criar nova conta
         nova_conta = {
-            "id": next_id,
+            "id": conta_id,
             "descricao": data["descricao"],
             "valor": float(data["valor"]),
             "vencimento": data["vencimento"],
@@ -678,7 +4309,7 @@ def criar_conta_pagar():
         if save_data(contas, CONTAS_FILE):
             # Atualizar balancete
             balancete = load_data(BALANCETE_FILE)
-            balancete["entries"].append({
+            ledger_append(balancete, {
                 "tipo": "saida",
                 "valor": nova_conta["valor"],
                 "descricao": nova_conta["descricao"],
@@ -698,6 +4329,7 @@ def criar_conta_pagar():
 
 
 @app.route("/api/contas_pagar/<conta_id>", methods=["PUT"])
+@with_transaction(CONTAS_FILE, BALANCETE_FILE)
 def atualizar_conta_pagar(conta_id):
     if not session.get("logged_in") or session.get("user_role") != "admin":
         return jsonify({"error": "Unauthorized"}), 401
@@ -706,16 +4338,14 @@ def atualizar_conta_pagar(conta_id):
         data = request.json
         if not data:
             return jsonify({"error": "Dados inválidos"}), 400
+        if not data.get("vencimento") and data.get("data_vencimento"):
+            data["vencimento"] = data["data_vencimento"]
 
         # Carregar contas
         contas = load_data(CONTAS_FILE)
 
         # Encontrar conta
-        conta_index = None
-        for i, conta in enumerate(contas):
-            if isinstance(conta, dict) and str(conta.get("id")) == str(conta_id):
-                conta_index = i
-                break
+        conta_index = find_position(CONTAS_FILE, contas, "id", conta_id)
 
         if conta_index is None:
             return jsonify({"error": "Conta não encontrada"}), 404
@@ -726,7 +4356,7 @@ def atualizar_conta_pagar(conta_id):
         conta_atualizada.update({
             "descricao": data.get("descricao", conta_atual["descricao"]),
             "valor": float(data.get("valor", conta_atual["valor"])),
-            "vencimento": data.get("vencimento", conta_atual["vencimento"]),
+            "vencimento": data.get("vencimento", conta_vencimento(conta_atual)),
             "categoria": data.get("categoria", conta_atual.get("categoria")),
             "forma_pagamento": data.get("forma_pagamento", conta_atual.get("forma_pagamento")),
             "status": data.get("status", conta_atual["status"]),
@@ -741,10 +4371,10 @@ def atualizar_conta_pagar(conta_id):
             # Atualizar balancete se necessário
             if conta_atualizada["valor"] != conta_atual["valor"]:
                 balancete = load_data(BALANCETE_FILE)
-                for entry in balancete["entries"]:
-                    if entry.get("referencia") == conta_id:
-                        entry["valor"] = conta_atualizada["valor"]
-                        break
+                entry_index = find_position(BALANCETE_FILE, balancete["entries"], "referencia", conta_id)
+                if entry_index is not None:
+                    ledger_update(balancete, entry_index,
+                                  dict(balancete["entries"][entry_index], valor=conta_atualizada["valor"]))
                 save_data(balancete, BALANCETE_FILE)
 
             return jsonify({"success": True, "conta": conta_atualizada})
@@ -757,6 +4387,7 @@ def atualizar_conta_pagar(conta_id):
 
 
 @app.route("/api/contas_pagar/<conta_id>", methods=["DELETE"])
+@with_transaction(CONTAS_FILE, BALANCETE_FILE)
 def excluir_conta_pagar(conta_id):
     if not session.get("logged_in") or session.get("user_role") != "admin":
         return jsonify({"error": "Unauthorized"}), 401
@@ -766,24 +4397,18 @@ def excluir_conta_pagar(conta_id):
         contas = load_data(CONTAS_FILE)
 
         # Encontrar e remover conta
-        conta = None
-        contas_atualizadas = []
-        for c in contas:
-            if isinstance(c, dict) and str(c.get("id")) == str(conta_id):
-                conta = c
-            else:
-                contas_atualizadas.append(c)
-
-        if not conta:
+        positions = find_positions(CONTAS_FILE, contas, "id", conta_id)
+        if not positions:
             return jsonify({"error": "Conta não encontrada"}), 404
 
-        if save_data(contas_atualizadas, CONTAS_FILE):
+        for position in reversed(positions):
+            del contas[position]
+
+        if save_data(contas, CONTAS_FILE):
             # Remover do balancete
             balancete = load_data(BALANCETE_FILE)
-            balancete["entries"] = [
-                entry for entry in balancete["entries"]
-                if entry.get("referencia") != conta_id
-            ]
+            for position in reversed(find_positions(BALANCETE_FILE, balancete["entries"], "referencia", conta_id)):
+                ledger_remove(balancete, position)
             save_data(balancete, BALANCETE_FILE)
 
             return jsonify({"success": True, "message": "Conta excluída com sucesso"})
@@ -795,7 +4420,30 @@ def excluir_conta_pagar(conta_id):
         return jsonify({"error": str(e)}), 500
 
 
+def settle_conta(conta, financial_data, usuario, data_pagamento=None):
+    """Marca a conta como paga e lança a saída correspondente no financeiro.
+
+    A despesa provisionada pela compra da conta, se houver, fica "Liquidada": o valor
+    sai do saldo uma única vez, pela saída.
+    """
+    conta["status"] = "Pago"
+    conta["data_pagamento"] = data_pagamento or datetime.datetime.now().isoformat()
+    conta["pago_por"] = usuario
+    entries = _ledger(financial_data)
+    for position in find_positions(FINANCIAL_FILE, entries, "conta_id", conta["id"]):
+        if entries[position].get("type") == "expense" and entries[position].get("status") != "Pago":
+            ledger_update(financial_data, position, dict(entries[position], status="Liquidada"))
+    ledger_append(financial_data, {
+        "tipo": "saida",
+        "valor": conta["valor"],
+        "descricao": f"Pagamento: {conta['descricao']}",
+        "data": conta["data_pagamento"],
+        "referencia": conta["id"]
+    })
+
+
 @app.route("/api/contas_pagar/<conta_id>/pagar", methods=["POST"])
+@with_transaction(CONTAS_FILE, FINANCIAL_FILE)
 def pagar_conta(conta_id):
     if not session.get("logged_in") or session.get("user_role") != "admin":
         return jsonify({"error": "Unauthorized"}), 401
@@ -805,33 +4453,22 @@ def pagar_conta(conta_id):
         contas = load_data(CONTAS_FILE)
 
         # Encontrar conta
-        conta = None
-        for c in contas:
-            if isinstance(c, dict) and str(c.get("id")) == str(conta_id):
-                if c["status"] == "Pago":
-                    return jsonify({"error": "Conta já está paga"}), 400
-
-                c["status"] = "Pago"
-                c["data_pagamento"] = datetime.datetime.now().isoformat()
-                c["pago_por"] = session.get("username")
-                conta = c
-                break
-
-        if not conta:
+        conta_index = find_position(CONTAS_FILE, contas, "id", conta_id)
+        if conta_index is None:
             return jsonify({"error": "Conta não encontrada"}), 404
 
+        conta = contas[conta_index]
+        if conta["status"] == "Pago":
+            return jsonify({"error": "Conta já está paga"}), 400
+
+        financial_data = load_data(FINANCIAL_FILE)
+        settle_conta(conta, financial_data, session.get("username"))
+
         if save_data(contas, CONTAS_FILE):
             # Atualizar financeiro
-            financial_data = load_data(FINANCIAL_FILE)
-            financial_data["entries"].append({
-                "tipo": "saida",
-                "valor": conta["valor"],
-                "descricao": f"Pagamento: {conta['descricao']}",
-                "data": conta["data_pagamento"],
-                "referencia": conta["id"]
-            })
             save_data(financial_data, FINANCIAL_FILE)
 
+            publish_event("conta_paga", {"id": conta["id"], "valor": conta["valor"]}, ("admin",))
             return jsonify({"success": True, "conta": conta})
         else:
             return jsonify({"error": "Erro ao salvar alterações"}), 500
@@ -841,8 +4478,90 @@ def pagar_conta(conta_id):
         return jsonify({"error": str(e)}), 500
 
 
+@app.route("/api/contas_pagar/pagar-lote", methods=["POST"])
+@with_transaction(CONTAS_FILE, FINANCIAL_FILE)
+def pagar_contas_lote():
+    """Paga várias contas de uma vez: {"ids": [...]} ou {"filtro": {"vencimento_ate": "AAAA-MM-DD"}}.
+
+    Todas as contas e lançamentos são gravados em um único commit por arquivo; cada
+    conta pedida volta com o próprio resultado.
+    """
+    if not session.get("logged_in") or session.get("user_role") != "admin":
+        return jsonify({"error": "Unauthorized"}), 401
+
+    try:
+        data = request.get_json(silent=True) or {}
+        ids = data.get("ids")
+        filtro = data.get("filtro")
+        if ids is not None:
+            if not isinstance(ids, list) or not ids:
+                return jsonify({"error": "\"ids\" deve ser uma lista não vazia"}), 400
+            if any(isinstance(conta_id, bool) or not isinstance(conta_id, (str, int)) for conta_id in ids):
+                return jsonify({"error": "Cada item de \"ids\" deve ser um texto ou número"}), 400
+        elif not isinstance(filtro, dict):
+            return jsonify({"error": "Informe \"ids\" ou \"filtro\""}), 400
+
+        contas = load_data(CONTAS_FILE)
+        resultados = []
+        positions = []
+        if ids:
+            for conta_id in ids:
+                position = find_position(CONTAS_FILE, contas, "id", str(conta_id))
+                if position is None:
+                    resultados.append({"id": str(conta_id), "success": False, "error": "Conta não encontrada"})
+                elif contas[position]["status"] == "Pago":
+                    resultados.append({"id": str(conta_id), "success": False, "error": "Conta já está paga"})
+                elif position in positions:
+                    resultados.append({"id": str(conta_id), "success": False, "error": "Conta repetida no lote"})
+                else:
+                    resultados.append({"id": str(conta_id), "success": True})
+                    positions.append(position)
+        else:
+            status = filtro.get("status", "Pendente")
+            vencimento_ate = filtro.get("vencimento_ate")
+            if vencimento_ate:
+                try:
+                    vencimento_ate = datetime.date.fromisoformat(vencimento_ate).isoformat()
+                except (TypeError, ValueError):
+                    return jsonify({"error": "vencimento_ate inválido (use AAAA-MM-DD)"}), 400
+            for position, conta in enumerate(contas):
+                if not isinstance(conta, dict) or conta.get("status") == "Pago" or conta.get("status") != status:
+                    continue
+                vencimento = conta_vencimento(conta)
+                if vencimento_ate and not (isinstance(vencimento, str) and vencimento[:10] <= vencimento_ate):
+                    continue
+                resultados.append({"id": str(conta.get("id")), "success": True})
+                positions.append(position)
+
+        financial_data = load_data(FINANCIAL_FILE)
+        data_pagamento = datetime.datetime.now().isoformat()
+        valor_total = Decimal(0)
+        for position in positions:
+            settle_conta(contas[position], financial_data, session.get("username"), data_pagamento)
+            valor_total += _as_decimal(contas[position]["valor"])
+
+        if positions and not (save_data(contas, CONTAS_FILE) and save_data(financial_data, FINANCIAL_FILE)):
+            return jsonify({"error": "Erro ao salvar alterações"}), 500
+
+        if positions:
+            publish_event("contas_pagas", {"quantidade": len(positions), "valor_total": float(valor_total),
+                                           "ids": [str(contas[position]["id"]) for position in positions]},
+                          ("admin",))
+        return jsonify({
+            "success": True,
+            "pagas": len(positions),
+            "valor_total": float(valor_total),
+            "resultados": resultados
+        })
+
+    except Exception as e:
+        logger.error(f"Erro ao pagar contas em lote: {e}")
+        return jsonify({"error": str(e)}), 500
+
+
 # API para dados financeiros
 @app.route("/api/financeiro/dados", methods=["GET"])
+@with_etag(ORDERS_FILE, COMPRAS_FILE, CONTAS_FILE)
 def get_dados_financeiros():
     if not session.get("logged_in") or session.get("user_role") != "admin":
         return jsonify({"error": "Unauthorized"}), 401
@@ -860,57 +4579,23 @@ def get_dados_financeiros():
         except ValueError as e:
             return jsonify({"error": f"Parâmetros inválidos: {str(e)}"}), 400
 
-        # Carregar dados
-        orders = load_data(ORDERS_FILE)
-        compras = load_data(COMPRAS_FILE)
-        contas = load_data(CONTAS_FILE)
-
         # Filtrar por período
         periodo = f"{ano}-{mes:02d}"
+        start, end = month_range(ano, mes)
 
-        # Calcular receita total (apenas ordens finalizadas)
-        receita_total = sum(
-            float(order.get("valor_total", 0))
-            for order in orders
-            if isinstance(order, dict)
-            and order.get("status") == "Finalizada"
-            and order.get("data", "").startswith(periodo)
-        )
+        # Receita e custos (ordens finalizadas) e valores a receber
+        resumo = resumo_ordens(column_table(ORDERS_FILE).aggregate(
+            "data", start, end, ("valor_total", "custo", "valor_restante")))
+        receita_total = resumo["receita_total"]
+        custos_total = resumo["custos_total"]
+        valores_receber = resumo["valores_receber"]
 
-        # Calcular custos totais (ordens finalizadas)
-        custos_total = sum(
-            float(order.get("custo", 0))
-            for order in orders
-            if isinstance(order, dict)
-            and order.get("status") == "Finalizada"
-            and order.get("data", "").startswith(periodo)
-        )
+        # Calcular saídas (compras não canceladas + contas pendentes pelo vencimento)
+        saidas_compras = group_total(
+            column_table(COMPRAS_FILE).aggregate("data", start, end, ("valor",), exclude=["Cancelada"]), "valor")
 
-        # Calcular valores a receber (ordens não finalizadas/canceladas)
-        valores_receber = sum(
-            float(order.get("valor_restante", 0))
-            for order in orders
-            if isinstance(order, dict)
-            and order.get("status") not in ["Finalizada", "Cancelada"]
-            and order.get("data", "").startswith(periodo)
-        )
-
-        # Calcular saídas (compras não canceladas + contas pendentes)
-        saidas_compras = sum(
-            float(compra.get("valor", 0))
-            for compra in compras
-            if isinstance(compra, dict)
-            and compra.get("status") != "Cancelada"
-            and compra.get("data", "").startswith(periodo)
-        )
-
-        saidas_contas = sum(
-            float(conta.get("valor", 0))
-            for conta in contas
-            if isinstance(conta, dict)
-            and conta.get("status") == "Pendente"
-            and conta.get("data_vencimento", "").startswith(periodo)
-        )
+        saidas_contas = group_total(
+            column_table(CONTAS_FILE).aggregate("vencimento", start, end, ("valor",), status=["Pendente"]), "valor")
 
         saidas_total = saidas_compras + saidas_contas
 
@@ -948,6 +4633,52 @@ def get_dados_financeiros():
         return jsonify({"error": "Erro ao processar dados"}), 500
 
 
+@app.route("/api/financeiro/saldo", methods=["GET"])
+@with_etag(FINANCIAL_FILE, BALANCETE_FILE)
+def get_saldo():
+    if not session.get("logged_in") or session.get("user_role") != "admin":
+        return jsonify({"error": "Unauthorized"}), 401
+
+    livros = {"financial": FINANCIAL_FILE, "balancete": BALANCETE_FILE}
+    livro = request.args.get("livro", "financial")
+    if livro not in livros:
+        return jsonify({"error": f"Livro inválido: {livro}"}), 400
+
+    data = request.args.get("data")
+    try:
+        if data is not None:
+            data = datetime.date.fromisoformat(data).isoformat()
+    except ValueError:
+        return jsonify({"error": "Data inválida (use AAAA-MM-DD)"}), 400
+
+    try:
+        saldos = ledger_balances(livros[livro])
+        saldo = balance_as_of(livros[livro], data) if data else Decimal(saldos["total"])
+        return jsonify({"livro": livro, "data": data, "saldo": float(saldo)})
+    except Exception as e:
+        logger.error(f"Erro ao calcular saldo: {e}")
+        return jsonify({"error": str(e)}), 500
+
+
+def _transferir_pedidos_job(job, periodo_origem, periodo_destino):
+    """Tarefa: leva os pedidos em aberto do período de origem para o primeiro dia do destino"""
+    with transaction(ORDERS_FILE):
+        orders = load_data(ORDERS_FILE)
+        positions = period_positions(ORDERS_FILE, orders, "data", periodo_origem,
+                                     exclude=["Finalizada", "Cancelada"])
+        for index, position in enumerate(positions, 1):
+            orders[position]["data"] = periodo_destino
+            job.progress(index, len(positions))
+        job.check()
+        if not save_data(orders, ORDERS_FILE):
+            raise RuntimeError("Erro ao salvar alterações")
+
+    return {
+        "message": f"Transferidos {len(positions)} pedidos",
+        "pedidos": [orders[position].get("numero") for position in positions]
+    }
+
+
 @app.route("/api/financeiro/transferir", methods=["POST"])
 def transferir_pedidos():
     if not session.get("logged_in") or session.get("user_role") != "admin":
@@ -966,33 +4697,11 @@ def transferir_pedidos():
         if not all([mes_origem, ano_origem, mes_destino, ano_destino]):
             return jsonify({"error": "Todos os campos de período são obrigatórios"}), 400
 
-        # Carregar pedidos
-        orders = load_data(ORDERS_FILE)
-
-        # Identificar pedidos a serem transferidos
-        periodo_origem = f"{ano_origem}-{mes_origem.zfill(2)}"
-        pedidos_transferir = [
-            order for order in orders
-            if isinstance(order, dict)
-               and order.get("data", "").startswith(periodo_origem)
-               and order.get("status") not in ["Finalizada", "Cancelada"]
-        ]
-
-        # Atualizar data dos pedidos
-        periodo_destino = f"{ano_destino}-{mes_destino.zfill(2)}-01"
-        for order in orders:
-            if isinstance(order, dict) and order in pedidos_transferir:
-                order["data"] = periodo_destino
-
-        # Salvar alterações
-        if save_data(orders, ORDERS_FILE):
-            return jsonify({
-                "success": True,
-                "message": f"Transferidos {len(pedidos_transferir)} pedidos",
-                "pedidos": pedidos_transferir
-            })
-        else:
-            return jsonify({"error": "Erro ao salvar alterações"}), 500
+        periodo_origem = f"{int(ano_origem)}-{int(mes_origem):02d}"
+        periodo_destino = f"{int(ano_destino)}-{int(mes_destino):02d}-01"
+        job, _ = submit_job("transferir_pedidos", f"transferir_pedidos:{periodo_origem}", _transferir_pedidos_job,
+                            periodo_origem=periodo_origem, periodo_destino=periodo_destino)
+        return jsonify({"success": True, "message": "Transferência de pedidos iniciada", "job": job}), 202
 
     except Exception as e:
         logger.error(f"Erro ao transferir pedidos: {e}")
@@ -1000,6 +4709,7 @@ def transferir_pedidos():
 
 
 @app.route("/api/financeiro/pagamentos", methods=["GET"])
+@with_etag(FINANCIAL_FILE)
 def get_pagamentos():
     if not session.get("logged_in") or session.get("user_role") != "admin":
         return jsonify({"error": "Unauthorized"}), 401
@@ -1012,15 +4722,9 @@ def get_pagamentos():
         if not mes or not ano:
             return jsonify({"error": "Mês e ano são obrigatórios"}), 400
 
-        # Carregar pagamentos
-        pagamentos = load_data(FINANCIAL_FILE)
-
         # Filtrar por período
         periodo = f"{ano}-{mes.zfill(2)}"
-        pagamentos_periodo = [
-            pagamento for pagamento in pagamentos.get("entries", [])
-            if isinstance(pagamento, dict) and pagamento.get("date", "").startswith(periodo)
-        ]
+        pagamentos_periodo = period_records(FINANCIAL_FILE, "date", periodo)
 
         return jsonify(pagamentos_periodo)
 
@@ -1030,6 +4734,7 @@ def get_pagamentos():
 
 
 @app.route("/api/financeiro/pagamentos", methods=["POST"])
+@with_data_lock(FINANCIAL_FILE)
 def create_pagamento():
     if not session.get("logged_in") or session.get("user_role") != "admin":
         return jsonify({"error": "Unauthorized"}), 401
@@ -1049,16 +4754,11 @@ def create_pagamento():
         pagamentos = load_data(FINANCIAL_FILE)
 
         # Gerar ID sequencial
-        next_id = "1"
-        if pagamentos.get("entries", []):
-            valid_ids = [int(pag.get("id", "0")) for pag in pagamentos.get("entries", []) if
-                         isinstance(pag, dict) and pag.get("id", "").isdigit()]
-            if valid_ids:
-                next_id = str(max(valid_ids) + 1)
+        pagamento_id = str(next_id("financial"))
 
         # Criar novo pagamento
         new_pagamento = {
-            "id": next_id,
+            "id": pagamento_id,
             "date": data.get("data"),
             "cliente": data.get("cliente"),
             "valor": float(data.get("valor")),
@@ -1066,7 +4766,7 @@ def create_pagamento():
             "observacao": data.get("observacao", "")
         }
 
-        pagamentos.get("entries", []).append(new_pagamento)
+        ledger_append(pagamentos, new_pagamento)
 
         if save_data(pagamentos, FINANCIAL_FILE):
             return jsonify({"success": True, "pagamento": new_pagamento})
@@ -1079,6 +4779,7 @@ def create_pagamento():
 
 
 @app.route("/api/financeiro/pagamentos/<pagamento_id>", methods=["PUT"])
+@with_data_lock(FINANCIAL_FILE)
 def update_pagamento(pagamento_id):
     if not session.get("logged_in") or session.get("user_role") != "admin":
         return jsonify({"error": "Unauthorized"}), 401
@@ -1092,11 +4793,7 @@ def update_pagamento(pagamento_id):
         pagamentos = load_data(FINANCIAL_FILE)
 
         # Encontrar pagamento
-        pagamento_index = None
-        for i, pagamento in enumerate(pagamentos.get("entries", [])):
-            if isinstance(pagamento, dict) and pagamento.get("id") == pagamento_id:
-                pagamento_index = i
-                break
+        pagamento_index = find_position(FINANCIAL_FILE, pagamentos.get("entries", []), "id", pagamento_id)
 
         if pagamento_index is None:
             return jsonify({"error": "Pagamento não encontrado"}), 404
@@ -1111,7 +4808,7 @@ def update_pagamento(pagamento_id):
             "observacao": data.get("observacao", updated_pagamento.get("observacao", ""))
         })
 
-        pagamentos.get("entries", [])[pagamento_index] = updated_pagamento
+        ledger_update(pagamentos, pagamento_index, updated_pagamento)
 
         if save_data(pagamentos, FINANCIAL_FILE):
             return jsonify({"success": True, "pagamento": updated_pagamento})
@@ -1123,12 +4820,85 @@ def update_pagamento(pagamento_id):
         return jsonify({"error": f"Erro ao processar dados: {str(e)}"}), 400
 
 
+@app.route("/api/events", methods=["GET"])
+def stream_events():
+    if not session.get("logged_in"):
+        return jsonify({"error": "Unauthorized"}), 401
+
+    subscriber = event_broker.subscribe(session.get("user_role"), app.config["SSE_MAX_SUBSCRIBERS"])
+    if subscriber is None:
+        return jsonify({"error": "Limite de conexões de eventos atingido"}), 503
+
+    response = Response(_event_stream(subscriber, app.config["SSE_HEARTBEAT"]), mimetype="text/event-stream")
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
+
+
+@app.route("/api/jobs", methods=["GET"])
+def get_jobs():
+    if not session.get("logged_in") or session.get("user_role") != "admin":
+        return jsonify({"error": "Unauthorized"}), 401
+    return jsonify(list_jobs())
+
+
+@app.route("/api/jobs/<job_id>", methods=["GET"])
+def get_job_status(job_id):
+    if not session.get("logged_in") or session.get("user_role") != "admin":
+        return jsonify({"error": "Unauthorized"}), 401
+
+    job = get_job(job_id)
+    if job is None:
+        return jsonify({"error": "Tarefa não encontrada"}), 404
+    return jsonify(job)
+
+
+@app.route("/api/jobs/<job_id>/cancelar", methods=["POST"])
+def cancelar_job(job_id):
+    if not session.get("logged_in") or session.get("user_role") != "admin":
+        return jsonify({"error": "Unauthorized"}), 401
+
+    job = cancel_job(job_id)
+    if job is None:
+        return jsonify({"error": "Tarefa não encontrada"}), 404
+    if not job.get("cancelar"):
+        return jsonify({"error": f"Tarefa já finalizada ({job['status']})", "job": job}), 409
+    return jsonify({"success": True, "job": job})
+
+
+@app.route("/api/jobs/<job_id>/arquivo", methods=["GET"])
+def download_job_arquivo(job_id):
+    if not session.get("logged_in") or session.get("user_role") != "admin":
+        return jsonify({"error": "Unauthorized"}), 401
+
+    job = get_job(job_id)
+    if job is None or job["status"] != "concluido" or not job.get("arquivo"):
+        return jsonify({"error": "Arquivo não disponível"}), 404
+    return send_from_directory(EXPORTS_DIR, job["arquivo"], as_attachment=True)
+
+
+@app.route("/api/sistema/metricas", methods=["GET"])
+def get_metricas_sistema():
+    if not session.get("logged_in") or session.get("user_role") != "admin":
+        return jsonify({"error": "Unauthorized"}), 401
+
+    return jsonify({
+        "cache": get_data_cache_stats(),
+        "locks": get_lock_stats(),
+        "eventos": {"conexoes": event_broker.count()},
+        "login": user_directory.stats(),
+        "sessoes": get_session_stats(),
+        "sequencias": get_sequences()
+    })
+
+
 # Rota para login
 @app.route("/login.html")
 def login_page():
     return render_template("login.html")
 
 
+@with_data_lock(CONTAS_FILE, FINANCIAL_FILE)
 def update_payment_status(conta_id, new_status):
     """Atualiza o status de pagamento e propaga as alterações"""
     try:
@@ -1137,36 +4907,30 @@ def update_payment_status(conta_id, new_status):
         financial_data = load_data(FINANCIAL_FILE)
 
         # Encontrar a conta
-        conta = None
-        for c in contas:
-            if c.get("id") == conta_id:
-                conta = c
-                break
-
-        if not conta:
+        conta_index = find_position(CONTAS_FILE, contas, "id", conta_id)
+        if conta_index is None:
             raise ValueError("Conta não encontrada")
+        conta = contas[conta_index]
 
         # Atualizar status da conta
         old_status = conta["status"]
         conta["status"] = new_status
         conta["updated_at"] = datetime.datetime.now().isoformat()
 
-        # Atualizar entrada financeira correspondente
-        for entry in financial_data.get("entries", []):
-            if entry.get("conta_id") == conta_id:
-                entry["status"] = new_status
-                entry["updated_at"] = datetime.datetime.now().isoformat()
-
-                # Atualizar saldo se necessário
-                if old_status != "Pago" and new_status == "Pago":
-                    financial_data["balance"] -= entry["value"]
-                elif old_status == "Pago" and new_status != "Pago":
-                    financial_data["balance"] += entry["value"]
+        # Atualizar entrada financeira correspondente (a despesa da compra só entra no
+        # saldo quando passa a "Pago"; o livro-razão ajusta o saldo pela diferença)
+        entries = financial_data.get("entries", [])
+        for position in find_positions(FINANCIAL_FILE, entries, "conta_id", conta_id):
+            ledger_update(financial_data, position, dict(entries[position], status=new_status,
+                                                         updated_at=datetime.datetime.now().isoformat()))
 
         # Salvar alterações
-        save_data(contas, CONTAS_FILE)
-        save_data(financial_data, FINANCIAL_FILE)
+        with transaction(CONTAS_FILE, FINANCIAL_FILE):
+            save_data(contas, CONTAS_FILE)
+            save_data(financial_data, FINANCIAL_FILE)
 
+        if new_status == "Pago" and old_status != "Pago":
+            publish_event("conta_paga", {"id": conta_id, "valor": conta.get("valor")}, ("admin",))
         return True, None
 
     except Exception as e:
@@ -1184,18 +4948,14 @@ def init_admin_user():
 
         # Cria arquivo de usuários se não existir
         if not os.path.exists(USERS_FILE):
-            with open(USERS_FILE, 'w') as f:
-                json.dump([], f)
+            user_directory.save([])
             logger.info("Arquivo de usuários criado")
 
-        users = load_users()
-        admin_exists = any(user.get("username") == "admin" for user in users if isinstance(user, dict))
-
-        if not admin_exists:
+        if user_directory.get("admin") is None:
             logger.info("Criando novo usuário admin")
             # Criar senha hash
             password = "admin123"
-            password_hash = generate_password_hash(password)
+            password_hash = user_directory.hash_password(password)
 
             admin_user = {
                 "username": "admin",
@@ -1206,8 +4966,7 @@ def init_admin_user():
             users = [admin_user]  # Substitui a lista existente
 
             # Salva no arquivo
-            with open(USERS_FILE, 'w') as f:
-                json.dump(users, f, indent=2)
+            user_directory.save(users)
 
             logger.info("Usuário admin criado com sucesso")
             logger.info(f"Credenciais - Usuário: admin, Senha: {password}")
@@ -1221,9 +4980,11 @@ def init_admin_user():
 
 # Adiciona a chamada para inicializar o usuário admin logo após a definição do app
 init_admin_user()
+recover_transactions()
 
 
 @app.route("/api/dashboard/stats", methods=["GET"])
+@with_etag(ORDERS_FILE, CONTAS_FILE)
 def get_dashboard_stats():
     if not session.get("logged_in"):
         return jsonify({"error": "Unauthorized"}), 401
@@ -1241,53 +5002,13 @@ def get_dashboard_stats():
         except ValueError as e:
             return jsonify({"error": f"Parâmetros inválidos: {str(e)}"}), 400
 
-        # Carregar dados
-        orders = load_data(ORDERS_FILE)
-        financial_data = load_data(FINANCIAL_FILE)
-        contas = load_data(CONTAS_FILE)
-
-        # Filtrar por período
+        # Linhas agregadas do período (mantidas a cada gravação)
         periodo = f"{ano}-{mes:02d}"
-        orders_periodo = [
-            order for order in orders
-            if isinstance(order, dict) and order.get("data", "").startswith(periodo)
-        ]
-
-        # Calcular estatísticas
-        total_orders = len(orders_periodo)
-        orders_em_producao = sum(1 for order in orders_periodo if order.get("status") == "Em Produção")
-        orders_aguardando = sum(
-            1 for order in orders_periodo if order.get("status") in ["Aguardando Aprovação", "Aguardando Pagamento"])
-        orders_finalizados = sum(1 for order in orders_periodo if order.get("status") == "Finalizada")
-        orders_retirada = sum(1 for order in orders_periodo if order.get("status") == "Disponível para Retirada")
-
-        # Calcular valores financeiros
-        receita_total = sum(
-            float(order.get("valor_total", 0)) for order in orders_periodo if order.get("status") == "Finalizada")
-        custos_total = sum(
-            float(order.get("custo", 0)) for order in orders_periodo if order.get("status") == "Finalizada")
-        lucro_total = receita_total - custos_total
-
-        # Valores a receber e a pagar
-        valores_receber = sum(float(order.get("valor_restante", 0)) for order in orders_periodo
-                              if order.get("status") not in ["Finalizada", "Cancelada"])
-
-        valores_pagar = sum(float(conta.get("valor", 0)) for conta in contas
-                            if isinstance(conta, dict)
-                            and conta.get("status") == "Pendente"
-                            and conta.get("vencimento", "").startswith(periodo))
+        orders_mes, contas_mes = month_aggregates(periodo)
 
         return jsonify({
-            "total_orders": total_orders,
-            "orders_em_producao": orders_em_producao,
-            "orders_aguardando": orders_aguardando,
-            "orders_finalizados": orders_finalizados,
-            "orders_retirada": orders_retirada,
-            "receita_total": receita_total,
-            "custos_total": custos_total,
-            "lucro_total": lucro_total,
-            "valores_receber": valores_receber,
-            "valores_pagar": valores_pagar,
+            **resumo_ordens(orders_mes),
+            "valores_pagar": float(group_total(contas_mes, "valor", status=["Pendente"])),
             "periodo": {
                 "mes": mes,
                 "ano": ano
@@ -1299,153 +5020,958 @@ def get_dashboard_stats():
         return jsonify({"error": "Erro ao processar dados"}), 500
 
 
-@app.route("/api/encerrar_mes", methods=["POST"])
-def encerrar_mes():
-    if not session.get("logged_in") or session.get("user_role") != "admin":
+def _analytics_response(dimension, default_order):
+    """Top N de uma dimensão para os gráficos, com filtros opcionais de período e status"""
+    if not session.get("logged_in"):
         return jsonify({"error": "Unauthorized"}), 401
 
     try:
-        data = request.json
-        mes_atual = data.get("mes")
-        ano_atual = data.get("ano")
+        mes = request.args.get("mes")
+        ano = request.args.get("ano")
+        try:
+            limite = int(request.args.get("limite", 8))
+            ordenar = request.args.get("ordenar", default_order)
+            if ordenar not in ("quantidade", "valor_total"):
+                raise ValueError("ordenar deve ser quantidade ou valor_total")
+            periodo = None
+            if ano:
+                periodo = f"{int(ano)}-{int(mes):02d}" if mes else str(int(ano))
+            elif mes:
+                raise ValueError("informe o ano junto com o mês")
+        except ValueError as e:
+            return jsonify({"error": f"Parâmetros inválidos: {str(e)}"}), 400
 
-        if not mes_atual or not ano_atual:
-            return jsonify({"error": "Mês e ano são obrigatórios"}), 400
+        def lista(param):
+            return [item for value in request.args.getlist(param) for item in value.split(",") if item]
 
-        # Calcular próximo mês e ano
-        proximo_mes = mes_atual + 1 if mes_atual < 12 else 1
-        proximo_ano = ano_atual + 1 if mes_atual == 12 else ano_atual
+        totals = group_totals(dimension, periodo, status=lista("status"), exclude=lista("excluir_status"))
+        itens = [{"nome": name, "quantidade": count, "valor_total": valor}
+                 for name, (count, valor) in totals.items()]
+        itens.sort(key=lambda item: (-item[ordenar], item["nome"]))
 
-        # Carregar dados
+        return jsonify({
+            "itens": itens[:max(limite, 0)],
+            "total": {
+                "quantidade": sum(item["quantidade"] for item in itens),
+                "valor_total": sum(item["valor_total"] for item in itens)
+            },
+            "periodo": periodo
+        })
+
+    except Exception as e:
+        logger.error(f"Erro ao agrupar ordens por {dimension}: {e}")
+        return jsonify({"error": "Erro ao processar dados"}), 500
+
+
+@app.route("/api/analytics/materials", methods=["GET"])
+@with_etag(ORDERS_FILE)
+def get_analytics_materials():
+    return _analytics_response("material", "quantidade")
+
+
+@app.route("/api/analytics/vendedores", methods=["GET"])
+@with_etag(ORDERS_FILE)
+def get_analytics_vendedores():
+    return _analytics_response("vendedor", "valor_total")
+
+
+def _mes_encerrado(financial_data, mes, ano):
+    return any(fechamento.get("mes") == mes and fechamento.get("ano") == ano
+               for fechamento in financial_data.get("fechamentos", []))
+
+
+def _encerrar_mes_job(job, mes, ano):
+    """Tarefa: registra o fechamento do mês e leva as ordens em aberto dele para o mês seguinte"""
+    proximo_mes = mes + 1 if mes < 12 else 1
+    proximo_ano = ano + 1 if mes == 12 else ano
+
+    with transaction(ORDERS_FILE, FINANCIAL_FILE):
         orders = load_data(ORDERS_FILE)
         financial_data = load_data(FINANCIAL_FILE)
+        if _mes_encerrado(financial_data, mes, ano):
+            raise ValueError(f"O mês {mes:02d}/{ano} já foi encerrado")
 
-        # Transferir ordens não finalizadas para o próximo mês
-        for order in orders:
-            if isinstance(order, dict) and order.get("status") not in ["Finalizada", "Cancelada"]:
-                order["data"] = f"{proximo_ano}-{proximo_mes:02d}-01"
+        # Totais do mês encerrado (as ordens finalizadas não mudam de data)
+        start, end = month_range(ano, mes)
+        resumo = resumo_ordens(column_table(ORDERS_FILE).aggregate(
+            "data", start, end, ("valor_total", "custo", "valor_restante")))
+
+        # Transferir as ordens não finalizadas do mês para o próximo mês
+        positions = period_positions(ORDERS_FILE, orders, "data", f"{ano}-{mes:02d}",
+                                     exclude=["Finalizada", "Cancelada"])
+        for index, position in enumerate(positions, 1):
+            orders[position]["data"] = f"{proximo_ano}-{proximo_mes:02d}-01"
+            job.progress(index, len(positions))
 
         # Registrar fechamento no financeiro
         mes_fechamento = {
-            "mes": mes_atual,
-            "ano": ano_atual,
+            "mes": mes,
+            "ano": ano,
             "data_fechamento": datetime.datetime.now().isoformat(),
-            "total_receitas": sum(float(order.get("valor_total", 0)) for order in orders
-                                  if isinstance(order, dict) and order.get("status") == "Finalizada"),
-            "total_custos": sum(float(order.get("custo", 0)) for order in orders
-                                if isinstance(order, dict) and order.get("status") == "Finalizada"),
-            "ordens_transferidas": len([order for order in orders
-                                        if isinstance(order, dict) and order.get("status") not in ["Finalizada",
-                                                                                                   "Cancelada"]])
+            "total_receitas": resumo["receita_total"],
+            "total_custos": resumo["custos_total"],
+            "ordens_transferidas": len(positions)
         }
+        financial_data.setdefault("fechamentos", []).append(mes_fechamento)
 
-        if "fechamentos" not in financial_data:
-            financial_data["fechamentos"] = []
-        financial_data["fechamentos"].append(mes_fechamento)
+        job.check()
+        if not (save_data(orders, ORDERS_FILE) and save_data(financial_data, FINANCIAL_FILE)):
+            raise RuntimeError("Erro ao salvar dados")
+        publish_event("mes_encerrado", {"mes": mes, "ano": ano, "ordens_transferidas": len(positions)})
 
-        # Salvar alterações
-        if save_data(orders, ORDERS_FILE) and save_data(financial_data, FINANCIAL_FILE):
-            return jsonify({
-                "success": True,
-                "message": "Mês encerrado com sucesso",
-                "fechamento": mes_fechamento
-            })
-        else:
-            return jsonify({"error": "Erro ao salvar dados"}), 500
+    return {"message": "Mês encerrado com sucesso", "fechamento": mes_fechamento}
+
+
+@app.route("/api/encerrar_mes", methods=["POST"])
+def encerrar_mes():
+    if not session.get("logged_in") or session.get("user_role") != "admin":
+        return jsonify({"error": "Unauthorized"}), 401
+
+    try:
+        data = request.json
+        mes_atual = data.get("mes")
+        ano_atual = data.get("ano")
+
+        if not mes_atual or not ano_atual:
+            return jsonify({"error": "Mês e ano são obrigatórios"}), 400
+        mes_atual, ano_atual = int(mes_atual), int(ano_atual)
+
+        if _mes_encerrado(load_data(FINANCIAL_FILE), mes_atual, ano_atual):
+            return jsonify({"error": f"O mês {mes_atual:02d}/{ano_atual} já foi encerrado"}), 409
+
+        job, _ = submit_job("encerrar_mes", f"encerrar_mes:{ano_atual}-{mes_atual:02d}", _encerrar_mes_job,
+                            mes=mes_atual, ano=ano_atual)
+        return jsonify({"success": True, "message": "Encerramento do mês iniciado", "job": job}), 202
 
     except Exception as e:
         logger.error(f"Erro ao encerrar mês: {e}")
         return jsonify({"error": str(e)}), 500
 
 
+# Exportação do balancete
+# Os lançamentos saem das tabelas colunares, que já entregam cada coleção ordenada
+# por dia; dentro de um mesmo dia eles são reordenados pela data completa e as
+# fontes são intercaladas com heapq.merge. Assim a resposta é produzida em ordem de
+# data, linha a linha, sem montar nem ordenar a lista inteira do período. Os totais
+# vêm da agregação colunar e são enviados no final.
+BALANCETE_FORMATS = {
+    "json": "application/json",
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+BALANCETE_CSV_FIELDS = ("data", "tipo", "descricao", "valor")
+EXPORT_CHUNK_ROWS = 500
+
+
+def _by_full_date(records, field):
+    """Reordena pela data completa (com hora) registros que já vêm ordenados por dia"""
+    for _, group in itertools.groupby(records, key=lambda record: str(record.get(field))[:10]):
+        yield from sorted(group, key=lambda record: str(record.get(field)))
+
+
+def _balancete_sources(start, end):
+    """Iteradores ordenados por data das entradas e das saídas do intervalo, e os totais"""
+    orders = column_table(ORDERS_FILE)
+    compras = column_table(COMPRAS_FILE)
+    contas = column_table(CONTAS_FILE)
+    recebidas = ["Finalizada", "Disponível para Retirada"]
+
+    entradas = ({
+        "data": order["data"],
+        "descricao": f"Ordem #{order['numero']} - {order['cliente']}",
+        "valor": float(order.get("valor_total", 0))
+    } for order in _by_full_date(orders.iter_rows("data", start, end, status=recebidas), "data"))
+
+    saidas = heapq.merge(
+        ({
+            "data": compra["data"],
+            "descricao": f"Compra: {compra['item']}",
+            "valor": float(compra.get("valor", 0))
+        } for compra in _by_full_date(compras.iter_rows("data", start, end), "data")),
+        ({
+            "data": conta["data_pagamento"],
+            "descricao": f"Conta: {conta['descricao']}",
+            "valor": float(conta.get("valor", 0))
+        } for conta in _by_full_date(contas.iter_rows("data_pagamento", start, end, status=["Pago"]),
+                                     "data_pagamento")),
+        key=lambda item: item["data"])
+
+    total_entradas = group_total(orders.aggregate("data", start, end, ("valor_total",), status=recebidas),
+                                 "valor_total")
+    total_saidas = group_total(compras.aggregate("data", start, end, ("valor",)), "valor") + group_total(
+        contas.aggregate("data_pagamento", start, end, ("valor",), status=["Pago"]), "valor")
+    totais = {"entradas": total_entradas, "saidas": total_saidas, "saldo": total_entradas - total_saidas}
+    return entradas, saidas, totais
+
+
+def _chunked(lines):
+    batch = []
+    for line in lines:
+        batch.append(line)
+        if len(batch) >= EXPORT_CHUNK_ROWS:
+            yield "".join(batch)
+            batch = []
+    if batch:
+        yield "".join(batch)
+
+
+def _balancete_json(header, entradas, saidas, totais, footer):
+    yield json.dumps(header)[:-1] + ', "entradas": ['
+    for index, item in enumerate(entradas):
+        yield ("," if index else "") + json.dumps(item)
+    yield '], "saidas": ['
+    for index, item in enumerate(saidas):
+        yield ("," if index else "") + json.dumps(item)
+    yield '], "totais": ' + json.dumps(totais) + ", " + json.dumps(footer)[1:]
+
+
+def _balancete_lancamentos(entradas, saidas):
+    """Entradas e saídas intercaladas em um único fluxo ordenado por data"""
+    return heapq.merge(
+        (dict(item, tipo="entrada") for item in entradas),
+        (dict(item, tipo="saida") for item in saidas),
+        key=lambda item: item["data"])
+
+
+def _balancete_ndjson(header, entradas, saidas, totais, footer):
+    yield json.dumps(header) + "\n"
+    for item in _balancete_lancamentos(entradas, saidas):
+        yield json.dumps(item) + "\n"
+    yield json.dumps(dict({"totais": totais}, **footer)) + "\n"
+
+
+def _balancete_csv(header, entradas, saidas, totais, footer):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def line(row):
+        writer.writerow(row)
+        value = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return value
+
+    yield line(BALANCETE_CSV_FIELDS)
+    for item in _balancete_lancamentos(entradas, saidas):
+        yield line([item[field] for field in BALANCETE_CSV_FIELDS])
+    for name in ("entradas", "saidas", "saldo"):
+        yield line(["", f"total_{name}" if name != "saldo" else name, "", round(totais[name], 2)])
+
+
+def _export_period(args):
+    """Intervalo pedido: data_inicio/data_fim (inclusivas), mes e ano, ou apenas ano"""
+    mes, ano = args.get("mes"), args.get("ano")
+    data_inicio, data_fim = args.get("data_inicio"), args.get("data_fim")
+    if data_inicio or data_fim:
+        if not data_inicio or not data_fim:
+            raise ValueError("Informe data_inicio e data_fim")
+        inicio = datetime.date.fromisoformat(data_inicio)
+        fim = datetime.date.fromisoformat(data_fim)
+        if fim < inicio:
+            raise ValueError("data_fim anterior a data_inicio")
+        periodo = {"inicio": inicio.isoformat(), "fim": fim.isoformat()}
+        return inicio.toordinal() - _EPOCH_ORDINAL, fim.toordinal() + 1 - _EPOCH_ORDINAL, periodo
+    if not ano:
+        raise ValueError("Mês e ano são obrigatórios")
+    if mes:
+        start, end = month_range(int(ano), int(mes))
+        return start, end, {"mes": mes, "ano": ano}
+    start, _ = month_range(int(ano), 1)
+    _, end = month_range(int(ano), 12)
+    return start, end, {"ano": ano}
+
+
+def _exportar_balancete_job(job, start, end, periodo, formato, usuario):
+    """Tarefa: grava a exportação em data/exports para download posterior"""
+    entradas, saidas, totais = _balancete_sources(start, end)
+    footer = {"gerado_em": datetime.datetime.now().isoformat(), "gerado_por": usuario}
+    writer = {"json": _balancete_json, "ndjson": _balancete_ndjson, "csv": _balancete_csv}[formato]
+
+    os.makedirs(EXPORTS_DIR, exist_ok=True)
+    arquivo = f"balancete_{job.job_id}.{formato}"
+    chunks = 0
+
+    def write(f):
+        nonlocal chunks
+        for chunk in _chunked(writer({"periodo": periodo}, entradas, saidas, totais, footer)):
+            f.write(chunk)
+            chunks += 1
+            job.progress(chunks * EXPORT_CHUNK_ROWS)
+
+    _atomic_write(os.path.join(EXPORTS_DIR, arquivo), write)
+    update_job(job.job_id, arquivo=arquivo)
+    return {"message": "Exportação concluída", "arquivo": arquivo, "totais": totais}
+
+
 @app.route("/api/balancete/export", methods=["GET"])
+@with_etag(ORDERS_FILE, COMPRAS_FILE, CONTAS_FILE)
 def export_balancete():
     if not session.get("logged_in") or session.get("user_role") != "admin":
         return jsonify({"error": "Unauthorized"}), 401
 
     try:
-        mes = request.args.get("mes")
-        ano = request.args.get("ano")
-
-        if not mes or not ano:
-            return jsonify({"error": "Mês e ano são obrigatórios"}), 400
+        formato = request.args.get("formato", "json")
+        if formato not in BALANCETE_FORMATS:
+            return jsonify({"error": f"Formato inválido: {formato}"}), 400
+        try:
+            start, end, periodo = _export_period(request.args)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        if request.args.get("assincrono") in ("1", "true"):
+            job, _ = submit_job("exportar_balancete", f"exportar_balancete:{formato}:{start}:{end}",
+                                _exportar_balancete_job, start=start, end=end, periodo=periodo,
+                                formato=formato, usuario=session.get("username"))
+            return jsonify({"success": True, "message": "Exportação iniciada", "job": job}), 202
+
+        # As tabelas são capturadas aqui; o restante roda enquanto a resposta é enviada
+        entradas, saidas, totais = _balancete_sources(start, end)
+        header = {"periodo": periodo}
+        footer = {"gerado_em": datetime.datetime.now().isoformat(), "gerado_por": session.get("username")}
+        writer = {"json": _balancete_json, "ndjson": _balancete_ndjson, "csv": _balancete_csv}[formato]
+
+        response = Response(_chunked(writer(header, entradas, saidas, totais, footer)),
+                            mimetype=BALANCETE_FORMATS[formato])
+        if formato != "json":
+            nome = "_".join(str(value) for value in periodo.values())
+            response.headers["Content-Disposition"] = f'attachment; filename="balancete_{nome}.{formato}"'
+        return response
 
-        # Carregar dados
-        balancete = load_data(BALANCETE_FILE)
-        orders = load_data(ORDERS_FILE)
-        compras = load_data(COMPRAS_FILE)
-        contas = load_data(CONTAS_FILE)
+    except Exception as e:
+        logger.error(f"Erro ao exportar balancete: {e}")
+        return jsonify({"error": str(e)}), 500
 
-        # Filtrar por período
-        periodo = f"{ano}-{int(mes):02d}"
 
-        # Calcular entradas
-        entradas = []
-        for order in orders:
-            if isinstance(order, dict) and order.get("status") in ["Finalizada", "Disponível para Retirada"]:
-                data = order.get("data", "")
-                if data.startswith(periodo):
-                    entradas.append({
-                        "data": data,
-                        "descricao": f"Ordem #{order['numero']} - {order['cliente']}",
-                        "valor": float(order.get("valor_total", 0))
-                    })
-
-        # Calcular saídas
-        saidas = []
-        # Compras
-        for compra in compras:
-            if isinstance(compra, dict):
-                data = compra.get("data", "")
-                if data.startswith(periodo):
-                    saidas.append({
-                        "data": data,
-                        "descricao": f"Compra: {compra['item']}",
-                        "valor": float(compra.get("valor", 0))
-                    })
-
-        # Contas pagas
-        for conta in contas:
-            if isinstance(conta, dict) and conta.get("status") == "Pago":
-                data = conta.get("data_pagamento", "")
-                if data.startswith(periodo):
-                    saidas.append({
-                        "data": data,
-                        "descricao": f"Conta: {conta['descricao']}",
-                        "valor": float(conta.get("valor", 0))
-                    })
-
-        # Ordenar por data
-        entradas.sort(key=lambda x: x["data"])
-        saidas.sort(key=lambda x: x["data"])
-
-        # Calcular totais
-        total_entradas = sum(entrada["valor"] for entrada in entradas)
-        total_saidas = sum(saida["valor"] for saida in saidas)
-        saldo = total_entradas - total_saidas
-
-        # Preparar dados para exportação
-        export_data = {
-            "periodo": {
-                "mes": mes,
-                "ano": ano
-            },
-            "entradas": entradas,
-            "saidas": saidas,
-            "totais": {
-                "entradas": total_entradas,
-                "saidas": total_saidas,
-                "saldo": saldo
-            },
-            "gerado_em": datetime.datetime.now().isoformat(),
-            "gerado_por": session.get("username")
-        }
+# Comandos de manutenção (flask --app cubo <comando>)
+@app.cli.command("migrar-sqlite")
+def migrar_sqlite_command():
+    """Copia os arquivos data/*.json para o banco SQLite"""
+    source = JsonStorage()
+    target = SqliteStorage(app.config["SQLITE_PATH"])
+    for file_path in SQLITE_TABLES:
+        if not source.exists(file_path):
+            continue
+        data = source.read(file_path)
+        target.write(file_path, data)
+        total = len(data.get("entries", [])) if file_path in LEDGER_FILES else len(data)
+        click.echo(f"{os.path.basename(file_path)}: {total} registros migrados")
+
+
+@app.cli.command("migrar-particoes")
+def migrar_particoes_command():
+    """Divide os arquivos data/*.json em partições mensais"""
+    source = JsonStorage()
+    target = PartitionedStorage(DATA_DIR)
+    # O financeiro por último: é ele que sela os meses já encerrados
+    for file_path in sorted(PARTITION_LAYOUT, key=lambda path: path == FINANCIAL_FILE):
+        if not source.exists(file_path):
+            continue
+        data = source.read(file_path)
+        target.write(file_path, data)
+        total = len(_records_of(file_path, data))
+        click.echo(f"{os.path.basename(file_path)}: {total} registros particionados")
+    click.echo(f"Meses selados: {', '.join(target._read_manifest()['seladas']) or 'nenhum'}")
+
+
+@app.cli.command("reconstruir-agregados")
+def reconstruir_agregados_command():
+    """Recalcula data/agregados.json a partir das ordens e contas"""
+    state = rebuild_aggregates()
+    for source in AGGREGATE_SOURCES.values():
+        click.echo(f"{source}: {len(state[source])} meses")
+
+
+@app.cli.command("verificar-agregados")
+def verificar_agregados_command():
+    """Compara os agregados mantidos com um recálculo completo"""
+    differences = verify_aggregates()
+    for source, month, status, field, stored, expected in differences:
+        click.echo(f"{source} {month} [{status or '-'}] {field}: {stored} (esperado {expected})")
+    if differences:
+        raise SystemExit(f"{len(differences)} diferenças encontradas")
+    click.echo("Agregados conferem com os dados")
+
+
+@app.cli.command("reconstruir-saldos")
+def reconstruir_saldos_command():
+    """Recalcula o saldo e os saldos por período dos livros a partir dos lançamentos"""
+    for file_path in LEDGER_FILES:
+        with transaction(file_path):
+            data = compute_ledger_balances(load_data(file_path))
+            save_data(data, file_path)
+        click.echo(f"{os.path.basename(file_path)}: {len(data['entries'])} lançamentos, "
+                   f"saldo {data['balance']}, {len(data['saldos']['meses'])} meses")
+
+
+@app.cli.command("verificar-saldos")
+def verificar_saldos_command():
+    """Compara os saldos gravados nos livros com um recálculo completo e confere que
+    cada compra paga sai do financeiro uma única vez"""
+    total = 0
+    for file_path in LEDGER_FILES:
+        differences = verify_ledger(file_path)
+        for key, stored, expected in differences:
+            click.echo(f"{os.path.basename(file_path)} {key}: {stored} (esperado {expected})")
+        total += len(differences)
+    for conta_id, status, found, expected in verify_compras_pagas():
+        click.echo(f"compra da conta {conta_id} ({status}): {found} no financeiro (esperado {expected})")
+        total += 1
+    if total:
+        raise SystemExit(f"{total} diferenças encontradas")
+    click.echo("Saldos conferem com os lançamentos")
+
+
+@app.cli.command("benchmark-relatorios")
+@click.option("--tamanhos", default="10000,100000,1000000", help="Quantidades de ordens, separadas por vírgula")
+def benchmark_relatorios_command(tamanhos):
+    """Compara as somas por varredura com o motor colunar em ordens sintéticas"""
+    import random
+    statuses = ["Finalizada", "Cancelada", "Em Produção", "Aguardando Aprovação",
+                "Aguardando Pagamento", "Disponível para Retirada"]
+    periodos = [(ano, mes) for ano in (2024, 2025) for mes in range(1, 13)]
+
+    for size in [int(value) for value in tamanhos.split(",") if value.strip()]:
+        rng = random.Random(size)
+        orders = []
+        for numero in range(size):
+            ano, mes = rng.choice(periodos)
+            valor = round(rng.uniform(50, 5000), 2)
+            orders.append({
+                "numero": str(numero), "data": f"{ano}-{mes:02d}-{rng.randint(1, 28):02d}",
+                "status": rng.choice(statuses), "valor_total": valor,
+                "custo": round(valor * 0.6, 2), "valor_restante": round(valor / 2, 2)
+            })
 
-        return jsonify(export_data)
+        # Implementação anterior: um filtro e uma soma com float() por indicador
+        started = time.perf_counter()
+        for ano, mes in periodos:
+            periodo = f"{ano}-{mes:02d}"
+            do_mes = [order for order in orders if order["data"].startswith(periodo)]
+            sum(float(order.get("valor_total", 0)) for order in do_mes if order.get("status") == "Finalizada")
+            sum(float(order.get("custo", 0)) for order in do_mes if order.get("status") == "Finalizada")
+            sum(float(order.get("valor_restante", 0)) for order in do_mes
+                if order.get("status") not in ["Finalizada", "Cancelada"])
+        varredura = time.perf_counter() - started
+
+        started = time.perf_counter()
+        table = ColumnTable(ORDERS_FILE, orders)
+        construcao = time.perf_counter() - started
+        started = time.perf_counter()
+        for ano, mes in periodos:
+            resumo_ordens(table.aggregate("data", *month_range(ano, mes), ("valor_total", "custo", "valor_restante")))
+        consultas = time.perf_counter() - started
+
+        click.echo(f"{size} ordens, {len(periodos)} meses: varredura {varredura:.3f}s | "
+                   f"colunar {construcao:.3f}s (carga) + {consultas:.3f}s (consultas) | "
+                   f"{varredura / max(consultas, 1e-9):.1f}x por consulta com a tabela em memória")
+
+
+def _benchmark_orders(size):
+    """Ordens sintéticas montadas por build_order, como as gravadas pela API"""
+    import random
+    statuses = ["Finalizada", "Cancelada", "Em Produção", "Aguardando Aprovação",
+                "Aguardando Pagamento", "Disponível para Retirada"]
+    vendedores = [f"Vendedor {index}" for index in range(12)]
+    fornecedores = [f"Fornecedor {index}" for index in range(30)]
+    materiais = ["Lona", "Adesivo", "Banner", "Placa PVC", "Acrílico", "Papel Couché", "Vinil"]
+
+    rng = random.Random(size)
+    return [build_order({
+        "cliente": f"Cliente {rng.randint(1, size // 10 or 1)}", "vendedor": rng.choice(vendedores),
+        "fornecedor": rng.choice(fornecedores), "material": rng.sample(materiais, rng.randint(1, 3)),
+        "valor_total": round(rng.uniform(50, 5000), 2), "custo": round(rng.uniform(10, 2000), 2),
+        "data": f"{rng.choice((2024, 2025))}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+        "status": rng.choice(statuses)
+    }, numero) for numero in range(1, size + 1)]
+
+
+def _process_rss():
+    """Memória residente do processo inteiro em bytes"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        # Fora do Linux: pico de memória residente (ru_maxrss em KiB; em bytes no macOS)
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _worker_rss(raw_path):
+    """RSS do processo após cada estrutura que um worker monta para as ordens de raw_path"""
+    import gc
+    with open(raw_path) as f:
+        raw = f.read()
+    gc.collect()
+    steps = [("início", _process_rss())]
+    kept = []
+
+    def step(label, build):
+        value = build()
+        kept.append(value)
+        gc.collect()
+        steps.append((label, _process_rss()))
+        return value
+
+    step("cache de repositório (pickle)", lambda: pickle.dumps(json.loads(raw), pickle.HIGHEST_PROTOCOL))
+    records = step("registros residentes", lambda: json.loads(raw))
+    step("tabela colunar", lambda: ColumnTable(ORDERS_FILE, records))
+    step("índice por período (posições)", lambda: _build_period_index(ORDERS_FILE, records))
+    step("índice de agrupamento", lambda: _build_group_index(records))
+    step("índice de registros (posições)", lambda: _build_record_index(ORDERS_FILE, records))
+    # Layout anterior: o índice por período guardava uma cópia compacta de cada registro
+    step("cópias compactas no índice por período", lambda: [Order.from_dict(order) for order in records])
+    return steps
+
+
+@app.cli.command("benchmark-memoria")
+@click.option("--tamanhos", default="100000,300000", help="Quantidades de ordens, separadas por vírgula")
+def benchmark_memoria_command(tamanhos):
+    """Compara a memória de ordens como dicts e como registros compactos e mede o RSS
+    do processo com as estruturas que cada worker mantém"""
+    import gc
+    import subprocess
+    import tempfile
+    import tracemalloc
+
+    def measure(build):
+        gc.collect()
+        tracemalloc.start()
+        started = time.perf_counter()
+        value = build()
+        elapsed = time.perf_counter() - started
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        return value, size, elapsed
+
+    for size in [int(value) for value in tamanhos.split(",") if value.strip()]:
+        # Como no cache dos workers, os registros vêm do JSON (sem textos compartilhados)
+        raw = json.dumps(_benchmark_orders(size))
+
+        dicts, dict_bytes, dict_time = measure(lambda: json.loads(raw))
+        compact, compact_bytes, compact_time = measure(lambda: [Order.from_dict(order) for order in json.loads(raw)])
+        started = time.perf_counter()
+        iguais = all(record.to_dict() == order for record, order in zip(compact, dicts))
+        to_dict_time = time.perf_counter() - started
+
+        click.echo(f"{size} ordens: dicts {dict_bytes / 2 ** 20:.1f} MiB ({dict_time:.2f}s json) | "
+                   f"compactos {compact_bytes / 2 ** 20:.1f} MiB ({compact_time:.2f}s json + conversão, "
+                   f"{to_dict_time:.2f}s de volta para dict) | {dict_bytes / max(compact_bytes, 1):.1f}x menor"
+                   f"{'' if iguais else ' | ATENÇÃO: to_dict() difere do original'}")
+        del dicts, compact
+
+        # RSS do processo inteiro antes e depois de montar as estruturas, medido em um
+        # processo novo (a memória liberada acima continuaria contada neste)
+        with tempfile.TemporaryDirectory() as tmp:
+            raw_path, result_path = os.path.join(tmp, "ordens.json"), os.path.join(tmp, "rss.pickle")
+            with open(raw_path, 'w') as f:
+                f.write(raw)
+            code = ("import pickle, sys\n"
+                    f"from {__name__} import _worker_rss\n"
+                    "with open(sys.argv[2], 'wb') as f:\n    pickle.dump(_worker_rss(sys.argv[1]), f)\n")
+            result = subprocess.run([sys.executable, "-c", code, raw_path, result_path],
+                                    cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True)
+            if result.returncode != 0:
+                raise click.ClickException(f"Medição do RSS falhou:\n{result.stderr[-2000:]}")
+            with open(result_path, 'rb') as f:
+                steps = pickle.load(f)
+
+        inicial, anterior = steps[0][1], steps[0][1]
+        for label, rss in steps:
+            click.echo(f"  {label:40} RSS {rss / 2 ** 20:8.1f} MiB ({(rss - anterior) / 2 ** 20:+7.1f} MiB)")
+            anterior = rss
+        total = dict(steps)["índice de registros (posições)"]
+        click.echo(f"  RSS do worker: {inicial / 2 ** 20:.1f} MiB antes, {total / 2 ** 20:.1f} MiB depois "
+                   f"(+{(total - inicial) / 2 ** 20:.1f} MiB; com as cópias do layout anterior "
+                   f"+{(anterior - inicial) / 2 ** 20:.1f} MiB)")
+
+
+@app.cli.command("benchmark-codecs")
+@click.option("--tamanhos", default="10000,100000", help="Quantidades de ordens, separadas por vírgula")
+@click.option("--repeticoes", default=3, type=int, help="Melhor tempo entre N execuções")
+def benchmark_codecs_command(tamanhos, repeticoes):
+    """Mede gravação e leitura de cada codec com ordens e com o livro financeiro"""
+    import gc
+    codecs = [codec for name, codec in DATA_CODECS.items() if name != "orjson" or orjson is not None]
+    if orjson is None:
+        click.echo("orjson não instalado: codec orjson fora da comparação")
+
+    def best(func):
+        # Como o timeit: coleta de lixo desligada durante a medição
+        times = []
+        for _ in range(max(repeticoes, 1)):
+            gc.collect()
+            gc.disable()
+            try:
+                started = time.perf_counter()
+                func()
+                times.append(time.perf_counter() - started)
+            finally:
+                gc.enable()
+        return min(times)
+
+    for size in [int(value) for value in tamanhos.split(",") if value.strip()]:
+        orders = _benchmark_orders(size)
+        ledger = {"entries": [], "balance": 0, "last_update": datetime.datetime.now().isoformat()}
+        for entry_id, order in enumerate(orders, 1):
+            entry = order_financial_entry(order, entry_id)
+            entry["date"] = f"{order['data']}T10:00:00"
+            ledger["entries"].append(entry)
+        ledger = compute_ledger_balances(ledger)
+
+        for label, data in ((f"{size} ordens", orders), (f"financeiro com {size} lançamentos", ledger)):
+            click.echo(label)
+            for codec in codecs:
+                raw = codec.encode(data)
+                if decode_data(raw) != data:
+                    click.echo(f"  {codec.name:15} ATENÇÃO: leitura difere do original")
+                    continue
+                encode_time = best(lambda: codec.encode(data))
+                decode_time = best(lambda: decode_data(raw))
+                megabytes = len(raw) / 2 ** 20
+                click.echo(f"  {codec.name:15} {megabytes:7.1f} MiB | gravação {encode_time:.3f}s "
+                           f"({megabytes / max(encode_time, 1e-9):6.1f} MiB/s) | leitura {decode_time:.3f}s "
+                           f"({megabytes / max(decode_time, 1e-9):6.1f} MiB/s)")
+
+
+@app.cli.command("benchmark-sessoes")
+@click.option("--requisicoes", default=5000, type=int, help="Requisições simuladas por backend")
+def benchmark_sessoes_command(requisicoes):
+    """Mede o custo por requisição de abrir e salvar a sessão em cada backend"""
+    import tempfile
+    backends = [backend for backend in SESSION_BACKENDS if backend != "filesystem" or Session is not None]
+    if not os.environ.get("CUBO_SECRET_KEY"):
+        backends.remove("cookie")
+        click.echo("CUBO_SECRET_KEY não definida: backend cookie fora da comparação")
+    previous = {key: app.config.get(key) for key in ("SESSION_SQLITE_PATH", "SESSION_FILE_DIR")}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        app.config["SESSION_SQLITE_PATH"] = os.path.join(tmp, "sessions.db")
+        app.config["SESSION_FILE_DIR"] = os.path.join(tmp, "flask_session")
+        try:
+            for backend in backends:
+                interface = build_session_interface(backend)
+
+                # Login: cria a sessão e guarda o cookie devolvido
+                with app.test_request_context():
+                    login_session = interface.open_session(app, request)
+                    login_session.update(logged_in=True, username="admin", user_role="admin")
+                    response = app.response_class()
+                    interface.save_session(app, login_session, response)
+                cookie = response.headers["Set-Cookie"].split(";", 1)[0]
+
+                timings = {}
+                with app.test_request_context(headers={"Cookie": cookie}):
+                    for label, modify in (("leitura", False), ("escrita", True)):
+                        started = time.perf_counter()
+                        for index in range(requisicoes):
+                            current = interface.open_session(app, request)
+                            if not current.get("logged_in"):
+                                raise click.ClickException(f"Sessão perdida no backend {backend}")
+                            if modify:
+                                current["ultima_requisicao"] = index
+                            interface.save_session(app, current, app.response_class())
+                        timings[label] = (time.perf_counter() - started) / requisicoes * 1e6
+
+                click.echo(f"{backend:10} leitura {timings['leitura']:7.1f} µs/req | "
+                           f"com alteração {timings['escrita']:7.1f} µs/req")
+        finally:
+            app.config.update(previous)
+
+
+@app.cli.command("converter-dados")
+@click.option("--formato", required=True, type=click.Choice(sorted(DATA_CODECS)), help="Codec de destino")
+@click.option("--arquivo", "arquivos", multiple=True,
+              help="Nome do arquivo em data/ (pode repetir); padrão: todos os arquivos de dados")
+def converter_dados_command(formato, arquivos):
+    """Regrava os arquivos de dados e as partições mensais no formato indicado"""
+    if formato == "orjson" and orjson is None:
+        raise click.UsageError("O pacote orjson não está instalado")
+    codec = DATA_CODECS[formato]
+    file_paths = [path for path in DATA_FILES if not arquivos or os.path.basename(path) in arquivos]
+    unknown = set(arquivos) - {os.path.basename(path) for path in file_paths}
+    if unknown:
+        raise click.UsageError(f"Arquivos desconhecidos: {', '.join(sorted(unknown))}")
+
+    for file_path in file_paths:
+        paths = [file_path] if os.path.exists(file_path) else []
+        partition_dir = os.path.join(DATA_DIR, PARTITION_LAYOUT[file_path][0])
+        if os.path.isdir(partition_dir):
+            paths.extend(os.path.join(partition_dir, name) for name in sorted(os.listdir(partition_dir))
+                         if name.endswith(".json") and name != "meta.json")
+
+        with data_lock(file_path):
+            # O journal guarda o CRC do snapshot: convertê-lo faria o journal ser ignorado
+            if os.path.exists(JournalStorage.journal_path(file_path)):
+                click.echo(f"{os.path.basename(file_path)}: journal pendente, "
+                           f"rode compactar-journal antes de converter")
+                continue
+            before = after = 0
+            for path in paths:
+                with open(path, 'rb') as f:
+                    raw = f.read()
+                data = decode_data(raw)
+                converted = codec.encode(data)
+                if decode_data(converted) != data:
+                    raise SystemExit(f"{path}: conversão para {formato} não preserva os dados")
+                if converted != raw:
+                    # Partições seladas continuam somente leitura
+                    mode = os.stat(path).st_mode & 0o777
+                    _atomic_write(path, lambda f: f.write(converted), binary=True)
+                    os.chmod(path, mode)
+                before += len(raw)
+                after += len(converted)
+        click.echo(f"{os.path.basename(file_path)}: {len(paths)} arquivo(s), "
+                   f"{before / 1024:.0f} KiB -> {after / 1024:.0f} KiB")
+
+    configured = {get_codec(path).name for path in file_paths}
+    if configured != {formato}:
+        click.echo(f"Atenção: as próximas gravações usam {', '.join(sorted(configured))}; "
+                   f"defina CUBO_DATA_CODEC (ou CUBO_LEDGER_CODEC) como {formato}")
+
+
+@app.cli.command("compactar-journal")
+def compactar_journal_command():
+    """Incorpora os journals pendentes aos snapshots"""
+    storage = JournalStorage()
+    for file_path in DATA_FILES:
+        if storage.compact(file_path):
+            click.echo(f"{os.path.basename(file_path)}: journal compactado")
+
+
+@app.cli.command("teste-concorrencia")
+@click.option("--processos", default=4, type=int)
+@click.option("--pedidos", default=25, type=int, help="Ordens criadas por processo")
+@click.confirmation_option(prompt="O teste grava ordens de teste em DATA_DIR (use CUBO_DATA_DIR com uma cópia). Continuar?")
+def teste_concorrencia_command(processos, pedidos):
+    """Cria ordens em paralelo a partir de vários processos e confere se nenhuma se perdeu"""
+    import multiprocessing
+
+    run_id = datetime.datetime.now().strftime("%H%M%S%f")
+    workers = multiprocessing.get_context("fork").Pool(processos)
+    try:
+        results = workers.starmap(_stress_create_orders, [(run_id, n, pedidos) for n in range(processos)])
+    finally:
+        workers.close()
+        workers.join()
+    created = sum(result[0] for result in results)
+    contended = sum(stats["contended"] for result in results for stats in result[1].values())
+    wait_max = max([stats["wait_max_ms"] for result in results for stats in result[1].values()] or [0])
+
+    clear_data_cache()
+    orders = [order for order in load_data(ORDERS_FILE)
+              if isinstance(order, dict) and order.get("cliente", "").startswith(f"stress-{run_id}-")]
+    numeros = [order.get("numero") for order in orders]
+    expected = processos * pedidos
+
+    click.echo(f"Requisições com sucesso: {created}/{expected}")
+    click.echo(f"Ordens gravadas: {len(orders)}/{expected}")
+    click.echo(f"Números duplicados: {len(numeros) - len(set(numeros))}")
+    click.echo(f"Bloqueios com espera: {contended} (espera máxima {wait_max:.1f} ms)")
+    if created != expected or len(orders) != expected or len(numeros) != len(set(numeros)):
+        raise SystemExit(1)
+
+
+def _stress_create_orders(run_id, worker, total):
+    client = app.test_client()
+    created = 0
+    for n in range(total):
+        response = client.post("/api/orders", json={
+            "cliente": f"stress-{run_id}-{worker}-{n}",
+            "vendedor": "stress",
+            "material": "Teste",
+            "valor_total": "10",
+            "custo": "1"
+        })
+        created += 1 if response.status_code == 200 else 0
+    return created, get_lock_stats()
+
+
+def _sqlite_write_sequence(client):
+    """Gravações (criar, editar, excluir, pagar) feitas pelas rotas da API.
+
+    Devolve (passo, status, corpo) de cada chamada. Os ids usados vêm das respostas
+    anteriores, então a mesma sequência roda igual em qualquer backend.
+    """
+    results = []
+
+    def call(label, method, url, body=None):
+        response = client.open(url, method=method, json=body)
+        payload = response.get_json(silent=True)
+        results.append((label, response.status_code, payload))
+        return payload if isinstance(payload, dict) else {}
+
+    existentes = [order["numero"] for order in client.get("/api/orders").get_json() or []
+                  if isinstance(order, dict) and "numero" in order]
+    ordem = {"cliente": "Verificação", "vendedor": "Teste", "material": "Lona, Adesivo",
+             "valor_total": 250.0, "custo": 100.0, "fornecedor": "Cubo"}
+
+    numero = call("criar ordem", "POST", "/api/orders", ordem).get("order", {}).get("numero")
+    call("editar ordem criada", "PUT", f"/api/orders/{numero}",
+         dict(ordem, status="Finalizada", valor_total=300.0))
+    if existentes:
+        # Alterações no meio e no início da lista exercitam o diff por posição do SQLite
+        call("editar ordem existente", "PUT", f"/api/orders/{existentes[len(existentes) // 2]}",
+             dict(ordem, status="Em Produção"))
+        call("editar primeira ordem", "PUT", f"/api/orders/{existentes[0]}", dict(ordem, custo=50.0))
+    call("lote de ordens", "POST", "/api/orders/batch",
+         {"modo": "melhor_esforco", "ordens": [dict(ordem, cliente=f"Lote {n}") for n in range(3)] + [{}]})
+
+    call("criar compra", "POST", "/api/compras",
+         {"item": "Lona", "fornecedor": "Fornecedor", "valor": 80.0,
+          "data": datetime.date.today().isoformat()})
+    conta = {"descricao": "Verificação", "valor": 120.0, "vencimento": datetime.date.today().isoformat(),
+             "categoria": "Outros", "forma_pagamento": "PIX"}
+    conta_id = call("criar conta", "POST", "/api/contas_pagar", conta).get("conta", {}).get("id")
+    call("editar conta", "PUT", f"/api/contas_pagar/{conta_id}", dict(conta, valor=150.0))
+    call("pagar conta", "POST", f"/api/contas_pagar/{conta_id}/pagar")
+
+    contas = [item for item in client.get("/api/contas_pagar").get_json() or [] if isinstance(item, dict)]
+    if contas:
+        call("excluir conta existente", "DELETE", f"/api/contas_pagar/{contas[len(contas) // 2]['id']}")
+    pendentes = [item["id"] for item in contas if item.get("status") != "Pago"][:3]
+    if pendentes:
+        call("pagar lote", "POST", "/api/contas_pagar/pagar-lote", {"ids": pendentes})
+    return results
+
+
+def _without_timestamps(value, today):
+    """Troca instantes gerados durante a verificação por um marcador"""
+    if isinstance(value, str) and value.startswith(today + "T"):
+        return "<agora>"
+    if isinstance(value, CompactRecord):
+        value = value.to_dict()
+    if isinstance(value, (list, tuple)):
+        return [_without_timestamps(item, today) for item in value]
+    if isinstance(value, dict):
+        return {key: _without_timestamps(item, today) for key, item in value.items()}
+    return value
+
+
+def _run_write_sequence(backend, data):
+    """Roda _sqlite_write_sequence em um processo novo, com CUBO_DATA_DIR em uma cópia.
+
+    data traz o conteúdo de cada coleção (pelo nome do arquivo), gravado no backend
+    antes da sequência para que as duas rodadas partam dos mesmos dados.
+    """
+    app.config["STORAGE_BACKEND"] = backend
+    storage = get_storage()
+    for name, content in data.items():
+        storage.write(os.path.join(DATA_DIR, name), content)
+    clear_data_cache()
+
+    client = app.test_client()
+    with client.session_transaction() as client_session:
+        client_session["logged_in"] = True
+        client_session["username"] = "admin"
+        client_session["user_role"] = "admin"
+    steps = _sqlite_write_sequence(client)
+    clear_data_cache()
+    collections = {os.path.basename(path): load_data(path) for path in SQLITE_TABLES}
+    return _without_timestamps((steps, collections), datetime.date.today().isoformat())
+
+
+def _verify_sqlite_writes():
+    """Roda _sqlite_write_sequence nos dois backends a partir dos mesmos dados.
+
+    Cada rodada acontece em um processo próprio sobre uma cópia temporária de DATA_DIR;
+    o diretório real só é lido.
+    """
+    import shutil
+    import subprocess
+    import tempfile
+    source = get_storage()
+    data = {os.path.basename(file_path): source.read(file_path)
+            for file_path in SQLITE_TABLES if source.exists(file_path)}
+
+    runs = {}
+    code = ("import pickle, sys\n"
+            f"from {__name__} import _run_write_sequence\n"
+            "with open(sys.argv[2], 'rb') as f:\n    data = pickle.load(f)\n"
+            "with open(sys.argv[3], 'wb') as f:\n    pickle.dump(_run_write_sequence(sys.argv[1], data), f)\n")
+    for backend in ("json", "sqlite"):
+        with tempfile.TemporaryDirectory() as tmp:
+            copy = os.path.join(tmp, "data")
+            shutil.copytree(DATA_DIR, copy, ignore=shutil.ignore_patterns(
+                "*.lock", "*.tmp", "cubo.db*", "sessions.db*", "exports"))
+            env = {
+                "CUBO_DATA_DIR": copy,
+                "CUBO_STORAGE_BACKEND": backend,
+                "CUBO_SQLITE_PATH": os.path.join(copy, "cubo.db"),
+                "CUBO_SESSION_SQLITE_PATH": os.path.join(copy, "sessions.db"),
+            }
+            data_path, result_path = os.path.join(tmp, "entrada.pickle"), os.path.join(tmp, "resultado.pickle")
+            with open(data_path, 'wb') as f:
+                pickle.dump(data, f, pickle.HIGHEST_PROTOCOL)
+            result = subprocess.run([sys.executable, "-c", code, backend, data_path, result_path],
+                                    cwd=os.path.dirname(os.path.abspath(__file__)), env=dict(os.environ, **env),
+                                    capture_output=True, text=True)
+            if result.returncode != 0:
+                raise click.ClickException(f"Rodada {backend} falhou:\n{result.stderr[-2000:]}")
+            with open(result_path, 'rb') as f:
+                runs[backend] = pickle.load(f)
+
+    (json_steps, json_collections), (sqlite_steps, sqlite_collections) = runs["json"], runs["sqlite"]
+    checks = [("quantidade de passos", len(json_steps), len(sqlite_steps))]
+    checks += [(json_step[0], json_step[1:], sqlite_step[1:])
+               for json_step, sqlite_step in zip(json_steps, sqlite_steps)]
+    checks += [(f"coleção {name}", json_collections[name], sqlite_collections[name]) for name in json_collections]
+    return checks
+
+
+@app.cli.command("verificar-sqlite")
+@click.option("--mes", default=datetime.datetime.now().month, type=int)
+@click.option("--ano", default=datetime.datetime.now().year, type=int)
+@click.option("--gravacoes/--sem-gravacoes", default=True,
+              help="Também compara uma sequência de gravações (POST/PUT/DELETE) nos dois backends")
+def verificar_sqlite_command(mes, ano, gravacoes):
+    """Compara as respostas das rotas GET /api/* e o resultado de gravações entre os backends json e sqlite"""
+    # Rotas que respondem em stream (SSE, downloads) não têm corpo JSON para comparar
+    streaming = {"stream_events", "export_balancete"}
+    routes = sorted(
+        rule.rule for rule in app.url_map.iter_rules()
+        if rule.rule.startswith("/api/") and not rule.rule.startswith("/api/sistema/")
+        and "GET" in rule.methods and not rule.arguments and rule.endpoint not in streaming
+    )
+
+    client = app.test_client()
+    with client.session_transaction() as client_session:
+        client_session["logged_in"] = True
+        client_session["username"] = "admin"
+        client_session["user_role"] = "admin"
+
+    previous_backend = app.config["STORAGE_BACKEND"]
+    responses = {}
+    try:
+        for backend in ("json", "sqlite"):
+            app.config["STORAGE_BACKEND"] = backend
+            for route in routes:
+                response = client.get(route, query_string={"mes": mes, "ano": ano})
+                body = response.get_json(silent=True)
+                response.close()
+                if isinstance(body, dict):
+                    body.pop("gerado_em", None)
+                responses.setdefault(route, []).append((response.status_code, body))
+    finally:
+        app.config["STORAGE_BACKEND"] = previous_backend
+
+    divergences = 0
+    for route, (json_response, sqlite_response) in responses.items():
+        if json_response == sqlite_response:
+            click.echo(f"OK       {route}")
+        else:
+            divergences += 1
+            click.echo(f"DIVERGE  {route}")
 
-    except Exception as e:
-        logger.error(f"Erro ao exportar balancete: {e}")
-        return jsonify({"error": str(e)}), 500
+    if gravacoes:
+        for label, json_result, sqlite_result in _verify_sqlite_writes():
+            if json_result == sqlite_result:
+                click.echo(f"OK       {label}")
+            else:
+                divergences += 1
+                click.echo(f"DIVERGE  {label}")
+    if divergences:
+        raise SystemExit(1)
 
 
 if __name__ == "__main__":
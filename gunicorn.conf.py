@@ -0,0 +1,17 @@
+# Configuração do gunicorn, carregada automaticamente ao rodar na raiz do projeto:
+#   gunicorn cubo:app
+#
+# As conexões de /api/events (Server-Sent Events) ficam abertas enquanto o painel está
+# na tela. Com workers gthread cada conexão ocupa só uma thread e o worker continua
+# avisando o master de que está vivo; com workers sync cada conexão prenderia o
+# processo inteiro, que seria morto ao atingir o timeout.
+import os
+
+bind = os.environ.get("CUBO_BIND", "0.0.0.0:5000")
+workers = int(os.environ.get("CUBO_WORKERS", "2"))
+worker_class = "gthread"
+threads = int(os.environ.get("CUBO_THREADS", "16"))
+timeout = int(os.environ.get("CUBO_TIMEOUT", "30"))
+
+# Metade das threads de cada worker fica livre para as demais rotas
+os.environ.setdefault("CUBO_SSE_MAX_SUBSCRIBERS", str(max(1, threads // 2)))
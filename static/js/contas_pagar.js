@@ -45,7 +45,7 @@ window.ContasPagar = {
                     row.append(`<td>${conta.descricao}</td>`);
                     row.append(`<td>${conta.fornecedor || '-'}</td>`);
                     row.append(`<td>${ContasPagar.formatMoney(conta.valor)}</td>`);
-                    row.append(`<td>${ContasPagar.formatDate(conta.data_vencimento)}</td>`);
+                    row.append(`<td>${ContasPagar.formatDate(conta.vencimento)}</td>`);
                     row.append(`<td>${conta.categoria || '-'}</td>`);
                     row.append(`<td>${conta.forma_pagamento || '-'}</td>`);
                     row.append(`<td class="status-${conta.status.toLowerCase()}">${conta.status}</td>`);
@@ -128,7 +128,7 @@ window.ContasPagar = {
                 $('#contaDescricao').val(conta.descricao);
                 $('#contaFornecedor').val(conta.fornecedor);
                 $('#contaValor').val(conta.valor);
-                $('#contaVencimento').val(conta.data_vencimento);
+                $('#contaVencimento').val(conta.vencimento);
                 $('#contaCategoria').val(conta.categoria);
                 $('#contaFormaPagamento').val(conta.forma_pagamento);
                 $('#contaObservacao').val(conta.observacao);
@@ -208,7 +208,7 @@ window.ContasPagar = {
                 descricao: $('#contaDescricao').val(),
                 fornecedor: $('#contaFornecedor').val(),
                 valor: parseFloat($('#contaValor').val()),
-                data_vencimento: $('#contaVencimento').val(),
+                vencimento: $('#contaVencimento').val(),
                 categoria: $('#contaCategoria').val(),
                 forma_pagamento: $('#contaFormaPagamento').val(),
                 observacao: $('#contaObservacao').val(),
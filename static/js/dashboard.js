@@ -102,41 +102,26 @@ window.Dashboard = {
                 return;
             }
 
-            $.get('/api/orders')
-                .done(function(orders) {
-                    if (!Array.isArray(orders)) {
-                        console.error('Resposta inválida da API:', orders);
+            // Filtros e ordenação (data mais recente primeiro) aplicados pelo servidor
+            const mesTexto = String(mes).padStart(2, '0');
+            const filtros = {
+                data_inicio: `${ano}-${mesTexto}-01`,
+                data_fim: `${ano}-${mesTexto}-31`,
+                ordenar: 'data',
+                direcao: 'desc'
+            };
+            if (status) filtros.status = status;
+            if (vendedor) filtros.vendedor = vendedor;
+            if (fornecedor) filtros.fornecedor = fornecedor;
+
+            $.get('/api/orders', filtros)
+                .done(function(response) {
+                    if (!response || !Array.isArray(response.orders)) {
+                        console.error('Resposta inválida da API:', response);
                         return;
                     }
 
-                    // Filtrar as ordens
-                    const filteredOrders = orders.filter(order => {
-                        if (!order || !order.data) {
-                            console.log('Ordem inválida ou sem data:', order);
-                            return false;
-                        }
-
-                        try {
-                            const orderDate = new Date(order.data);
-                            if (isNaN(orderDate.getTime())) {
-                                console.log('Data inválida:', order.data);
-                                return false;
-                            }
-
-                            const orderMonth = orderDate.getMonth() + 1;
-                            const orderYear = orderDate.getFullYear();
-
-                            const matchesDate = orderMonth === mes && orderYear === ano;
-                            const matchesStatus = !status || order.status === status;
-                            const matchesVendedor = !vendedor || order.vendedor === vendedor;
-                            const matchesFornecedor = !fornecedor || order.fornecedor === fornecedor;
-
-                            return matchesDate && matchesStatus && matchesVendedor && matchesFornecedor;
-                        } catch (error) {
-                            console.error('Erro ao processar ordem:', error, order);
-                            return false;
-                        }
-                    });
+                    const filteredOrders = response.orders;
 
                     console.log('Ordens filtradas:', filteredOrders);
 
@@ -177,9 +162,6 @@ window.Dashboard = {
                     const tbody = $('#recentOrdersTable tbody');
                     tbody.empty();
 
-                    // Ordenar por data mais recente
-                    filteredOrders.sort((a, b) => new Date(b.data) - new Date(a.data));
-
                     // Pegar as 10 ordens mais recentes
                     const recentOrders = filteredOrders.slice(0, 10);
 
@@ -243,6 +225,16 @@ window.Dashboard = {
             $('#dashboardMesSelect, #dashboardAnoSelect, #dashboardStatusFilter, #dashboardVendedorFilter, #dashboardFornecedorFilter').on('change', () => {
                 this.updateDashboard();
             });
+
+            // Recarregar quando ordens forem criadas ou alteradas (ver eventos.js)
+            if (window.CuboEventos) {
+                CuboEventos.on(['ordem_criada', 'ordens_criadas', 'ordem_atualizada', 'mes_encerrado', 'recarregar'], () => {
+                    this.updateDashboard();
+                });
+                CuboEventos.on('colecao_alterada', dados => {
+                    if (dados.colecao === 'orders') this.updateDashboard();
+                });
+            }
         } catch (error) {
             console.error('Erro na inicialização do dashboard:', error);
         }
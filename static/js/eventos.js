@@ -0,0 +1,74 @@
+// Eventos em tempo real (/api/events)
+// Uma única conexão EventSource por página, compartilhada pelos módulos que querem
+// ser avisados de alterações. Quando a aba fica oculta a conexão é fechada; ao voltar
+// a ficar visível ela é reaberta e os assinantes recebem um evento "recarregar",
+// já que alterações feitas nesse intervalo não foram recebidas.
+window.CuboEventos = (function () {
+    const handlers = {};
+    let source = null;
+
+    function dispatch(tipo, dados) {
+        (handlers[tipo] || []).forEach(handler => {
+            try {
+                handler(dados, tipo);
+            } catch (error) {
+                console.error(`Erro ao tratar evento ${tipo}:`, error);
+            }
+        });
+    }
+
+    function listen(tipo) {
+        if (!source) return;
+        source.addEventListener(tipo, function (event) {
+            let dados = {};
+            try {
+                dados = JSON.parse(event.data);
+            } catch (error) {
+                console.error("Evento inválido recebido:", event.data);
+            }
+            dispatch(tipo, dados);
+        });
+    }
+
+    function connect() {
+        if (source || document.hidden || typeof EventSource === "undefined") return;
+        source = new EventSource("/api/events");
+        Object.keys(handlers).forEach(listen);
+        source.onerror = function () {
+            // Sessão expirada ou limite de conexões: o navegador não reconecta sozinho
+            if (source && source.readyState === EventSource.CLOSED) {
+                source = null;
+            }
+        };
+    }
+
+    function disconnect() {
+        if (source) {
+            source.close();
+            source = null;
+        }
+    }
+
+    document.addEventListener("visibilitychange", function () {
+        if (document.hidden) {
+            disconnect();
+        } else if (!source) {
+            connect();
+            dispatch("recarregar", {});
+        }
+    });
+
+    return {
+        // Registra um handler para um ou mais tipos de evento
+        on: function (tipos, handler) {
+            (Array.isArray(tipos) ? tipos : [tipos]).forEach(tipo => {
+                if (!handlers[tipo]) {
+                    handlers[tipo] = [];
+                    listen(tipo);
+                }
+                handlers[tipo].push(handler);
+            });
+            connect();
+        }
+    };
+})();
@@ -206,8 +206,10 @@ async function transferOrders() {
             throw new Error(error.error || 'Erro ao transferir pedidos');
         }
         
+        // A transferência roda em segundo plano; acompanhar a tarefa até o fim
         const result = await response.json();
-        showSuccess(result.message);
+        const job = await waitForJob(result.job);
+        showSuccess(job.resultado.message);
         loadFinancialData();
     } catch (error) {
         console.error('Erro:', error);
@@ -215,6 +217,22 @@ async function transferOrders() {
     }
 }
 
+// Aguarda a conclusão de uma tarefa em segundo plano (/api/jobs/<id>)
+async function waitForJob(job) {
+    while (job.status === 'pendente' || job.status === 'executando') {
+        await new Promise(resolve => setTimeout(resolve, 1000));
+        const response = await fetch(`/api/jobs/${job.id}`, { credentials: 'include' });
+        if (!response.ok) {
+            throw new Error('Erro ao consultar a tarefa');
+        }
+        job = await response.json();
+    }
+    if (job.status !== 'concluido') {
+        throw new Error(job.erro || `Tarefa ${job.status}`);
+    }
+    return job;
+}
+
 // Função para mostrar mensagens de sucesso
 function showSuccess(message) {
     const successDiv = document.createElement('div');
@@ -393,7 +411,7 @@ function loadContasPagar() {
                 row.append(`<td>${conta.id}</td>`);
                 row.append(`<td>${conta.descricao}</td>`);
                 row.append(`<td>${formatMoney(conta.valor)}</td>`);
-                row.append(`<td>${formatDate(conta.data_vencimento)}</td>`);
+                row.append(`<td>${formatDate(conta.vencimento)}</td>`);
                 row.append(`<td class="status-${conta.status.toLowerCase()}">${conta.status}</td>`);
 
                 const actions = $('<td class="actions">');
@@ -437,7 +455,7 @@ function editarConta(id) {
             $('#contaId').val(conta.id);
             $('#contaDescricao').val(conta.descricao);
             $('#contaValor').val(conta.valor);
-            $('#contaVencimento').val(conta.data_vencimento);
+            $('#contaVencimento').val(conta.vencimento);
             $('#contaStatus').val(conta.status);
 
             // Mostrar modal
@@ -450,9 +468,16 @@ function editarConta(id) {
 
 // Event listeners
 $(document).ready(function() {
-    // Atualizar cards financeiros a cada 30 segundos
+    // Atualizar cards financeiros quando um evento de ordem, conta ou saldo chegar
     updateFinanceiroCards();
-    setInterval(updateFinanceiroCards, 30000);
+    if (window.CuboEventos) {
+        let pendingCards = null;
+        CuboEventos.on(['ordem_criada', 'ordens_criadas', 'ordem_atualizada', 'conta_paga', 'contas_pagas', 'saldo_atualizado',
+                        'mes_encerrado', 'colecao_alterada', 'recarregar'], function() {
+            clearTimeout(pendingCards);
+            pendingCards = setTimeout(updateFinanceiroCards, 300);
+        });
+    }
 
     // Carregar contas a pagar
     if ($('#contasPagarTable').length) {
@@ -467,7 +492,7 @@ $(document).ready(function() {
             descricao: $('#contaDescricao').val(),
             fornecedor: $('#contaFornecedor').val(),
             valor: parseFloat($('#contaValor').val()),
-            data_vencimento: $('#contaVencimento').val(),
+            vencimento: $('#contaVencimento').val(),
             categoria: $('#contaCategoria').val(),
             forma_pagamento: $('#contaFormaPagamento').val(),
             observacao: $('#contaObservacao').val()
@@ -7,43 +7,16 @@ document.addEventListener('DOMContentLoaded', function() {
     // Função para carregar dados e criar o gráfico
     async function loadMaterialsChart() {
         try {
-            // Buscar dados das ordens
-            const response = await fetch('/api/orders');
+            // Buscar os 8 materiais mais comuns, já agregados pelo servidor
+            const response = await fetch('/api/analytics/materials?limite=8');
             if (!response.ok) {
-                throw new Error('Erro ao buscar dados das ordens');
+                throw new Error('Erro ao buscar dados dos materiais');
             }
             
-            const orders = await response.json();
+            const resultado = await response.json();
             
-            // Processar dados para o gráfico
-            const materialsCount = {};
-            
-            orders.forEach(order => {
-                if (!order.material) return;
-                
-                // Tratar material como array ou string
-                let materials = [];
-                if (Array.isArray(order.material)) {
-                    materials = order.material;
-                } else if (typeof order.material === 'string') {
-                    materials = [order.material];
-                }
-                
-                materials.forEach(material => {
-                    if (material && material.trim()) {
-                        const trimmedMaterial = material.trim();
-                        materialsCount[trimmedMaterial] = (materialsCount[trimmedMaterial] || 0) + 1;
-                    }
-                });
-            });
-            
-            // Ordenar materiais por contagem (do maior para o menor)
-            const sortedMaterials = Object.entries(materialsCount)
-                .sort((a, b) => b[1] - a[1])
-                .slice(0, 8); // Limitar aos 8 materiais mais comuns
-            
-            const labels = sortedMaterials.map(item => item[0]);
-            const data = sortedMaterials.map(item => item[1]);
+            const labels = resultado.itens.map(item => item.nome);
+            const data = resultado.itens.map(item => item.quantidade);
             
             // Cores para o gráfico
             const backgroundColors = [
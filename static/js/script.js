@@ -62,9 +62,18 @@ document.addEventListener("DOMContentLoaded", function () {
     };
 
     // --- Funções de API ---
+    // Última resposta de cada URL com seu ETag: em um 304 o servidor confirma que os
+    // dados não mudaram e a cópia local é reaproveitada
+    const responseCache = new Map();
+
     async function fetchData(url) {
         try {
-            const response = await fetch(url);
+            const cached = responseCache.get(url);
+            const headers = cached ? { "If-None-Match": cached.etag } : {};
+            const response = await fetch(url, { headers, cache: "no-store" });
+            if (response.status === 304 && cached) {
+                return structuredClone(cached.data);
+            }
             if (!response.ok) {
                 if (response.status === 401) {
                     console.error("Unauthorized access. Redirecting to login.");
@@ -73,7 +82,12 @@ document.addEventListener("DOMContentLoaded", function () {
                 }
                 throw new Error(`HTTP error! status: ${response.status}`);
             }
-            return await response.json();
+            const data = await response.json();
+            const etag = response.headers.get("ETag");
+            if (etag) {
+                responseCache.set(url, { etag, data: structuredClone(data) });
+            }
+            return data;
         } catch (error) {
             console.error(`Error fetching ${url}:`, error);
             return null;
@@ -522,9 +536,42 @@ document.addEventListener("DOMContentLoaded", function () {
         }
     }
 
+    // --- Sincronização das coleções ---
+    // Depois da primeira carga, cada coleção pede apenas o que mudou desde a versão
+    // que já tem (?since=) e aplica as alterações na própria lista. Quando o servidor
+    // não tem mais esse histórico, devolve a coleção completa.
+    const syncedCollections = {
+        orders: { url: "/api/orders", key: "numero", items: [], version: 0 },
+        compras: { url: "/api/compras", key: "id", items: [], version: 0 },
+        contas_pagar: { url: "/api/contas_pagar", key: "id", items: [], version: 0 }
+    };
+
+    async function syncCollection(name) {
+        const collection = syncedCollections[name];
+        const result = await fetchData(`${collection.url}?since=${collection.version}`);
+        if (!result) return null;
+
+        if (result.completo) {
+            collection.items.splice(0, collection.items.length, ...result.registros);
+        } else {
+            result.alteracoes.forEach(change => {
+                const index = collection.items.findIndex(item => String(item[collection.key]) === change.id);
+                if (change.op === "delete") {
+                    if (index !== -1) collection.items.splice(index, 1);
+                } else if (index !== -1) {
+                    collection.items[index] = change.registro;
+                } else {
+                    collection.items.push(change.registro);
+                }
+            });
+        }
+        collection.version = result.versao;
+        return collection.items;
+    }
+
     // --- Funções de Carregamento de Dados ---
     async function loadDashboardData() {
-        const orders = await fetchData("/api/orders");
+        const orders = await syncCollection("orders");
         if (!orders) return;
         
         currentOrders = orders;
@@ -533,42 +580,34 @@ document.addEventListener("DOMContentLoaded", function () {
         const kpis = calculateKPIs(orders);
         updateKPIs(kpis);
         
-        // Renderizar tabela de ordens recentes
-        const recentOrders = [...orders].sort((a, b) => {
-            const dateA = new Date(a.data + "T00:00:00");
-            const dateB = new Date(b.data + "T00:00:00");
-            return dateB - dateA;
-        }).slice(0, 5);
+        // Renderizar tabela de ordens recentes (ordenadas pelo servidor)
+        const recentOrders = await fetchOrders({ ordenar: "data", direcao: "desc", limite: 5 });
+        if (!recentOrders) return;
         
         renderOrdersTable(recentOrdersTableBody, recentOrders);
     }
 
     async function loadAllOrders() {
-        const orders = await fetchData("/api/orders");
+        // Filtros aplicados pelo servidor
+        const orders = await fetchOrders(orderFilterParams());
         if (!orders) return;
         
         currentOrders = orders;
         
-        // Aplicar filtros
-        const filteredOrders = filterOrders(orders);
-        
         // Renderizar tabela
-        renderOrdersTable(allOrdersTableBody, filteredOrders);
+        renderOrdersTable(allOrdersTableBody, orders);
     }
 
     async function loadProducaoOrders() {
-        const orders = await fetchData("/api/orders");
-        if (!orders) return;
-        
-        // Filtrar apenas ordens em produção
-        const ordersEmProducao = orders.filter(order => order.status === "Em Produção");
+        const ordersEmProducao = await fetchOrders({ status: "Em Produção" });
+        if (!ordersEmProducao) return;
         
         // Renderizar tabela
         renderOrdersTable(producaoTableBody, ordersEmProducao);
     }
 
     async function loadFinanceiroData() {
-        const orders = await fetchData("/api/orders");
+        const orders = await syncCollection("orders");
         if (!orders) return;
         
         currentOrders = orders;
@@ -582,7 +621,7 @@ document.addEventListener("DOMContentLoaded", function () {
     }
 
     async function loadCompras() {
-        const compras = await fetchData("/api/compras");
+        const compras = await syncCollection("compras");
         if (!compras) return;
         
         currentCompras = compras;
@@ -592,7 +631,7 @@ document.addEventListener("DOMContentLoaded", function () {
     }
 
     async function loadContasPagar() {
-        const contas = await fetchData("/api/contas_pagar");
+        const contas = await syncCollection("contas_pagar");
         if (!contas) return;
         
         currentContasPagar = contas;
@@ -606,9 +645,9 @@ document.addEventListener("DOMContentLoaded", function () {
         const ano = balanceteAnoSelect.value;
         
         // Simular dados de balancete (em produção, isso viria da API)
-        const orders = await fetchData("/api/orders");
-        const compras = await fetchData("/api/compras");
-        const contas = await fetchData("/api/contas_pagar");
+        const orders = await syncCollection("orders");
+        const compras = await syncCollection("compras");
+        const contas = await syncCollection("contas_pagar");
         
         if (!orders || !compras || !contas) return;
         
@@ -655,26 +694,29 @@ document.addEventListener("DOMContentLoaded", function () {
     }
 
     // --- Funções de Filtro ---
-    function filterOrders(orders) {
-        const searchTerm = orderSearchInput.value.toLowerCase();
-        const vendedorFilter = vendedorFilterInput.value.toLowerCase();
-        const statusFilter = statusFilterSelect.value;
-        
-        return orders.filter(order => {
-            // Filtro de busca
-            const matchesSearch = !searchTerm || 
-                                 order.numero?.toLowerCase().includes(searchTerm) || 
-                                 order.cliente?.toLowerCase().includes(searchTerm);
-            
-            // Filtro de vendedor
-            const matchesVendedor = !vendedorFilter || 
-                                   order.vendedor?.toLowerCase().includes(vendedorFilter);
-            
-            // Filtro de status
-            const matchesStatus = !statusFilter || order.status === statusFilter;
-            
-            return matchesSearch && matchesVendedor && matchesStatus;
+    function orderFilterParams() {
+        return {
+            busca: orderSearchInput.value.trim(),
+            vendedor: vendedorFilterInput.value.trim(),
+            status: statusFilterSelect.value
+        };
+    }
+
+    // Busca ordens filtradas no servidor; parâmetros vazios são ignorados
+    async function fetchOrders(filters) {
+        const params = new URLSearchParams();
+        Object.entries(filters).forEach(([key, value]) => {
+            if (value) params.append(key, value);
         });
+        if (!params.has("direcao")) params.append("direcao", "asc");
+        const result = await fetchData(`/api/orders?${params.toString()}`);
+        return result ? result.orders : null;
+    }
+
+    let filterTimeout = null;
+    function scheduleOrdersReload() {
+        clearTimeout(filterTimeout);
+        filterTimeout = setTimeout(loadAllOrders, 250);
     }
 
     // --- Funções de Cálculo ---
@@ -1204,32 +1246,22 @@ document.addEventListener("DOMContentLoaded", function () {
             const activeSection = document.querySelector(".dashboard-section.active-section");
             if (activeSection && activeSection.id === "ordensSection") {
                 orderSearchInput.value = searchTerm;
-                const filteredOrders = filterOrders(currentOrders);
-                renderOrdersTable(allOrdersTableBody, filteredOrders);
+                scheduleOrdersReload();
             }
         });
     }
 
     // Filtros de ordens
     if (orderSearchInput) {
-        orderSearchInput.addEventListener("input", function() {
-            const filteredOrders = filterOrders(currentOrders);
-            renderOrdersTable(allOrdersTableBody, filteredOrders);
-        });
+        orderSearchInput.addEventListener("input", scheduleOrdersReload);
     }
 
     if (vendedorFilterInput) {
-        vendedorFilterInput.addEventListener("input", function() {
-            const filteredOrders = filterOrders(currentOrders);
-            renderOrdersTable(allOrdersTableBody, filteredOrders);
-        });
+        vendedorFilterInput.addEventListener("input", scheduleOrdersReload);
     }
 
     if (statusFilterSelect) {
-        statusFilterSelect.addEventListener("change", function() {
-            const filteredOrders = filterOrders(currentOrders);
-            renderOrdersTable(allOrdersTableBody, filteredOrders);
-        });
+        statusFilterSelect.addEventListener("change", loadAllOrders);
     }
 
     // Modais
@@ -1356,10 +1388,53 @@ document.addEventListener("DOMContentLoaded", function () {
             });
     }
 
-    // Atualizar dashboard a cada 30 segundos
+    // --- Atualização por eventos ---
+    // Em vez de recarregar a cada 30 segundos, a página recarrega apenas a seção ativa
+    // quando chega um evento que a afeta (ver eventos.js).
+    const sectionsByCollection = {
+        orders: ["dashboard", "ordens", "producao", "financeiro"],
+        compras: ["compras"],
+        contas_pagar: ["contas_pagar", "financeiro"],
+        financial: ["financeiro", "balancete"],
+        balancete: ["balancete"]
+    };
+    let pendingReload = null;
+    let pendingKpis = false;
+
+    function scheduleSectionReload(sectionIds, kpis) {
+        const activeSection = document.querySelector(".dashboard-section.active-section");
+        const sectionId = activeSection ? activeSection.id.replace("Section", "") : null;
+        pendingKpis = pendingKpis || kpis;
+        if (!pendingKpis && !(sectionId && sectionIds.includes(sectionId))) return;
+
+        clearTimeout(pendingReload);
+        pendingReload = setTimeout(() => {
+            if (pendingKpis) updateDashboard();
+            pendingKpis = false;
+            const current = document.querySelector(".dashboard-section.active-section");
+            const currentId = current ? current.id.replace("Section", "") : null;
+            if (currentId && sectionIds.includes(currentId)) showSection(currentId);
+        }, 300);
+    }
+
     $(document).ready(function() {
         updateDashboard();
-        setInterval(updateDashboard, 30000);
+
+        if (window.CuboEventos) {
+            CuboEventos.on(["ordem_criada", "ordens_criadas", "ordem_atualizada", "mes_encerrado"], () => {
+                scheduleSectionReload(sectionsByCollection.orders, true);
+            });
+            CuboEventos.on(["conta_paga", "contas_pagas", "saldo_atualizado"], () => {
+                scheduleSectionReload(["contas_pagar", "financeiro", "balancete"], false);
+            });
+            CuboEventos.on("colecao_alterada", dados => {
+                scheduleSectionReload(sectionsByCollection[dados.colecao] || [], dados.colecao === "orders");
+            });
+            CuboEventos.on("recarregar", () => {
+                scheduleSectionReload(Object.keys(sectionsByCollection).reduce(
+                    (ids, name) => ids.concat(sectionsByCollection[name]), []), true);
+            });
+        }
 
         // Resto do código existente...
     });
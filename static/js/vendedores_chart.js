@@ -7,39 +7,17 @@ document.addEventListener('DOMContentLoaded', function() {
     // Função para carregar dados e criar o gráfico
     async function loadVendedoresChart() {
         try {
-            // Buscar dados das ordens
-            const response = await fetch('/api/orders');
+            // Buscar os 8 vendedores com mais vendas (sem ordens canceladas), já agregados pelo servidor
+            const response = await fetch('/api/analytics/vendedores?limite=8&excluir_status=Cancelada');
             if (!response.ok) {
-                throw new Error('Erro ao buscar dados das ordens');
+                throw new Error('Erro ao buscar dados dos vendedores');
             }
             
-            const orders = await response.json();
+            const resultado = await response.json();
+            const totalVendas = resultado.total.valor_total;
             
-            // Processar dados para o gráfico
-            const vendedoresCount = {};
-            let totalVendas = 0;
-            
-            orders.forEach(order => {
-                if (!order.vendedor || order.status === 'Cancelada') return;
-                
-                const vendedor = order.vendedor.trim();
-                const valorTotal = parseFloat(order.valor_total || 0);
-                
-                if (!vendedoresCount[vendedor]) {
-                    vendedoresCount[vendedor] = 0;
-                }
-                
-                vendedoresCount[vendedor] += valorTotal;
-                totalVendas += valorTotal;
-            });
-            
-            // Ordenar vendedores por valor total (do maior para o menor)
-            const sortedVendedores = Object.entries(vendedoresCount)
-                .sort((a, b) => b[1] - a[1])
-                .slice(0, 8); // Limitar aos 8 vendedores com mais vendas
-            
-            const labels = sortedVendedores.map(item => item[0]);
-            const data = sortedVendedores.map(item => item[1]);
+            const labels = resultado.itens.map(item => item.nome);
+            const data = resultado.itens.map(item => item.valor_total);
             
             // Cores para o gráfico
             const backgroundColors = [